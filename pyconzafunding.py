@@ -2,33 +2,78 @@
 
 from __future__ import print_function, unicode_literals, absolute_import, division
 
+import abc
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import email.message
 import functools
-
-from sqlalchemy.orm import relationship
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import Column, Integer, UnicodeText, Boolean, Numeric
-
-from reahl.web.fw import UserInterface, Widget, CannotCreate, UrlBoundView, Detour, ViewPreCondition, Url
-
-from reahl.domain.systemaccountmodel import AccountManagementInterface, EmailAndPasswordSystemAccount, NoSuchAccountException
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import operator
+import os
+import random
+import re
+import smtplib
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import urllib.parse
+
+from webob import Request, Response
+from webob.exc import HTTPForbidden
+
+from sqlalchemy.orm import relationship, load_only
+from sqlalchemy.orm.session import Session as OrmSession
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DatabaseError, IntegrityError
+from sqlalchemy import Column, Integer, UnicodeText, Boolean, Numeric, DateTime, Index, case, func, select, text, true, false, and_, or_, not_, tuple_
+from alembic import op
+
+from reahl.web.fw import UserInterface, Widget, CannotCreate, UrlBoundView, Detour, ViewPreCondition, Url, Bookmark, RemoteMethod, MethodResult, \
+    ReahlWSGIApplication
+
+from reahl.domain.systemaccountmodel import AccountManagementInterface, EmailAndPasswordSystemAccount
 
 from reahl.web.layout import PageLayout
-from reahl.web.bootstrap.ui import HTML5Page, TextNode, Div, H, P, A
+from reahl.web.bootstrap.ui import HTML5Page, TextNode, Div, H, P, A, Alert
 from reahl.web.bootstrap.navbar import Navbar, ResponsiveLayout
 from reahl.web.bootstrap.navs import Nav, TabLayout
 from reahl.web.bootstrap.grid import Container, ColumnLayout, ColumnOptions, ResponsiveSize
 from reahl.web.bootstrap.tables import Table, TableLayout
-from reahl.web.ui import StaticColumn, DynamicColumn
+from reahl.web.ui import StaticColumn, DynamicColumn, HTMLElement, PrimitiveInput, HTMLInputElement
 from reahl.web.bootstrap.forms import TextInput, TextArea, Form, FormLayout, Button, ButtonLayout, FieldSet, CheckboxInput
-from reahl.component.modelinterface import exposed, Field, EmailField, Action, Event, IntegerField, BooleanField
+from reahl.component.modelinterface import exposed, Field, EmailField, Action, Event, IntegerField, BooleanField, ValidationConstraint
 
 from reahl.sqlalchemysupport import Session, Base, ForeignKey
 
+from reahl.component.config import Configuration, ConfigSetting, ConfigurationException
+from reahl.component.context import ExecutionContext
+from reahl.component.exceptions import DomainException
+from reahl.commands.prodshell import ProductionCommand
+from reahl.component.migration import Migration
+
 from reahl.domain.systemaccountmodel import LoginSession
 from reahl.domainui.bootstrap.accounts import AccountUI
 
 
 african_countries = [
+    'Algeria',
     'Angola',
     'Benin', 
     'Botswana', 
@@ -76,8 +121,7 @@ african_countries = [
     'South Africa',
     'South Sudan',
     'Sudan',
-    'Swaziland', 
-    'Swaziland', 
+    'Eswatini',
     'Tanzania', 
     'Togo',
     'Tunisia',
@@ -86,6 +130,28 @@ african_countries = [
     'Zimbabwe'
         ]
 
+other_countries = [
+    'Australia', 'Bangladesh', 'Brazil', 'Canada', 'China', 'France', 'Germany', 'India', 'Ireland', 'Italy',
+    'Japan', 'Netherlands', 'New Zealand', 'Pakistan', 'Portugal', 'Spain', 'Sweden', 'Switzerland',
+    'United Kingdom', 'United States'
+        ]
+
+country_aliases = {
+    'Eswatini': ['Swaziland', 'Kingdom of Eswatini'],
+    'South Africa': ['RSA', 'SA', 'ZA', 'Republic of South Africa', 'Suid-Afrika', 'Mzansi'],
+    'The Republic of Cabo Verde': ['Cabo Verde', 'Cape Verde'],
+    'The Central African Republic': ['Central African Republic', 'CAR'],
+    'Democratic Republic of Congo': ['DRC', 'DR Congo', 'Democratic Republic of the Congo', 'Congo-Kinshasa'],
+    'Republic of Congo': ['Congo', 'Republic of the Congo', 'Congo-Brazzaville'],
+    'Cote d’Ivoire': ['Ivory Coast'],
+    'Republic Arab Saharawi Democratic': ['Western Sahara', 'Sahrawi Arab Democratic Republic'],
+    'Tanzania': ['United Republic of Tanzania'],
+    'Egypt': ['Arab Republic of Egypt'],
+    'United Kingdom': ['UK', 'Great Britain', 'Britain', 'England', 'Scotland', 'Wales'],
+    'United States': ['USA', 'US', 'United States of America', 'America'],
+    'Netherlands': ['Holland']
+    }
+
 class LogoutForm(Form):
     def __init__(self, view):
         super(LogoutForm, self).__init__(view, 'logout')
@@ -117,16 +183,27 @@ class FundingRequestPage(HTML5Page):
 
 class EditView(UrlBoundView):
     def assemble(self, funding_request_id=None):
-        try:
-            #TODO: only filter/guard for logged in user/super user
-            funding_request = Session.query(FundingRequest).filter_by(id=funding_request_id).one()
-        except NoResultFound:
+        #TODO: only filter/guard for logged in user/super user
+        found = FundingRequest.find_requests(id=funding_request_id)
+        if not found:
             raise CannotCreate()
+        funding_request = found[0]
 
         self.title = 'Edit Financial Aid Application for %s' % funding_request.name
         self.set_slot('main', EditFundingRequestForm.factory(funding_request))
 
 
+class HistoryView(UrlBoundView):
+    def assemble(self, funding_request_id=None):
+        found = FundingRequest.find_requests(id=funding_request_id)
+        if not found:
+            raise CannotCreate()
+        funding_request = found[0]
+
+        self.title = 'History of the application of %s %s' % (funding_request.name, funding_request.surname)
+        self.set_slot('main', ChangeTimeline.factory(funding_request))
+
+
 class MyCheckboxInput(CheckboxInput):
 
     def get_value_from_input(self, input_values):
@@ -136,10 +213,23 @@ class MyCheckboxInput(CheckboxInput):
             return input_values.get(self.name, self.bound_field.false_value) #TODO: this fixes a bug - see test_marshalling_of_checkbox_select_input, and add a similar test using a BooleanField
 
 
+class VersionInput(PrimitiveInput):
+    """A hidden input for the version of what a form shows. It always renders the current version: input
+    restored from an earlier (refused) submit would otherwise bring back the version seen back then."""
+    def prepare_input(self):
+        self.bound_field.clear_user_input()
+
+    def create_html_widget(self):
+        return HTMLInputElement(self, 'hidden')
+
+
 class FundingRequestForm(Form):
     def __init__(self, view, unique_id, funding_request, submit_event):
         super(FundingRequestForm, self).__init__(view, unique_id)
 
+        if self.exception:
+            self.add_child(Alert(view, self.exception.as_user_message(), 'warning'))
+
         personal_info = self.add_child(FieldSet(view, legend_text='Personal information'))
         personal_info.use_layout(FormLayout())
         personal_info.layout.add_input(TextInput(self, funding_request.fields.name))
@@ -178,6 +268,8 @@ class FundingRequestForm(Form):
         admin_inputs.layout.add_input(TextInput(self, funding_request.fields.number_keynote_talks))
 
         
+        self.add_child(VersionInput(self, funding_request.fields.seen_version))
+
         button = self.add_child(Button(self, submit_event))
         button.use_layout(ButtonLayout(style='primary'))
 
@@ -193,131 +285,995 @@ class NewFundingRequestForm(FundingRequestForm):
 
 
 
-class AllFundRequestsPanel(Widget):
+class KeysetPage(object):
+    """The ids of one page of FundingRequests, sorted on `sort_column` and found in the database.
+
+    Instead of an OFFSET, a page starts right after the (sort value, id) key of the last row of the
+    previous page (given as `after`). Rows are ordered and sought on the same expression as one of
+    the `funding_request_sort_indexes`, so each page is a range scan of that index no matter how
+    deep it is.
+    """
+    def __init__(self, sort_column, descending, page_size, after):
+        self.is_numeric = isinstance(FundingRequest.__table__.columns[sort_column].type, Integer)
+        self.sort_expression = FundingRequest.get_sort_expression(sort_column)
+        self.descending = descending
+        if descending:
+            self.order_by = [self.sort_expression.desc(), FundingRequest.id.desc()]
+        else:
+            self.order_by = [self.sort_expression, FundingRequest.id]
+
+        query = Session.query(self.sort_expression, FundingRequest.id)
+        if after:
+            query = query.filter(self.seek_condition(*self.decode_key(after)))
+        keys = query.order_by(*self.order_by).limit(page_size+1).all()
+
+        self.has_next = len(keys) > page_size
+        keys = keys[:page_size]
+        self.ids = [funding_request_id for value, funding_request_id in keys]
+        self.next_after = self.encode_key(*keys[-1]) if self.has_next else None
+
+    def seek_condition(self, value, funding_request_id):
+        key = tuple_(self.sort_expression, FundingRequest.id)
+        if self.descending:
+            return key < tuple_(value, funding_request_id)
+        else:
+            return key > tuple_(value, funding_request_id)
+
+    def encode_key(self, value, funding_request_id):
+        return '%s,%s' % (value, funding_request_id)
+
+    def decode_key(self, after):
+        value, _, funding_request_id = after.rpartition(',')
+        return (int(value) if self.is_numeric else value), int(funding_request_id)
+
+    def restrict(self, query):
+        """Limits `query` (on FundingRequest) to the rows of this page, in page order."""
+        if not self.ids:
+            return query.filter(false())
+        return query.filter(FundingRequest.id.in_(self.ids)).order_by(*self.order_by)
+
+
+class RenderedFragmentCache(object):
+    """A bounded cache of rendered HTML that evicts the least recently used entries first.
+
+    Keys should include whatever version of the data the HTML was rendered from, so that
+    out of date entries are never asked for again. They age out, and are all dropped when this
+    process commits a change to FundingRequests (see FundingRequest.bump_version).
+    """
+    def __init__(self, max_size=200):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.pop(key, None)
+            if html is not None:
+                self.entries[key] = html
+            return html
+
+    def put(self, key, html):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = html
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+rendered_fragments = RenderedFragmentCache()
+
+
+class RenderedFragment(Widget):
+    """Outputs HTML that was rendered (and cached) earlier."""
+    def __init__(self, view, html):
+        super(RenderedFragment, self).__init__(view)
+        self.html = html
+
+    def render(self):
+        return self.html
+
+
+class RequestRecord(object):
+    """What happened while handling one request for the view at `path`: its latency (up to when all of the
+    response was sent), SQL statements and widget construction times."""
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.seconds = None
+        self.status = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = collections.Counter()
+        self.widget_seconds = collections.Counter()
+
+    def repeated_statements(self, threshold):
+        return [(statement, count) for statement, count in self.statements.items() if count >= threshold]
+
+
+class RequestMetrics(object):
+    """Keeps a RequestRecord of each of the last `size` requests in a ring buffer, and aggregates them.
+
+    SQL statements are counted from SQLAlchemy events on every Engine. A statement (ignoring
+    its parameters) that runs `repeat_threshold` or more times in one request is reported as a
+    likely N+1 pattern, such as a lazy load per row.
+    """
+    repeat_threshold = 5
+
+    def __init__(self, size=1000):
+        self.records = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.installed = False
+
+    def install(self):
+        with self.lock:
+            if not self.installed:
+                event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+                self.installed = True
+
+    @property
+    def current(self):
+        return getattr(self.local, 'record', None)
+
+    def start(self, path):
+        self.local.record = RequestRecord(path)
+
+    def finish(self, status):
+        record = self.current
+        self.local.record = None
+        if record:
+            record.seconds = time.time()-record.started
+            record.status = status
+            if status == 404:
+                record.path = '(not found)'  # So that made up URLs do not each get metrics of their own
+            with self.lock:
+                self.records.append(record)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current:
+            conn.info.setdefault('pyconza_statement_started', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = self.current
+        started_times = conn.info.get('pyconza_statement_started')
+        if record and started_times:
+            record.sql_count += 1
+            record.sql_seconds += time.time()-started_times.pop()
+            record.statements[statement] += 1
+
+    @contextlib.contextmanager
+    def timing(self, widget_name):
+        started = time.time()
+        try:
+            yield
+        finally:
+            record = self.current
+            if record:
+                record.widget_seconds[widget_name] += time.time()-started
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
+
+    def aggregate(self):
+        """Returns a PathMetrics for each path in the buffer, and the most often repeated statements."""
+        by_path = collections.OrderedDict()
+        repeated = collections.Counter()
+        for record in self.get_records():
+            by_path.setdefault(record.path, []).append(record)
+            for statement, count in record.repeated_statements(self.repeat_threshold):
+                repeated[statement] += count
+        return [PathMetrics(path, records, self.repeat_threshold) for path, records in sorted(by_path.items())], repeated.most_common(10)
+
+    @classmethod
+    def escape_label_value(cls, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def as_prometheus_text(self):
+        path_metrics, repeated = self.aggregate()
+        lines = ['# HELP pyconza_request_seconds Latency of requests in the metrics window.',
+                 '# TYPE pyconza_request_seconds summary']
+        for metrics in path_metrics:
+            view = self.escape_label_value(metrics.path)
+            for quantile, value in [('0.5', metrics.p50), ('0.95', metrics.p95), ('1', metrics.max)]:
+                lines.append('pyconza_request_seconds{view="%s",quantile="%s"} %f' % (view, quantile, value))
+            lines.append('pyconza_request_seconds_count{view="%s"} %d' % (view, metrics.count))
+            lines.append('pyconza_request_seconds_sum{view="%s"} %f' % (view, metrics.total_seconds))
+        for name, help_text, attribute in [('pyconza_sql_statements', 'SQL statements executed', 'sql_count'),
+                                           ('pyconza_sql_seconds', 'Time spent executing SQL', 'sql_seconds'),
+                                           ('pyconza_repeated_statement_requests', 'Requests with likely N+1 queries', 'repeated_count'),
+                                           ('pyconza_widget_seconds', 'Time spent constructing widgets', 'widget_seconds')]:
+            lines.append('# HELP %s %s, in the metrics window.' % (name, help_text))
+            lines.append('# TYPE %s gauge' % name)
+            for metrics in path_metrics:
+                lines.append('%s{view="%s"} %s' % (name, self.escape_label_value(metrics.path), getattr(metrics, attribute)))
+        return '\n'.join(lines)+'\n'
+
+
+class PathMetrics(object):
+    """Aggregates of the RequestRecords of one path."""
+    def __init__(self, path, records, repeat_threshold):
+        seconds = sorted(record.seconds for record in records)
+        self.path = path
+        self.count = len(records)
+        self.total_seconds = sum(seconds)
+        self.p50 = seconds[int(0.5*(len(seconds)-1))]
+        self.p95 = seconds[int(0.95*(len(seconds)-1))]
+        self.max = seconds[-1]
+        self.sql_count = sum(record.sql_count for record in records)
+        self.sql_seconds = sum(record.sql_seconds for record in records)
+        self.average_sql_count = self.sql_count/self.count
+        self.repeated_count = len([record for record in records if record.repeated_statements(repeat_threshold)])
+        self.widget_seconds = sum(sum(record.widget_seconds.values()) for record in records)
+        self.error_count = len([record for record in records if record.status and record.status >= 500])
+
+
+request_metrics = RequestMetrics()
+
+
+def timed_construction(init):
+    """Decorates the __init__ of a Widget to record how long it takes in the current RequestRecord."""
+    @functools.wraps(init)
+    def timed_init(self, *args, **kwargs):
+        with request_metrics.timing(self.__class__.__name__):
+            init(self, *args, **kwargs)
+    return timed_init
+
+
+class MetricsMiddleware(object):
+    """WSGI middleware that records each request in `request_metrics`. It is the outermost middleware
+    of make_wsgi_application.
+
+    Requests are recorded per view: by the first segment of their path, so that eg /edit/12 and
+    /edit/13 are both recorded as /edit. A request is finished when the server closes its response,
+    after sending all of it, so that the time (and SQL) of streaming a body such as an export counts.
+    """
+    def __init__(self, application, metrics=None):
+        self.application = application
+        self.metrics = metrics or request_metrics
+        self.metrics.install()
+
+    @classmethod
+    def get_view_path(cls, path):
+        return '/%s' % path.lstrip('/').split('/', 1)[0]
+
+    def __call__(self, environ, start_response):
+        status = []
+        def recording_start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split(' ', 1)[0]))
+            return start_response(status_line, headers, exc_info) if exc_info else start_response(status_line, headers)
+
+        self.metrics.start(self.get_view_path(environ.get('PATH_INFO', '/')))
+        try:
+            result = self.application(environ, recording_start_response)
+        except Exception:
+            self.metrics.finish(500)
+            raise
+        return RecordedResponse(result, lambda: self.metrics.finish(status[0] if status else None))
+
+
+class RecordedResponse(object):
+    """The response iterable of an application, calling `finish` once the server closes it (as WSGI requires)."""
+    def __init__(self, result, finish):
+        self.result = result
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.finish()
+
+
+class TextResult(MethodResult):
+    def render(self, return_value):
+        return return_value
+
+
+class MetricsPanel(Widget):
     def __init__(self, view):
-        super(AllFundRequestsPanel, self).__init__(view)
+        super(MetricsPanel, self).__init__(view)
+        if not request_metrics.installed:
+            self.add_child(P(view, text='No requests are being recorded: serve the application with make_wsgi_application '
+                                        '(which installs MetricsMiddleware) to see metrics here.'))
+            return
+
+        prometheus = RemoteMethod('prometheus', request_metrics.as_prometheus_text,
+                                  TextResult(content_type='text/plain', charset='utf-8'), immutable=True)
+        view.add_resource(prometheus)
+        self.add_child(P(view)).add_child(A(view, prometheus.get_url(), description='Prometheus format'))
+
+        path_metrics, repeated = request_metrics.aggregate()
+
+        def make_seconds_value(attribute_name, view, metrics):
+            return TextNode(view, '%.3f' % getattr(metrics, attribute_name))
+
+        columns = [StaticColumn(Field(label='View'), 'path'),
+                   StaticColumn(IntegerField(label='Requests'), 'count'),
+                   DynamicColumn('Median (s)', functools.partial(make_seconds_value, 'p50')),
+                   DynamicColumn('95th percentile (s)', functools.partial(make_seconds_value, 'p95')),
+                   DynamicColumn('Slowest (s)', functools.partial(make_seconds_value, 'max')),
+                   DynamicColumn('SQL per request', functools.partial(make_seconds_value, 'average_sql_count')),
+                   DynamicColumn('SQL time (s)', functools.partial(make_seconds_value, 'sql_seconds')),
+                   DynamicColumn('Widget time (s)', functools.partial(make_seconds_value, 'widget_seconds')),
+                   StaticColumn(IntegerField(label='Requests with repeated SQL'), 'repeated_count'),
+                   StaticColumn(IntegerField(label='Errors'), 'error_count')]
+        table = self.add_child(Table(view, caption_text='Requests (last %s)' % request_metrics.records.maxlen))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, path_metrics)
+
+        self.add_child(H(view, 2, 'Most repeated statements'))
+        for statement, count in repeated:
+            self.add_child(P(view, text='%s times: %s' % (count, statement)))
+
+
+class RequestLogin(object):
+    """Who is logged in with the Reahl session cookie of a `request`, for middleware that answers without
+    calling the application: the id of the account (None if nobody is logged in) and whether it is the super user.
+
+    It is read with one query over `connection`, the way LoginSession.is_logged_in sees it: only while the
+    UserSession of the cookie is active.
+    """
+    def __init__(self, account_id, is_super_user):
+        self.account_id = account_id
+        self.is_super_user = is_super_user
+
+    @classmethod
+    def nobody(cls):
+        return cls(None, False)
+
+    @classmethod
+    def from_request(cls, request, connection, web_config):
+        key = urllib.parse.unquote(request.cookies.get(web_config.session_key_name, ''))
+        try:
+            user_session_id, salt = key.split(':')
+            user_session_id = int(user_session_id)
+        except ValueError:
+            return cls.nobody()
+
+        user_sessions = web_config.session_class.__table__
+        login_sessions = LoginSession.__table__
+        accounts = EmailAndPasswordSystemAccount.__table__
+        tables = user_sessions.join(login_sessions, login_sessions.c.user_session_id == user_sessions.c.id).\
+                               join(accounts, accounts.c.id == login_sessions.c.account_id)
+        row = connection.execute(select([user_sessions.c.last_activity, user_sessions.c.idle_lifetime, accounts.c.id, accounts.c.email]).
+                                 select_from(tables).
+                                 where(and_(user_sessions.c.id == user_session_id, user_sessions.c.salt == salt))).first()
+        if not row:
+            return cls.nobody()
+        last_activity, idle_lifetime, account_id, email = row
+        if last_activity+datetime.timedelta(seconds=idle_lifetime) <= datetime.datetime.now():
+            return cls.nobody()
+        return cls(account_id, email == CurrentUserSession.super_user_email_address)
+
+
+class ExportSigner(object):
+    """Makes and checks the signed URLs of the downloads that ExportMiddleware serves.
+
+    A URL names the export and what is in it, and is valid until `lifetime` after it was made. The
+    key is configured, so that every process serving the application accepts the URLs of the others.
+    """
+    path_prefix = '/export/'
+    lifetime = datetime.timedelta(hours=1)
+
+    def __init__(self, key):
+        self.key = key
+
+    @classmethod
+    def for_config(cls, config):
+        if not config.export_signing_key:
+            raise ConfigurationException('%s.export_signing_key is not set: set it to a long random secret, '
+                                         'the same for all processes serving the application' % config.config_key)
+        return cls(config.export_signing_key.encode('utf-8'))
+
+    def get_signature(self, path, parts, expires):
+        message = '%s|%s|%s' % (path, ','.join(parts), expires)
+        return hmac.new(self.key, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get_url(self, name, parts, export_format):
+        path = '%s%s.%s' % (self.path_prefix, name, export_format)
+        expires = int(time.time()+self.lifetime.total_seconds())
+        query = urllib.parse.urlencode([('parts', ','.join(parts)), ('expires', expires),
+                                        ('signature', self.get_signature(path, parts, expires))])
+        return '%s?%s' % (path, query)
+
+    def is_valid(self, path, parts, expires, signature):
+        try:
+            expires = int(expires)
+        except ValueError:
+            return False
+        return expires > time.time() and hmac.compare_digest(self.get_signature(path, parts, expires), signature)
+
+
+class ExportMiddleware(object):
+    """WSGI middleware that serves the downloads linked to by ExportLinks, without going through the UI.
+
+    A download needs both a validly signed URL and a login as the super user (see RequestLogin). An
+    export is streamed from a connection of its own, a chunk of rows at a time, so no page is built
+    for it and it is never held in full (nor kept in a Session that ends with the request).
+    """
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+    installed = False
+
+    def __init__(self, application, engine, signer, web_config):
+        self.application = application
+        self.engine = engine
+        self.signer = signer
+        self.web_config = web_config
+        ExportMiddleware.installed = True
+
+    def is_logged_in_as_super_user(self, request):
+        connection = self.engine.connect()
+        try:
+            return RequestLogin.from_request(request, connection, self.web_config).is_super_user
+        finally:
+            connection.close()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.signer.path_prefix):
+            return self.application(environ, start_response)
+
+        request = Request(environ)
+        export_format = path.rpartition('.')[2]
+        parts = [part for part in request.GET.get('parts', '').split(',') if part]
+        if request.method != 'GET' or export_format not in FundingExport.formats or \
+           not self.signer.is_valid(path, parts, request.GET.get('expires', ''), request.GET.get('signature', '')) or \
+           not self.is_logged_in_as_super_user(request):
+            return HTTPForbidden()(environ, start_response)
+
+        response = Response(content_type=self.content_types[export_format], charset='utf-8',
+                            app_iter=self.generate(export_format, parts))
+        response.content_disposition = 'attachment; filename=%s' % path[len(self.signer.path_prefix):]
+        return response(environ, start_response)
+
+    def generate(self, export_format, parts):
+        connection = self.engine.connect()
+        try:
+            export = FundingExport(parts=parts, rule_set=ScoringRuleSet.read(connection))
+            for chunk in export.generate(export_format, connection=connection):
+                yield chunk.encode('utf-8')
+        finally:
+            connection.close()
+
+
+class ConditionalGetMiddleware(object):
+    """WSGI middleware that answers 304 Not Modified to a GET of one of the `paths` when the browser
+    already has that page as it is for the current data, without calling the application at all.
+
+    The pages are only for the super user, so only a request logged in as the super user (see
+    RequestLogin) is answered here; any other is left to the application, which checks access. The
+    ETag is worked out before calling the application, from the URL, the account logged in and the
+    DatasetVersions the pages are rendered from, read with small queries over a connection of its
+    own. It also changes every `max_age`, so that the signed export links on the pages are renewed
+    well before they expire.
+    """
+    paths = ['/requests', '/scores', '/results', '/allocation']
+    max_age = ExportSigner.lifetime/2
+
+    def __init__(self, application, engine, web_config):
+        self.application = application
+        self.engine = engine
+        self.web_config = web_config
+
+    def get_login_and_versions(self, request):
+        table = DatasetVersion.__table__
+        connection = self.engine.connect()
+        try:
+            login = RequestLogin.from_request(request, connection, self.web_config)
+            return login, sorted(connection.execute(select([table.c.name, table.c.version])).fetchall())
+        finally:
+            connection.close()
+
+    def get_etag(self, request, login, versions):
+        period = int(time.time()//self.max_age.total_seconds())
+        key = '%s|%s|%s|%s' % (request.path_qs, login.account_id, versions, period)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if request.method != 'GET' or request.path_info not in self.paths:
+            return self.application(environ, start_response)
+        login, versions = self.get_login_and_versions(request)
+        if not login.is_super_user:
+            return self.application(environ, start_response)
+        etag = self.get_etag(request, login, versions)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = request.get_response(self.application)
+            if response.status_int != 200:
+                return response(environ, start_response)
+        response.etag = etag
+        response.cache_control = 'private, no-cache'
+        return response(environ, start_response)
+
+
+class ExportLinks(Widget):
+    """Download links for a FundingExport of `parts`, one per export format, served by ExportMiddleware
+    (and so only shown where it is installed)."""
+    def __init__(self, view, name, parts):
+        super(ExportLinks, self).__init__(view)
+        if not ExportMiddleware.installed:
+            return
+        signer = ExportSigner.for_config(FundingConfig.get_current())
+        paragraph = self.add_child(P(view, text='Download all: '))
+        for export_format in FundingExport.formats:
+            paragraph.add_child(A(view, Url(signer.get_url(name, parts, export_format)), description=export_format.upper()))
+
+
+def make_wsgi_application(config_directory):
+    """The WSGI application to deploy: the Reahl application, with the middleware of this module around it.
+
+    Use it in a WSGI script, eg::
+
+        from pyconzafunding import make_wsgi_application
+        application = make_wsgi_application('/etc/pyconzafunding')
+    """
+    application = ReahlWSGIApplication.from_directory(config_directory)
+    application.start()
+    config = application.config
+    engine = create_engine(config.reahlsystem.connection_uri)
+    application = ConditionalGetMiddleware(application, engine, config.web)
+    application = ExportMiddleware(application, engine, ExportSigner.for_config(config.pyconzafunding), config.web)
+    return MetricsMiddleware(application)
+
+
+class PagedFundingRequestPanel(Div):
+    """Superclass for admin tables that show FundingRequests a page at a time.
+
+    The column to sort on, the sort order, page size and where the page starts are all taken
+    from the URL; sorting and paging happen in the database.
+    """
+    sortable_columns = [('id', 'Date received'), ('name', 'Name'), ('surname', 'Surname')]
+    default_page_size = 50
+    max_page_size = 500
+    caption_text = None
+    export_parts = ('columns', 'criteria', 'amounts')
+
+    @timed_construction
+    def __init__(self, view, css_id):
+        super(PagedFundingRequestPanel, self).__init__(view, css_id=css_id)
+
+        sort_columns = [name for name, label in self.sortable_columns]
+        sort_column = self.sort if self.sort in sort_columns else sort_columns[0]
+        page_size = min(max(self.page_size or self.default_page_size, 1), self.max_page_size)
+
+        self.add_child(ExportLinks(view, css_id, self.export_parts))
+
+        cache_key = (self.__class__.__name__, sort_column, self.order, page_size, self.after,
+                     DatasetVersion.current(FundingRequest.__tablename__))
+        html = rendered_fragments.get(cache_key)
+        if html is None:
+            html = self.create_contents(sort_column, page_size).render()
+            rendered_fragments.put(cache_key, html)
+        self.add_child(RenderedFragment(view, html))
+
+    def create_contents(self, sort_column, page_size):
+        try:
+            page = KeysetPage(sort_column, self.order == 'desc', page_size, self.after)
+        except ValueError:
+            page = KeysetPage(sort_column, self.order == 'desc', page_size, '')
 
-        funding_requests = FundingRequest.find_requests()
+        contents = Widget(self.view)
+        contents.add_child(Nav(self.view).with_bookmarks(self.get_sort_bookmarks(sort_column, page_size)))
 
+        table = contents.add_child(Table(self.view, caption_text=self.caption_text))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(self.make_columns(), self.get_rows(page))
+
+        page_bookmarks = []
+        if self.after:
+            page_bookmarks.append(self.get_bookmark('First page', sort_column, self.order, page_size, ''))
+        if page.has_next:
+            page_bookmarks.append(self.get_bookmark('Next page', sort_column, self.order, page_size, page.next_after))
+        contents.add_child(Nav(self.view).with_bookmarks(page_bookmarks))
+        return contents
+
+    @exposed
+    def query_fields(self, fields):
+        fields.sort = Field(required=False, default='')
+        fields.order = Field(required=False, default='asc')
+        fields.page_size = IntegerField(required=False, default=self.default_page_size)
+        fields.after = Field(required=False, default='')
+
+    def get_bookmark(self, description, sort_column, order, page_size, after):
+        query_arguments = {'sort': sort_column, 'order': order, 'page_size': str(page_size), 'after': after}
+        return Bookmark.for_widget(description, query_arguments=query_arguments).on_view(self.view)
+
+    def get_sort_bookmarks(self, current_sort_column, page_size):
+        bookmarks = []
+        for name, label in self.sortable_columns:
+            if name == current_sort_column:
+                order = 'desc' if self.order != 'desc' else 'asc'
+                label = '%s %s' % (label, '▲' if self.order != 'desc' else '▼')
+            else:
+                order = 'asc'
+            bookmarks.append(self.get_bookmark(label, name, order, page_size, ''))
+        return bookmarks
+
+    def make_columns(self):
+        schema = FundingRequestSchema.get()
+        return [StaticColumn(schema.get_column_field(name), name) for name in ['name', 'surname']]
+
+    def get_rows(self, page):
+        return page.restrict(Session.query(FundingRequest)).all()
+
+
+class AllFundRequestsPanel(PagedFundingRequestPanel):
+    sortable_columns = [('id', 'Date received'), ('name', 'Name'), ('surname', 'Surname'),
+                        ('email_address', 'Email'), ('resident_country', 'Country of residence'),
+                        ('grant_status', 'Application status'), ('amount_requested', 'Aid amount requested')]
+    caption_text = 'Financial Aid Applications'
+
+    def __init__(self, view):
+        super(AllFundRequestsPanel, self).__init__(view, 'all_requests')
+
+    def make_columns(self):
         def make_edit_link(view, funding_request):
-            form = Form(view, 'edit_%s' % funding_request.id)
-            form.add_child(Button(form, funding_request.events.edit.with_arguments(funding_request_id=funding_request.id)))
-            return form
+            return A.from_bookmark(view, view.user_interface.get_edit_bookmark(funding_request))
 
-        columns = [StaticColumn(field.unbound_copy(), field.name) for field in FundingRequest().fields.values()]
-        columns.append(DynamicColumn('', make_edit_link))
+        def make_history_link(view, funding_request):
+            return A.from_bookmark(view, view.user_interface.get_history_bookmark(funding_request))
 
-        table = self.add_child(Table(view, caption_text='Financial Aid Applications'))
-        table.use_layout(TableLayout(responsive=True,striped=True))
-        table.with_data(columns, funding_requests)
+        schema = FundingRequestSchema.get()
+        columns = [StaticColumn(schema.get_column_field(name), name) for name in schema.column_fields]
+        columns.append(DynamicColumn('', make_edit_link))
+        columns.append(DynamicColumn('', make_history_link))
+        return columns
 
         
-class ScoringDataPanel(Widget):
+class ScoringDataPanel(PagedFundingRequestPanel):
+    sortable_columns = [('id', 'Date received'), ('name', 'Name'), ('surname', 'Surname'), ('score_total', 'Score')]
+    caption_text = 'Financial Aid Applications'
+    export_parts = ('criteria',)
+
     def __init__(self, view):
-        super(ScoringDataPanel, self).__init__(view)
-
-        class Row(object):
-            def __init__(self, request):
-                self.request = request
-                self.criteria = {i.label:i for i in self.request.get_criteria()}
-
-            def does_criterion_apply(self, criterion):
-                return self.criteria[criterion.label].applies
-            def value_for(self, criterion):
-                return self.criteria[criterion.label].score
-
-            @property
-            def score_total(self):
-                return self.request.score_total
-            @property
-            def name(self):
-                return self.request.name
-            @property
-            def surname(self):
-                return self.request.surname
-            
+        super(ScoringDataPanel, self).__init__(view, 'scores')
 
-        def make_column_value(criterion, view, row):
-            return TextNode(view, ('yes' if row.does_criterion_apply(criterion) else 'no'))
+    def make_columns(self):
+        def make_column_value(index, view, row):
+            return TextNode(view, ('yes' if row.criteria_apply[index] else 'no'))
 
-        def make_score_column_value(criterion, view, row):
-            return TextNode(view, str(row.value_for(criterion)))
+        def make_score_column_value(index, view, row):
+            return TextNode(view, str(row.criterion_scores[index]))
 
-        columns = []
-        columns.append(StaticColumn(IntegerField(label='Name'), 'name'))
-        columns.append(StaticColumn(IntegerField(label='Surname'), 'surname'))
-        for i in FundingRequest().get_criteria():
-            columns.append(DynamicColumn(i.label, functools.partial(make_column_value, i)))
-            columns.append(DynamicColumn('#', functools.partial(make_score_column_value, i)))
+        columns = super(ScoringDataPanel, self).make_columns()
+        for index, rule in enumerate(ScoringRuleSet.current().criterion_rules):
+            columns.append(DynamicColumn(rule.label, functools.partial(make_column_value, index)))
+            columns.append(DynamicColumn('#', functools.partial(make_score_column_value, index)))
         columns.append(StaticColumn(IntegerField(label='Total'), 'score_total'))
-            
-        rows = [Row(i) for i in FundingRequest.find_requests()]
-        table = self.add_child(Table(view, caption_text='Financial Aid Applications'))
-        table.use_layout(TableLayout(responsive=True,striped=True))
-        table.with_data(columns, rows)
+        return columns
+
+    def get_rows(self, page):
+        return list(FundingRequest.score_requests(page.restrict(Session.query(FundingRequest))))
 
 
-class QualifyDataPanel(Widget):
+class QualifyDataPanel(PagedFundingRequestPanel):
+    sortable_columns = [('id', 'Date received'), ('name', 'Name'), ('surname', 'Surname'),
+                        ('score_total', 'Score'), ('qualify_total', 'Total')]
+    caption_text = 'Qualifying amounts'
+    export_parts = ('amounts',)
+
     def __init__(self, view):
-        super(QualifyDataPanel, self).__init__(view)
-
-        class QualifyDataRow(object):
-            def __init__(self, request):
-                self.request = request
-                self.funding_items = {i.label:i for i in self.request.get_funding_items()}
-
-            def qualifies_for_amount(self, funding_item):
-                return self.funding_items[funding_item.label].qualified_amount
-
-            @property
-            def score_total(self):
-                return self.request.score_total
-            @property
-            def qualify_total(self):
-                return self.request.qualify_total
-            @property
-            def name(self):
-                return self.request.name
-            @property
-            def surname(self):
-                return self.request.surname
-            
+        super(QualifyDataPanel, self).__init__(view, 'results')
 
-        def make_column_value(funding_item, view, row):
-            return TextNode(view, str(row.qualifies_for_amount(funding_item)))
+    def make_columns(self):
+        def make_column_value(index, view, row):
+            return TextNode(view, str(row.qualified_amounts[index]))
 
-        columns = []
-        columns.append(StaticColumn(IntegerField(label='Name'), 'name'))
-        columns.append(StaticColumn(IntegerField(label='Surname'), 'surname'))
+        columns = super(QualifyDataPanel, self).make_columns()
         columns.append(StaticColumn(IntegerField(label='Score'), 'score_total'))
-        for i in FundingRequest().get_funding_items():
-            columns.append(DynamicColumn(i.label, functools.partial(make_column_value, i)))
+        for index, rule in enumerate(ScoringRuleSet.current().funding_item_rules):
+            columns.append(DynamicColumn(rule.label, functools.partial(make_column_value, index)))
 
         columns.append(StaticColumn(IntegerField(label='Total'), 'qualify_total'))
-            
-        rows = [QualifyDataRow(i) for i in FundingRequest.find_requests()]
-        table = self.add_child(Table(view, caption_text='Qualifying amounts'))
+        return columns
+
+    def get_rows(self, page):
+        return list(FundingRequest.score_requests(page.restrict(Session.query(FundingRequest))))
+
+        
+class FundingScenarioForm(Form):
+    def __init__(self, view):
+        super(FundingScenarioForm, self).__init__(view, 'scenario_form')
+        funding_scenario = FundingScenario()
+
+        rule_set = ScoringRuleSet.current()
+        self.add_child(P(view, text='Criteria, in order: %s' % ', '.join(rule.label for rule in rule_set.criterion_rules)))
+        self.add_child(P(view, text='Funding items, in order: %s' % ', '.join(rule.label for rule in rule_set.funding_item_rules)))
+        self.add_child(P(view, text='Separate alternatives with | to try all their combinations, eg 35|40.'))
+
+        inputs = self.add_child(FieldSet(view, legend_text='Add a scenario'))
+        inputs.use_layout(FormLayout())
+        inputs.layout.add_input(TextInput(self, funding_scenario.fields.name))
+        inputs.layout.add_input(TextInput(self, funding_scenario.fields.weights))
+        inputs.layout.add_input(TextInput(self, funding_scenario.fields.thresholds))
+
+        self.define_event_handler(funding_scenario.events.save)
+        button = self.add_child(Button(self, funding_scenario.events.save))
+        button.use_layout(ButtonLayout(style='primary'))
+
+
+class WhatIfPanel(Widget):
+    @timed_construction
+    def __init__(self, view):
+        super(WhatIfPanel, self).__init__(view)
+
+        rule_set = ScoringRuleSet.current()
+        outcomes = FundingScenario.simulate_all()
+
+        def as_json():
+            return json.dumps([outcome.as_dict(rule_set) for outcome in outcomes])
+        download = RemoteMethod('whatif_json', as_json, TextResult(content_type='application/json', charset='utf-8'), immutable=True)
+        view.add_resource(download)
+        self.add_child(P(view)).add_child(A(view, download.get_url(), description='Download as JSON'))
+
+        def make_list_value(attribute_name, view, outcome):
+            return TextNode(view, ', '.join(str(value) for value in getattr(outcome.scenario, attribute_name)))
+
+        def make_item_value(index, view, outcome):
+            return TextNode(view, '%s (%s)' % (outcome.payouts[index], outcome.funded[index]))
+
+        columns = [DynamicColumn('Scenario', lambda view, outcome: TextNode(view, outcome.scenario.name)),
+                   DynamicColumn('Weights', functools.partial(make_list_value, 'weights')),
+                   DynamicColumn('Thresholds', functools.partial(make_list_value, 'thresholds'))]
+        for index, rule in enumerate(rule_set.funding_item_rules):
+            columns.append(DynamicColumn('%s (applicants)' % rule.label, functools.partial(make_item_value, index)))
+        columns.append(StaticColumn(IntegerField(label='Total payout'), 'total_payout'))
+
+        table = self.add_child(Table(view, caption_text='What if?'))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, outcomes)
+
+        self.add_child(FundingScenarioForm(view))
+
+
+class JobRequestForm(Form):
+    def __init__(self, view):
+        super(JobRequestForm, self).__init__(view, 'job_form')
+        job_request = JobRequest()
+
+        rescore = self.add_child(FieldSet(view, legend_text='Rescore'))
+        rescore.add_child(P(view, text='Recomputes the stored scores and qualifying totals of all applications.'))
+        self.add_button(rescore, job_request.events.rescore)
+
+        grant_status = self.add_child(FieldSet(view, legend_text='Set application status'))
+        grant_status.use_layout(FormLayout())
+        grant_status.layout.add_input(TextInput(self, job_request.fields.grant_status))
+        grant_status.layout.add_input(TextInput(self, job_request.fields.condition))
+        self.add_button(grant_status, job_request.events.set_grant_status)
+
+        export = self.add_child(FieldSet(view, legend_text='Export'))
+        export.use_layout(FormLayout())
+        export.layout.add_input(TextInput(self, job_request.fields.export_format))
+        self.add_button(export, job_request.events.export)
+
+    def add_button(self, parent, event):
+        self.define_event_handler(event)
+        button = parent.add_child(Button(self, event))
+        button.use_layout(ButtonLayout(style='primary'))
+        return button
+
+
+class JobsPanel(Widget):
+    def __init__(self, view):
+        super(JobsPanel, self).__init__(view)
+        self.add_child(P(view, text='Queued jobs are run by "reahl jobworker" processes; the progress below is as of loading this page.'))
+
+        def make_time_value(attribute_name, view, job):
+            value = getattr(job, attribute_name)
+            return TextNode(view, value.strftime('%Y-%m-%d %H:%M:%S') if value else '')
+
+        columns = [StaticColumn(IntegerField(label='Job'), 'id'),
+                   StaticColumn(Field(label='What'), 'label'),
+                   StaticColumn(Field(label='Status'), 'status'),
+                   StaticColumn(Field(label='Progress'), 'progress'),
+                   StaticColumn(Field(label='Queued by'), 'queued_by'),
+                   DynamicColumn('Queued (UTC)', functools.partial(make_time_value, 'queued_at')),
+                   DynamicColumn('Finished (UTC)', functools.partial(make_time_value, 'finished_at')),
+                   DynamicColumn('Result', lambda view, job: TextNode(view, job.error or job.result or ''))]
+        table = self.add_child(Table(view, caption_text='Jobs, most recent first'))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, Job.recent())
+
+        self.add_child(JobRequestForm(view))
+
+
+class ChangeTimeline(Widget):
+    def __init__(self, view, funding_request):
+        super(ChangeTimeline, self).__init__(view)
+        self.add_child(P(view)).add_child(A.from_bookmark(view, view.user_interface.get_edit_bookmark(funding_request)))
+
+        def make_changes_value(view, change):
+            return TextNode(view, change.describe())
+
+        columns = [DynamicColumn('When (UTC)', lambda view, change: TextNode(view, change.changed_at.strftime('%Y-%m-%d %H:%M:%S'))),
+                   StaticColumn(Field(label='By'), 'changed_by'),
+                   StaticColumn(Field(label='Event'), 'event'),
+                   DynamicColumn('Changes', make_changes_value)]
+        table = self.add_child(Table(view, caption_text='Changes, most recent first'))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, FundingRequestChange.timeline_for(funding_request.id))
+
+
+class DashboardPanel(Widget):
+    @timed_construction
+    def __init__(self, view):
+        super(DashboardPanel, self).__init__(view)
+        summary = FundingSummary.for_current_data()
+
+        summary_columns = [StaticColumn(Field(label=''), 'label'),
+                           StaticColumn(IntegerField(label='Applications'), 'applications'),
+                           StaticColumn(IntegerField(label='Aid amount requested'), 'amount_requested'),
+                           StaticColumn(IntegerField(label='Qualifies for'), 'qualify_total')]
+        self.add_table('Totals', summary_columns, [summary.total])
+        self.add_table('By application status', summary_columns, summary.by_status)
+
+        budget_columns = [StaticColumn(Field(label='Budget line'), 'label'),
+                          StaticColumn(IntegerField(label='Requested'), 'requested'),
+                          StaticColumn(IntegerField(label='Qualifies for'), 'qualifies')]
+        self.add_table('By budget line', budget_columns, summary.budget_lines)
+        self.add_table('By country of residence', summary_columns, summary.by_country)
+
+        emails = OutboxMessage.count_by_status()
+        self.add_child(P(view, text='Emails to applicants: %s' % (', '.join('%s %s' % (count, status) for status, count in sorted(emails.items()))
+                                                                  or 'none yet')))
+
+    def add_table(self, caption_text, columns, rows):
+        table = self.add_child(Table(self.view, caption_text=caption_text))
         table.use_layout(TableLayout(responsive=True, striped=True))
         table.with_data(columns, rows)
+        return table
+
+
+class SearchBox(HTMLElement):
+    """A plain GET form, so that a search ends up in the URL (and can be bookmarked or paged)."""
+    def __init__(self, view, query_text):
+        super(SearchBox, self).__init__(view, 'form', children_allowed=True)
+        self.set_attribute('method', 'get')
+        self.append_class('form-inline')
+        search_input = self.add_child(HTMLElement(view, 'input'))
+        search_input.set_attribute('type', 'search')
+        search_input.set_attribute('name', 'q')
+        search_input.set_attribute('value', query_text or '')
+        search_input.set_attribute('placeholder', 'Name, email, username or words from the motivation')
+        search_input.append_class('form-control')
+        button = self.add_child(HTMLElement(view, 'button', children_allowed=True))
+        button.set_attribute('type', 'submit')
+        button.append_class('btn')
+        button.add_child(TextNode(view, 'Search'))
+
+
+class SearchPanel(Div):
+    page_size = 25
+
+    @timed_construction
+    def __init__(self, view):
+        super(SearchPanel, self).__init__(view, css_id='search')
+        self.add_child(SearchBox(view, self.q))
+        if not SearchIndex.get_words(self.q):
+            return
 
-        
-class FundingRequestBox(Form):
+        page_number = max(self.page or 1, 1)
+        ids = SearchIndex.for_current_database().search(self.q, self.page_size+1, offset=(page_number-1)*self.page_size)
+        has_next = len(ids) > self.page_size
+        ids = ids[:self.page_size]
+        found = dict((funding_request.id, funding_request) for funding_request in FundingRequest.find_requests(ids=ids)) if ids else {}
+
+        def make_edit_link(view, funding_request):
+            return A.from_bookmark(view, view.user_interface.get_edit_bookmark(funding_request))
+
+        columns = [StaticColumn(Field(label='Name'), 'name'),
+                   StaticColumn(Field(label='Surname'), 'surname'),
+                   StaticColumn(Field(label='Email'), 'email_address'),
+                   StaticColumn(Field(label='Username on za.pycon.org'), 'username_on_za'),
+                   StaticColumn(Field(label='Country of residence'), 'resident_country'),
+                   StaticColumn(Field(label='Application status'), 'grant_status'),
+                   StaticColumn(IntegerField(label='Score'), 'score_total'),
+                   DynamicColumn('', make_edit_link)]
+        table = self.add_child(Table(view, caption_text='Applications matching "%s"' % self.q))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, [found[funding_request_id] for funding_request_id in ids if funding_request_id in found])
+
+        page_bookmarks = []
+        if page_number > 1:
+            page_bookmarks.append(self.get_bookmark('Previous page', page_number-1))
+        if has_next:
+            page_bookmarks.append(self.get_bookmark('Next page', page_number+1))
+        self.add_child(Nav(view).with_bookmarks(page_bookmarks))
+
+    @exposed
+    def query_fields(self, fields):
+        fields.q = Field(required=False, default='')
+        fields.page = IntegerField(required=False, default=1)
+
+    def get_bookmark(self, description, page_number):
+        query_arguments = {'q': self.q, 'page': str(page_number)}
+        return Bookmark.for_widget(description, query_arguments=query_arguments).on_view(self.view)
+
+
+class AllocationPanel(Widget):
+    """The totals of allocating the budget, and a page of the allocations (highest scores first)."""
+    page_size = 50
+
+    @timed_construction
+    def __init__(self, view):
+        super(AllocationPanel, self).__init__(view)
+
+        budget = self.budget if self.budget is not None else FundingConfig.get_current().total_aid_budget
+        result = GrantAllocator.for_current_data().solve(budget=budget)
+
+        self.add_child(P(view, text='Budget: %s. Granted: %s to %s applicants (score-weighted coverage %s).' % \
+                                    (budget if budget is not None else 'no limit', result.total_granted,
+                                     result.applicants_funded, result.coverage)))
+        self.add_child(P(view, text='; '.join('%s: %s' % (label, granted) for label, granted in result.granted_per_item.items())))
+        self.add_child(Nav(view).with_bookmarks([Bookmark.for_widget('Allocate %s' % amount,
+                                                                     query_arguments={'budget': str(amount), 'page': '1'}).on_view(view)
+                                                 for amount in self.get_budget_options(budget, result)]))
+
+        columns = [StaticColumn(Field(label='Applicant'), 'applicant'),
+                   StaticColumn(IntegerField(label='Score'), 'score'),
+                   StaticColumn(Field(label='Item'), 'item_label'),
+                   StaticColumn(IntegerField(label='Qualifies for'), 'requested'),
+                   StaticColumn(IntegerField(label='Granted'), 'granted')]
+        page_number = max(self.page or 1, 1)
+        first = (page_number-1)*self.page_size
+        allocations = result.allocations[first:first+self.page_size]
+        table = self.add_child(Table(view, caption_text='Allocation (%s to %s of %s)' % \
+                                                        (first+1 if allocations else first, first+len(allocations), len(result.allocations))))
+        table.use_layout(TableLayout(responsive=True, striped=True))
+        table.with_data(columns, allocations)
+
+        page_bookmarks = []
+        if page_number > 1:
+            page_bookmarks.append(self.get_bookmark('Previous page', page_number-1))
+        if first+self.page_size < len(result.allocations):
+            page_bookmarks.append(self.get_bookmark('Next page', page_number+1))
+        self.add_child(Nav(view).with_bookmarks(page_bookmarks))
+
+    @exposed
+    def query_fields(self, fields):
+        fields.budget = IntegerField(required=False, default=None)
+        fields.page = IntegerField(required=False, default=1)
+
+    def get_bookmark(self, description, page_number):
+        query_arguments = {'page': str(page_number)}
+        if self.budget is not None:
+            query_arguments['budget'] = str(self.budget)
+        return Bookmark.for_widget(description, query_arguments=query_arguments).on_view(self.view)
+
+    def get_budget_options(self, budget, result):
+        base = budget or result.total_granted
+        return [int(base*factor) for factor in [0.5, 0.75, 1.25, 1.5] if base]
+
+
+class FundingRequestBox(Widget):
     def __init__(self, view, funding_request):
-        form_name = 'fund_%s' % funding_request.id  # Forms need unique names!
-        super(FundingRequestBox, self).__init__(view, form_name)
+        super(FundingRequestBox, self).__init__(view)
         allow_edit_symbol = '…' if funding_request.allow_user_changes else '⏹'
         paragraph = self.add_child(P(view, text='%s : %s: %s' % (allow_edit_symbol, funding_request.name, funding_request.email_address)))
-        paragraph.add_child(Button(self, funding_request.events.edit.with_arguments(funding_request_id=funding_request.id)))
+        paragraph.add_child(A.from_bookmark(view, view.user_interface.get_edit_bookmark(funding_request)))
 
 
 class MyFundingRequest(Widget):
+    @timed_construction
     def __init__(self, view):
         super(MyFundingRequest, self).__init__(view)
 
-        if not CurrentUserSession().is_logged_in_as_super_user():
-            funding_requests = FundingRequest.find_requests(account=CurrentUserSession().account)
-            if len(funding_requests) == 1:
-                funding_request = funding_requests[0]
+        user_session = CurrentUserSession.for_current_request()
+        if not user_session.is_logged_in_as_super_user():
+            funding_request = FundingRequest.for_account(user_session.account)
+            if funding_request:
                 self.add_child(EditFundingRequestForm(view, funding_request))
             else:
                 funding_request = FundingRequest()
@@ -351,13 +1307,14 @@ class FundingRequestSummary(Widget):
         
         
 class MyFundingRequestStatus(Widget):
+    @timed_construction
     def __init__(self, view, apply_bookmark):
         super(MyFundingRequestStatus, self).__init__(view)
     
-        if not CurrentUserSession().is_logged_in_as_super_user():
-            funding_requests = FundingRequest.find_requests(account=CurrentUserSession().account)
-            if len(funding_requests) == 1:
-                funding_request = funding_requests[0]
+        user_session = CurrentUserSession.for_current_request()
+        if not user_session.is_logged_in_as_super_user():
+            funding_request = FundingRequest.for_account(user_session.account)
+            if funding_request:
                 self.add_child(FundingRequestSummary(view, funding_request, apply_bookmark))
             else:
                 self.add_child(P(view, text='You have not applied for financial aid yet.'))
@@ -379,10 +1336,27 @@ class LoginFirst(Div):
 
 
 class CurrentUserSession(object):
+    """Who is logged in, and in which role.
+
+    Use :meth:`for_current_request` rather than constructing one: it is created once per request,
+    and the role is worked out only once for each account that is logged in during the request.
+    """
     super_user_email_address = 'admin@example.org'
 
+    @classmethod
+    def for_current_request(cls):
+        context = ExecutionContext.get_context()
+        try:
+            return context.pyconza_user_session
+        except AttributeError:
+            context.pyconza_user_session = cls()
+            return context.pyconza_user_session
+
     def __init__(self):
         self.login_session = LoginSession.for_current_session()
+        self.role_account = None
+        self.is_super_user = False
+        self.funding_requests = {}  # The FundingRequest (or None) of each account looked up in this request
 
     @property
     def account(self):
@@ -395,37 +1369,342 @@ class CurrentUserSession(object):
         return self.is_logged_in() and not self.is_logged_in_as_super_user()
 
     def is_logged_in_as_super_user(self):
-        return self.is_logged_in() and self.get_logged_in_user_email() == self.super_user_email_address
+        account = self.account
+        if account is not self.role_account:
+            self.role_account = account
+            self.is_super_user = bool(account) and account.email == self.super_user_email_address
+        return self.is_super_user
 
     def get_logged_in_user_email(self):
         if self.is_logged_in():
             return self.account.email
         return None
 
-    def setup_super_and_example_account(self):
-        example_accounts = ['applicant%s@example.org' % i for i in range(100)]
-        for email in [self.super_user_email_address]+example_accounts:
+
+class FundingConfig(Configuration):
+    filename = 'pyconzafunding.config.py'
+    config_key = 'pyconzafunding'
+
+    total_aid_budget = ConfigSetting(default=None, description='The total amount available for financial aid (None for no limit)')
+    export_signing_key = ConfigSetting(default=None, description='The secret that download links of exports are signed with '
+                                       '(required by make_wsgi_application)')
+    job_output_directory = ConfigSetting(default=tempfile.gettempdir(), description='Where export jobs write their files')
+
+    mail_from = ConfigSetting(default='financial-aid@example.org', description='The sender of emails to applicants')
+    smtp_host = ConfigSetting(default='localhost', description='The SMTP server emails to applicants are sent through')
+    smtp_port = ConfigSetting(default=25, description='The port of the SMTP server')
+    smtp_username = ConfigSetting(default=None, description='The user to log into the SMTP server as (None to not log in)')
+    smtp_password = ConfigSetting(default=None, description='The password of smtp_username')
+    smtp_starttls = ConfigSetting(default=False, description='Whether to switch to TLS after connecting to the SMTP server')
+    smtp_connections = ConfigSetting(default=4, description='How many SMTP connections to send over at once')
+    mail_batch_size = ConfigSetting(default=100, description='How many emails to take from the outbox at a time')
+    mail_max_attempts = ConfigSetting(default=6, description='How often to try sending an email before giving up on it')
+    mail_retry_seconds = ConfigSetting(default=60, description='How long to wait before retrying an email (doubled on each attempt)')
+
+    @classmethod
+    def get_current(cls):
+        return ExecutionContext.get_context().config.pyconzafunding
+
+
+class SeedMarker(Base):
+    __tablename__ = 'pyconza_seed_marker'
+
+    id   = Column(Integer, primary_key=True)
+    name = Column(UnicodeText, nullable=False, unique=True)
+
+    @classmethod
+    def is_set(cls, name):
+        return Session.query(cls).filter_by(name=name).count() > 0
+
+
+example_account_password = 'snakesnake'
+example_account_emails = ['applicant%s@example.org' % i for i in range(100)]
+
+
+def hashed_password_columns(email):
+    # Runs in a worker process: hashes on a throwaway account and hands back only the column values it set
+    system_account = EmailAndPasswordSystemAccount(email=email)
+    system_account.set_new_password(email, example_account_password)
+    return dict((attribute.key, attribute.value) for attribute in inspect(system_account).attrs
+                if attribute.history.added)
+
+
+def setup_super_and_example_account():
+    """Creates the super user and example applicant accounts, once.
+
+    Returns the number of accounts created. Safe to call repeatedly: once the accounts are
+    seeded a marker is persisted and subsequent calls do nothing.
+    """
+    marker_name = 'super_and_example_accounts'
+    if SeedMarker.is_set(marker_name):
+        return 0
+
+    emails = [CurrentUserSession.super_user_email_address]+example_account_emails
+    existing = set(email for (email,) in Session.query(EmailAndPasswordSystemAccount.email).
+                                          filter(EmailAndPasswordSystemAccount.email.in_(emails)))
+    missing = [email for email in emails if email not in existing]
+
+    if missing:
+        # Spawned (not forked) workers, so they do not inherit the open database connection
+        pool = multiprocessing.get_context('spawn').Pool()
+        try:
+            all_columns = pool.map(hashed_password_columns, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+        new_accounts = []
+        for columns in all_columns:
+            system_account = EmailAndPasswordSystemAccount()
+            for name, value in columns.items():
+                setattr(system_account, name, value)
+            system_account.activate()
+            new_accounts.append(system_account)
+        Session.add_all(new_accounts)
+
+    Session.add(SeedMarker(name=marker_name))
+    Session.flush()
+    return len(missing)
+
+
+class FundingCommand(ProductionCommand, metaclass=abc.ABCMeta):
+    """Superclass for commands that work on the funding database in a single transaction."""
+    def execute(self, args):
+        super(FundingCommand, self).execute(args)
+        self.context.install()
+        self.sys_control.connect()
+        try:
+            result = self.perform(args)
+            self.sys_control.orm_control.commit()
+            return result
+        finally:
+            self.sys_control.disconnect()
+
+    @abc.abstractmethod
+    def perform(self, args):
+        """Does the work of the command within the transaction, returning its exit code."""
+
+
+class SeedAccounts(FundingCommand):
+    """Creates the super user and example applicant accounts (if not done before)."""
+    keyword = 'seedaccounts'
+
+    def perform(self, args):
+        created = setup_super_and_example_account()
+        print('Created %s accounts' % created)
+        return 0
+
+
+class ExportFunding(FundingCommand):
+    """Writes all funding requests, their criteria and qualifying amounts as CSV or JSON lines."""
+    keyword = 'exportfunding'
+
+    def assemble(self):
+        super(ExportFunding, self).assemble()
+        self.parser.add_argument('-f', '--format', dest='export_format', choices=FundingExport.formats, default='csv',
+                                 help='the format to write')
+        self.parser.add_argument('-o', '--output', dest='output', default='-',
+                                 help='the file to write to (default: stdout)')
+        self.parser.add_argument('-p', '--parts', dest='parts', nargs='+', default=['columns', 'criteria', 'amounts'],
+                                 choices=['columns', 'criteria', 'amounts'], help='what to include')
+
+    def perform(self, args):
+        output = sys.stdout if args.output == '-' else io.open(args.output, 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in FundingExport(parts=args.parts).generate(args.export_format):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        return 0
+
+
+class ImportFundingRequests(FundingCommand):
+    """Imports funding requests from a .csv, .json or .jsonl file, in batches."""
+    keyword = 'importfunding'
+
+    def assemble(self):
+        super(ImportFundingRequests, self).assemble()
+        self.parser.add_argument('filename', help='the .csv, .json (a list) or .jsonl file to import')
+        self.parser.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=None,
+                                 help='the number of requests inserted per flush')
+
+    def perform(self, args):
+        funding_import = FundingRequestImport(batch_size=args.batch_size)
+        funding_import.import_records(FundingRequestImport.read_records(args.filename))
+        for number, message in funding_import.errors:
+            print('Record %s: %s' % (number, message), file=sys.stderr)
+        print('Imported %s funding requests, %s failed' % (funding_import.imported, len(funding_import.errors)))
+        return 0
+
+
+class LoadScoringRules(FundingCommand):
+    """Replaces the scoring rules with those in a file and rescores all requests (or shows the current rules)."""
+    keyword = 'scoringrules'
+
+    def assemble(self):
+        super(LoadScoringRules, self).assemble()
+        self.parser.add_argument('filename', nargs='?', default=None,
+                                 help='a file with the new rules; if omitted, the current rules are printed')
+
+    def perform(self, args):
+        if not args.filename:
+            print(ScoringRuleSet.current().as_text(), end='')
+            return 0
+        with io.open(args.filename, encoding='utf-8') as rules_file:
             try:
-                EmailAndPasswordSystemAccount.by_email(email)
-            except NoSuchAccountException:
-                system_account = EmailAndPasswordSystemAccount(email=email)
-                system_account.set_new_password(email, 'snakesnake')
-                system_account.activate()
-                Session.add(system_account)
+                rescored = ScoringRule.replace_all(rules_file.read())
+            except RuleSyntaxError as ex:
+                print(ex, file=sys.stderr)
+                return 1
+        print('Rescored %s funding requests' % rescored)
+        return 0
+
+
+class ExportChanges(FundingCommand):
+    """Writes the changes made to funding requests after a given time as JSON lines, oldest first."""
+    keyword = 'exportchanges'
+    date_formats = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+    chunk_size = 1000
+
+    def assemble(self):
+        super(ExportChanges, self).assemble()
+        self.parser.add_argument('since', help='a UTC time (eg 2019-08-01 or 2019-08-01T12:00:00); only later changes are written')
+        self.parser.add_argument('-o', '--output', dest='output', default='-',
+                                 help='the file to write to (default: stdout)')
+
+    def parse_time(self, text):
+        for date_format in self.date_formats:
+            try:
+                return datetime.datetime.strptime(text, date_format)
+            except ValueError:
+                pass
+        raise ValueError('Cannot understand the time %s' % text)
+
+    def perform(self, args):
+        try:
+            since = self.parse_time(args.since)
+        except ValueError as ex:
+            print(ex, file=sys.stderr)
+            return 1
+        output = sys.stdout if args.output == '-' else io.open(args.output, 'w', encoding='utf-8')
+        try:
+            after_id = None
+            changes = FundingRequestChange.changes_since(since, limit=self.chunk_size)
+            while changes:
+                for change in changes:
+                    output.write('%s\n' % json.dumps(change.as_dict(), sort_keys=True))
+                since, after_id = changes[-1].changed_at, changes[-1].id
+                Session.expunge_all()
+                changes = FundingRequestChange.changes_since(since, after_id=after_id, limit=self.chunk_size)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        return 0
+
+
+class QueueJob(FundingCommand):
+    """Queues a bulk job (rescore, grant_status or export) for the job workers."""
+    keyword = 'queuejob'
+
+    def assemble(self):
+        super(QueueJob, self).assemble()
+        self.parser.add_argument('kind', choices=list(job_kinds), help='what the job does')
+        self.parser.add_argument('-s', '--status', dest='status', help='grant_status: the status to set')
+        self.parser.add_argument('-c', '--condition', dest='condition', default='',
+                                 help='grant_status: which requests to change, in the scoring rule language')
+        self.parser.add_argument('-f', '--format', dest='export_format', choices=FundingExport.formats, default='csv',
+                                 help='export: the format to write')
+
+    def perform(self, args):
+        arguments = {'rescore': {},
+                     'grant_status': {'status': args.status, 'condition': args.condition},
+                     'export': {'format': args.export_format}}[args.kind]
+        try:
+            job = Job.queue(args.kind, **arguments)
+        except DomainException as ex:
+            print(ex.message, file=sys.stderr)
+            return 1
+        print('Queued job %s: %s' % (job.id, job.label))
+        return 0
+
+
+class RunJobs(FundingCommand):
+    """Runs queued jobs one after the other, until there are none left (or forever, with --wait).
+
+    Start more of these to run jobs in parallel; each job is claimed by one worker only.
+    """
+    keyword = 'jobworker'
+
+    def assemble(self):
+        super(RunJobs, self).assemble()
+        self.parser.add_argument('-w', '--wait', dest='wait', action='store_true', default=False,
+                                 help='keep waiting for new jobs instead of stopping when there are none')
+        self.parser.add_argument('-p', '--poll-seconds', dest='poll_seconds', type=float, default=5,
+                                 help='how long to wait between looking for new jobs')
+
+    def perform(self, args):
+        worker = '%s:%s' % (socket.gethostname(), os.getpid())
+        orm_control = self.sys_control.orm_control
+        while True:
+            job = Job.claim_next(worker)
+            orm_control.commit()
+            if job:
+                print('Running job %s: %s' % (job.id, job.label))
+                job.run(orm_control.commit, orm_control.rollback)
+                job = Session.query(Job).get(job.id)
+                print('Job %s %s: %s' % (job.id, job.status, job.error or job.result or job.progress))
+            elif args.wait:
+                time.sleep(args.poll_seconds)
+            else:
+                return 0
+
+
+class SendNotifications(FundingCommand):
+    """Sends the queued emails to applicants (until none are due, or forever with --wait).
+
+    To try it against a local SMTP stub, run one (eg: python -m aiosmtpd -n -l localhost:8025) and
+    pass --smtp-host localhost --smtp-port 8025.
+    """
+    keyword = 'sendnotifications'
+
+    def assemble(self):
+        super(SendNotifications, self).assemble()
+        self.parser.add_argument('-w', '--wait', dest='wait', action='store_true', default=False,
+                                 help='keep waiting for new emails instead of stopping when none are due')
+        self.parser.add_argument('-p', '--poll-seconds', dest='poll_seconds', type=float, default=5,
+                                 help='how long to wait between looking for new emails')
+        self.parser.add_argument('--smtp-host', dest='smtp_host', default=None, help='overrides pyconzafunding.smtp_host')
+        self.parser.add_argument('--smtp-port', dest='smtp_port', type=int, default=None, help='overrides pyconzafunding.smtp_port')
+
+    def perform(self, args):
+        config = FundingConfig.get_current()
+        orm_control = self.sys_control.orm_control
+        while True:
+            sent, failed, retried = OutboxSender.from_config(config, host=args.smtp_host, port=args.smtp_port).send_due(orm_control.commit)
+            if sent or failed or retried:
+                print('Sent %s emails, %s failed, %s to be retried' % (sent, failed, retried))
+            if not args.wait:
+                return 0
+            time.sleep(args.poll_seconds)
+
+
+class RebuildSearchIndex(FundingCommand):
+    """Refills the full-text search index from all funding requests."""
+    keyword = 'searchindex'
+
+    def perform(self, args):
+        indexed = SearchIndex.for_current_database().rebuild()
+        print('Indexed %s funding requests' % indexed)
+        return 0
 
 
-                
 class FundingRequestUI(UserInterface):
-    created = False
     def assemble(self):
 
         self.define_static_directory('/css')
 
-        user_session = CurrentUserSession()
-
-        if not self.created:
-            user_session.setup_super_and_example_account()
-            self.created = True
+        user_session = CurrentUserSession.for_current_request()
 
         home = self.define_view('/', title='PyConZA 2019 Financial Aid')
 
@@ -439,35 +1718,66 @@ class FundingRequestUI(UserInterface):
         else:
             home.set_slot('main', LoginFirst.factory(accounts))
         
+        dashboard = self.define_view('/dashboard', title='Dashboard', read_check=user_session.is_logged_in_as_super_user)
+        dashboard.set_slot('main', DashboardPanel.factory())
+
         requests = self.define_view('/requests', title='Funding Requests', read_check=user_session.is_logged_in_as_super_user)
         requests.set_slot('main', AllFundRequestsPanel.factory())
 
+        search = self.define_view('/search', title='Search', read_check=user_session.is_logged_in_as_super_user)
+        search.set_slot('main', SearchPanel.factory())
+
         scores = self.define_view('/scores', title='Scoring data', read_check=user_session.is_logged_in_as_super_user)
         scores.set_slot('main', ScoringDataPanel.factory())
 
         results = self.define_view('/results', title='Funding', read_check=user_session.is_logged_in_as_super_user)
         results.set_slot('main', QualifyDataPanel.factory())
 
+        allocation = self.define_view('/allocation', title='Allocation', read_check=user_session.is_logged_in_as_super_user)
+        allocation.set_slot('main', AllocationPanel.factory())
+
+        whatif = self.define_view('/whatif', title='What if?', read_check=user_session.is_logged_in_as_super_user)
+        whatif.set_slot('main', WhatIfPanel.factory())
+
+        jobs = self.define_view('/jobs', title='Jobs', read_check=user_session.is_logged_in_as_super_user)
+        jobs.set_slot('main', JobsPanel.factory())
+
+        metrics = self.define_view('/metrics', title='Metrics', read_check=user_session.is_logged_in_as_super_user)
+        metrics.set_slot('main', MetricsPanel.factory())
+
         create = self.define_view('/create', title='Create', read_check=user_session.is_logged_in_as_super_user)
         create.set_slot('main', NewFundingRequestForm.factory())
 
         self.edit = self.define_view('/edit', view_class=EditView, funding_request_id=IntegerField(), read_check=user_session.is_logged_in)
+        self.history = self.define_view('/history', view_class=HistoryView, funding_request_id=IntegerField(),
+                                        read_check=user_session.is_logged_in_as_super_user)
 
 
         account_bookmarks = []
         if not user_session.is_logged_in():
             account_bookmarks = [accounts.get_bookmark(relative_path=relative_path)
                                  for relative_path in ['/login', '/register', '/registerHelp', '/verify']]
-        funding_bookmarks = [f.as_bookmark(self) for f in [create, requests, scores, results]]
+        funding_bookmarks = [f.as_bookmark(self) for f in [create, dashboard, requests, search, scores, results, allocation, whatif, jobs, metrics]]
+        if user_session.is_logged_in_as_normal_user():
+            has_applied = FundingRequest.for_account(user_session.account) is not None
+            funding_bookmarks.insert(0, myapplication.as_bookmark(self, description='My application' if has_applied else 'Apply'))
         self.define_page(FundingRequestPage, funding_bookmarks+account_bookmarks)
 
         self.define_transition(FundingRequest.events.save, create, requests)
+        self.define_transition(FundingScenario.events.save, whatif, whatif)
+        for job_event in [JobRequest.events.rescore, JobRequest.events.set_grant_status, JobRequest.events.export]:
+            self.define_transition(job_event, jobs, jobs)
         self.define_transition(FundingRequest.events.update, self.edit, requests)
-        self.define_transition(FundingRequest.events.edit, requests, self.edit)
         self.define_transition(FundingRequest.events.save, myapplication, home)
         self.define_transition(FundingRequest.events.update, myapplication, home)
 
 
+    def get_edit_bookmark(self, funding_request):
+        return self.edit.as_bookmark(self, description='Edit', funding_request_id=funding_request.id)
+
+    def get_history_bookmark(self, funding_request):
+        return self.history.as_bookmark(self, description='History', funding_request_id=funding_request.id)
+
     def define_accounts(self):
 
         terms_of_service = self.define_view('/terms_of_service', title='Terms of service')
@@ -522,48 +1832,2075 @@ class FundingItem(object):
             return self.value
         else:
             return 0
-        
 
-class FundingRequest(Base):
-    __tablename__ = 'pyconza_funding_request'
 
-    id              = Column(Integer, primary_key=True)
+class FieldSpec(object):
+    """Describes one of the Fields of a FundingRequest.
 
-    account_id    = Column(Integer, ForeignKey(EmailAndPasswordSystemAccount.id), nullable=False)
-    account       = relationship(EmailAndPasswordSystemAccount)
-    
-    email_address = Column(UnicodeText)
-    name          = Column(UnicodeText)
-    surname       = Column(UnicodeText)
-    username_on_za   = Column(UnicodeText)
-    origin_country   = Column(UnicodeText)
-    resident_country = Column(UnicodeText)
-    motivation       = Column(UnicodeText)
-    willing_to_help = Column(Boolean, nullable=False, default=False)
-    amount_requested = Column(Integer, default=0)
-    budget_own_contribution = Column(Integer, default=0)
-    budget_ticket    = Column(Integer, default=0)
-    budget_travel    = Column(Integer, default=0)
-    budget_accommodation = Column(Integer, default=0)
-    budget_food      = Column(Integer, default=0)
-    budget_transport = Column(Integer, default=0)
-    budget_other     = Column(Integer, default=0)
-    budget_other_describe = Column(UnicodeText, default='')
-    
-    allow_user_changes = Column(Boolean, nullable=False, default=True)
-    grant_status  = Column(UnicodeText, default='Pending')
-    feedback_message = Column(UnicodeText, default='')
+    `readable_by` and `writable_by` name who may read or write it: 'applicant' (an applicant
+    allowed to make changes, or the super user) or 'super_user'; None means anyone may.
+    `required` may also be 'super_user' to only require the field from the super user.
+    """
+    roles_allowed = {'applicant': ['super_user', 'editor'], 'super_user': ['super_user']}
+    allowed = Action(lambda: True)
+    denied = Action(lambda: False)
 
-    number_talks_proposed = Column(Integer, default=0)
-    number_talks_accepted = Column(Integer, default=0)
-    number_keynote_talks = Column(Integer, default=0)
+    def __init__(self, name, field_class, label, required=False, readable_by=None, writable_by='applicant', **field_arguments):
+        self.name = name
+        self.field_class = field_class
+        self.label = label
+        self.required = required
+        self.readable_by = readable_by
+        self.writable_by = writable_by
+        self.field_arguments = field_arguments
+
+    def allows(self, allowed_by, role):
+        return allowed_by is None or role in self.roles_allowed[allowed_by]
+
+    def create_field(self, role=None):
+        """Creates the Field as seen by `role` (one of FundingRequestSchema.roles), or an unchecked Field
+        (validating as for the super user) if None."""
+        arguments = dict(self.field_arguments, label=self.label)
+        if role is None:
+            arguments['required'] = bool(self.required)
+        else:
+            if self.required == 'super_user':
+                arguments['required'] = role == 'super_user'
+            else:
+                arguments['required'] = self.required
+            arguments['readable'] = self.allowed if self.allows(self.readable_by, role) else self.denied
+            arguments['writable'] = self.allowed if self.allows(self.writable_by, role) else self.denied
+        return self.field_class(**arguments)
+
+
+class FundingRequestSchema(object):
+    """The Fields of FundingRequest, worked out once per role rather than for every FundingRequest.
+
+    What a user may read, write or must fill in only depends on their role towards a FundingRequest:
+    'super_user', 'editor' (logged in, and the FundingRequest allows changes by its applicant) or
+    'viewer'. Prototype Fields are created once for each role and copied when a FundingRequest's
+    fields are bound. `column_fields` are unchecked Fields of the columns, for labelling tables and
+    validating imports without a FundingRequest.
+    """
+    roles = ['super_user', 'editor', 'viewer']
+    current = None
+    lock = threading.Lock()
+
+    def __init__(self, specs):
+        self.specs = collections.OrderedDict((spec.name, spec) for spec in specs)
+        self.labels = dict((spec.name, spec.label) for spec in specs)
+        self.readable_by_role = dict((role, frozenset(spec.name for spec in specs if spec.allows(spec.readable_by, role)))
+                                     for role in self.roles)
+        self.writable_by_role = dict((role, frozenset(spec.name for spec in specs if spec.allows(spec.writable_by, role)))
+                                     for role in self.roles)
+        self.prototypes = dict((role, self.create_fields(role)) for role in self.roles)
+        self.column_fields = collections.OrderedDict((spec.name, spec.create_field()) for spec in specs
+                                                     if spec.name in FundingRequest.__table__.columns)
+
+    def create_fields(self, role):
+        fields = collections.OrderedDict((spec.name, spec.create_field(role)) for spec in self.specs.values())
+        fields['seen_version'] = IntegerField(required=False, label='Version')
+        return fields
+
+    @classmethod
+    def get(cls):
+        with cls.lock:
+            if cls.current is None:
+                cls.current = cls(funding_request_field_specs)
+            return cls.current
+
+    def role_of(self, funding_request):
+        user_session = CurrentUserSession.for_current_request()
+        if user_session.is_logged_in_as_super_user():
+            return 'super_user'
+        elif user_session.is_logged_in() and funding_request.allow_user_changes:
+            return 'editor'
+        return 'viewer'
+
+    def fields_for(self, funding_request):
+        return [(name, field.unbound_copy()) for name, field in self.prototypes[self.role_of(funding_request)].items()]
+
+    def get_column_field(self, name):
+        return self.column_fields[name].unbound_copy()
+
+
+class CriterionRule(object):
+    """Knows how to decide whether a Criterion applies, both for a single FundingRequest and as SQL."""
+    def __init__(self, label, score_contribution, applies_to, condition):
+        self.label = label
+        self.score_contribution = score_contribution
+        self.applies_to = applies_to
+        self.condition = condition
+
+    def criterion_for(self, funding_request):
+        return Criterion(self.label, self.score_contribution, self.applies_to(funding_request))
+
+    def applies_expression(self):
+        return case([(self.condition(), 1)], else_=0)
+
+    def score_expression(self):
+        return case([(self.condition(), self.score_contribution)], else_=0)
+
+
+class FundingItemRule(object):
+    """Knows which budget line a FundingItem pays out, and the score needed for it."""
+    def __init__(self, label, score_needed, budget_column):
+        self.label = label
+        self.score_needed = score_needed
+        self.budget_column = budget_column
+
+    def funding_item_for(self, funding_request, total_score):
+        return FundingItem(self.label, self.score_needed, getattr(funding_request, self.budget_column) or 0, total_score)
+
+    def qualified_amount_expression(self, score_expression):
+        budget = func.coalesce(getattr(FundingRequest, self.budget_column), 0)
+        return case([(score_expression >= self.score_needed, budget)], else_=0)
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+class ConditionCompiler(object):
+    """Compiles a condition written in the scoring rule language.
+
+    A condition compares columns of FundingRequest with literals, eg::
+
+        number_talks_accepted > 1 and not (resident_country in AFRICA or resident_country == 'Mars')
+
+    Operators are ==, !=, >, >=, < and <=; `column in NAME` tests membership of one of the
+    `rule_sets`, and `column in ['a', 'b']` of a list. For the country columns, `column in NAME`
+    instead tests the flag of one of the `country_regions` on the linked Country. A Boolean column on its own is true when
+    set, and `true`/`false` are constants. Conditions combine with `and`, `or`, `not` and brackets.
+
+    The parsed condition is compiled both into a function of a FundingRequest (`applies_to`) and
+    into an equivalent SQL expression over FundingRequest's columns (`sql_expression`). Whatever
+    is tested of a column that is NULL (None) is false in both, so that `not` makes it true in both:
+    in SQL each test of a nullable column is guarded with IS NOT NULL, so NULL never reaches `not`.
+    """
+    token_pattern = re.compile(r"""\s*(?:(?P<number>-?\d+)|(?P<string>'[^']*'|"[^"]*")|(?P<operator>>=|<=|==|!=|>|<|\(|\)|\[|\]|,)|(?P<name>[A-Za-z_]\w*))""")
+    comparisons = {'==': operator.eq, '!=': operator.ne, '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self.tokenise(text)
+        self.position = 0
+        self.tree = self.parse_or()
+        if self.position < len(self.tokens):
+            raise RuleSyntaxError('Unexpected %s in: %s' % (self.tokens[self.position][1], text))
+        self.applies_to = self.compile_python(self.tree)
+        self.sql_expression = self.compile_sql(self.tree)
+
+    def get_sql_expression(self):
+        return self.sql_expression
+
+    def tokenise(self, text):
+        tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = self.token_pattern.match(text, position)
+            if not match or match.end() == position:
+                raise RuleSyntaxError('Cannot understand "%s" in: %s' % (text[position:], text))
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'number':
+                value = int(value)
+            elif kind == 'string':
+                value = value[1:-1]
+            tokens.append((kind, value))
+            position = match.end()
+        return tokens
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, expected_kind=None, expected_value=None):
+        kind, value = self.peek()
+        if kind is None or (expected_kind and kind != expected_kind) or (expected_value is not None and value != expected_value):
+            raise RuleSyntaxError('Expected %s in: %s' % (expected_value or expected_kind or 'more', self.text))
+        self.position += 1
+        return value
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ('name', 'or'):
+            self.take()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else ('or', operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == ('name', 'and'):
+            self.take()
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else ('and', operands)
+
+    def parse_not(self):
+        if self.peek() == ('name', 'not'):
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        if (kind, value) == ('operator', '('):
+            self.take()
+            tree = self.parse_or()
+            self.take('operator', ')')
+            return tree
+        name = self.take('name')
+        if name in ('true', 'false'):
+            return ('constant', name == 'true')
+        column = self.get_column(name)
+        kind, value = self.peek()
+        if kind == 'operator' and value in self.comparisons:
+            self.take()
+            literal = self.take()
+            self.check_type(column, [literal])
+            return ('compare', name, value, literal)
+        elif (kind, value) == ('name', 'in'):
+            self.take()
+            if self.peek() == ('operator', '['):
+                values = self.parse_list()
+            else:
+                set_name = self.take('name')
+                if name in country_columns and set_name in country_regions:
+                    return ('in_region', country_columns[name], set_name)
+                if set_name not in rule_sets:
+                    raise RuleSyntaxError('There is no set named %s (try one of %s)' % (set_name, ', '.join(sorted(rule_sets))))
+                values = list(rule_sets[set_name])
+            self.check_type(column, values)
+            return ('in', name, values)
+        if not isinstance(column.type, Boolean):
+            raise RuleSyntaxError('%s is not a yes/no column, compare it with something in: %s' % (name, self.text))
+        return ('column', name)
+
+    def parse_list(self):
+        self.take('operator', '[')
+        values = [self.take()]
+        while self.peek() == ('operator', ','):
+            self.take()
+            values.append(self.take())
+        self.take('operator', ']')
+        return values
+
+    def get_column(self, name):
+        try:
+            return FundingRequest.__table__.columns[name]
+        except KeyError:
+            raise RuleSyntaxError('FundingRequest has no column %s' % name)
+
+    def check_type(self, column, values):
+        expected_type = int if isinstance(column.type, Integer) else type('')
+        for value in values:
+            if not isinstance(value, expected_type) or isinstance(column.type, Boolean):
+                raise RuleSyntaxError('%r cannot be compared with %s in: %s' % (value, column.name, self.text))
+
+    def compile_python(self, tree):
+        kind = tree[0]
+        if kind == 'constant':
+            constant = tree[1]
+            return lambda funding_request: constant
+        elif kind == 'column':
+            name = tree[1]
+            return lambda funding_request: bool(getattr(funding_request, name))
+        elif kind == 'compare':
+            name, comparison, literal = tree[1], self.comparisons[tree[2]], tree[3]
+            def compare(funding_request):
+                value = getattr(funding_request, name)
+                return value is not None and comparison(value, literal)
+            return compare
+        elif kind == 'in':
+            name, values = tree[1], frozenset(tree[2])
+            return lambda funding_request: getattr(funding_request, name) in values
+        elif kind == 'in_region':
+            name, region = tree[1], tree[2]
+            return lambda funding_request: CountryDirectory.current().in_region(getattr(funding_request, name), region)
+        elif kind == 'not':
+            operand = self.compile_python(tree[1])
+            return lambda funding_request: not operand(funding_request)
+        operands = [self.compile_python(operand) for operand in tree[1]]
+        combine = any if kind == 'or' else all
+        return lambda funding_request: combine(operand(funding_request) for operand in operands)
+
+    def compile_sql(self, tree):
+        kind = tree[0]
+        if kind == 'constant':
+            return true() if tree[1] else false()
+        elif kind == 'column':
+            return self.unless_null(tree[1], getattr(FundingRequest, tree[1]) == true())
+        elif kind == 'compare':
+            return self.unless_null(tree[1], self.comparisons[tree[2]](getattr(FundingRequest, tree[1]), tree[3]))
+        elif kind == 'in':
+            return self.unless_null(tree[1], getattr(FundingRequest, tree[1]).in_(tree[2]))
+        elif kind == 'in_region':
+            flag = getattr(Country, country_regions[tree[2]])
+            return self.unless_null(tree[1], getattr(FundingRequest, tree[1]).in_(select([Country.id]).where(flag == true())))
+        elif kind == 'not':
+            return not_(self.compile_sql(tree[1]))
+        operands = [self.compile_sql(operand) for operand in tree[1]]
+        return or_(*operands) if kind == 'or' else and_(*operands)
+
+    def unless_null(self, name, expression):
+        """`expression` (a test of column `name`), but false rather than NULL when the column is NULL."""
+        column = FundingRequest.__table__.columns[name]
+        if not column.nullable:
+            return expression
+        return and_(getattr(FundingRequest, name).isnot(None), expression)
+
+
+class ScoringRule(Base):
+    """One line of the scoring rules: a criterion and the score it contributes, or a
+    funding item with the budget column it pays out and the score needed for it."""
+    __tablename__ = 'pyconza_scoring_rule'
+
+    id         = Column(Integer, primary_key=True)
+    position   = Column(Integer, nullable=False)
+    kind       = Column(UnicodeText, nullable=False)
+    label      = Column(UnicodeText, nullable=False)
+    points     = Column(Integer, nullable=False)
+    expression = Column(UnicodeText, nullable=False)
+
+    line_pattern = re.compile(r'^(?P<kind>criterion|funding)\s+(?P<points>-?\d+)\s+"(?P<label>[^"]+)"\s*:\s*(?P<expression>.+)$')
+
+    @classmethod
+    def parse(cls, text):
+        """Reads rules from lines like `criterion 35 "Accepted speaker?": number_talks_accepted > 0`
+        or `funding 60 "Travel": budget_travel` (blank lines and lines starting with # are ignored)."""
+        rules = []
+        for line_number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = cls.line_pattern.match(line)
+            if not match:
+                raise RuleSyntaxError('Line %s is not a rule: %s' % (line_number, line))
+            rules.append(cls(position=len(rules), kind=match.group('kind'), label=match.group('label'),
+                             points=int(match.group('points')), expression=match.group('expression').strip()))
+        return rules
+
+    @classmethod
+    def replace_all(cls, text):
+        """Replaces the stored rules with those in `text`, and rescores all FundingRequests with them."""
+        rules = cls.parse(text)
+        compiled = ScoringRuleSet(rules)
+        Session.query(cls).delete()
+        Session.add_all(rules)
+        Session.flush()
+        DatasetVersion.bump(cls.__tablename__)
+        ScoringRuleSet.set_current(compiled)
+        return FundingRequest.update_totals_in_bulk()
+
+    def as_text(self):
+        return '%s %s "%s": %s' % (self.kind, self.points, self.label, self.expression)
+
+
+class ScoringRuleSet(object):
+    """The scoring rules, compiled.
+
+    The rules are compiled once for each version of the stored rules (or from
+    `default_scoring_rules` if none are stored) and then looked up once per request.
+    """
+    compiled = None
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.rules = rules
+        self.criterion_rules = []
+        self.funding_item_rules = []
+        for rule in rules:
+            if rule.kind == 'criterion':
+                compiler = ConditionCompiler(rule.expression)
+                self.criterion_rules.append(CriterionRule(rule.label, rule.points, compiler.applies_to, compiler.get_sql_expression))
+            else:
+                column = FundingRequest.__table__.columns.get(rule.expression)
+                if column is None or not isinstance(column.type, Integer):
+                    raise RuleSyntaxError('%s is not an amount column of FundingRequest' % rule.expression)
+                self.funding_item_rules.append(FundingItemRule(rule.label, rule.points, rule.expression))
+
+    @classmethod
+    def current(cls):
+        context = ExecutionContext.get_context()
+        try:
+            return context.pyconza_scoring_rules
+        except AttributeError:
+            version = DatasetVersion.current(ScoringRule.__tablename__)
+            if cls.compiled is None or cls.compiled.version != version:
+                rules = Session.query(ScoringRule).order_by(ScoringRule.position).all() or ScoringRule.parse(default_scoring_rules)
+                cls.compiled = cls(rules, version=version)
+            context.pyconza_scoring_rules = cls.compiled
+            return cls.compiled
+
+    @classmethod
+    def read(cls, connection):
+        """Compiles the rules stored in the database of `connection`, for use outside of a request."""
+        table = ScoringRule.__table__
+        rows = connection.execute(select([table.c.position, table.c.kind, table.c.label, table.c.points, table.c.expression]).
+                                  order_by(table.c.position))
+        rules = [ScoringRule(**dict(row)) for row in rows] or ScoringRule.parse(default_scoring_rules)
+        return cls(rules)
+
+    @classmethod
+    def set_current(cls, rule_set):
+        ExecutionContext.get_context().pyconza_scoring_rules = rule_set
+
+    def as_text(self):
+        return '\n'.join(rule.as_text() for rule in self.rules)+'\n'
+
+
+class ScoredRequest(object):
+    """One row of a ScoreSheet: the outcome of all rules for a single FundingRequest."""
+    def __init__(self, score_sheet, row):
+        number_of_criteria = len(score_sheet.criterion_rules)
+        self.id, self.name, self.surname = row[:3]
+        self.criteria_apply = [bool(applies) for applies in row[3:3+number_of_criteria]]
+        self.criterion_scores = [rule.score_contribution if applies else 0
+                                 for rule, applies in zip(score_sheet.criterion_rules, self.criteria_apply)]
+        self.qualified_amounts = list(row[3+number_of_criteria:-1])
+        self.score_total = row[-1]
+        self.qualify_total = sum(self.qualified_amounts)
+
+
+class ScoreSheet(object):
+    """Scores many FundingRequests at once.
+
+    All criteria and qualifying amounts are computed as SQL expressions in a single query that
+    selects only the resulting numbers, so no FundingRequest (or Criterion) objects are created.
+    Iterating over a ScoreSheet yields a ScoredRequest per FundingRequest in `query`.
+    """
+    def __init__(self, query):
+        rule_set = ScoringRuleSet.current()
+        self.criterion_rules = rule_set.criterion_rules
+        self.funding_item_rules = rule_set.funding_item_rules
+        score = FundingRequest.score_total_expression()
+        columns = [FundingRequest.id, FundingRequest.name, FundingRequest.surname]
+        columns += [rule.applies_expression() for rule in self.criterion_rules]
+        columns += [rule.qualified_amount_expression(score) for rule in self.funding_item_rules]
+        columns.append(score)
+        self.query = query.with_entities(*columns)
+
+    def __iter__(self):
+        for row in self.query:
+            yield ScoredRequest(self, row)
+
+
+class Scenario(object):
+    """Alternative criterion weights and funding item thresholds (in the order of the rules) to try out."""
+    def __init__(self, name, weights, thresholds):
+        self.name = name
+        self.weights = weights
+        self.thresholds = thresholds
+
+    @classmethod
+    def from_rule_set(cls, rule_set, name='Current rules'):
+        return cls(name, [rule.score_contribution for rule in rule_set.criterion_rules],
+                   [rule.score_needed for rule in rule_set.funding_item_rules])
+
+
+class ScenarioOutcome(object):
+    """How many applicants a Scenario funds for each funding item, and what that costs."""
+    def __init__(self, scenario, funded, payouts):
+        self.scenario = scenario
+        self.funded = funded
+        self.payouts = payouts
+        self.total_payout = sum(payouts)
+
+    def as_dict(self, rule_set):
+        items = [rule.label for rule in rule_set.funding_item_rules]
+        return {'name': self.scenario.name, 'weights': self.scenario.weights, 'thresholds': self.scenario.thresholds,
+                'funded': dict(zip(items, self.funded)), 'payouts': dict(zip(items, self.payouts)),
+                'total_payout': self.total_payout}
+
+
+class ApplicantPool(object):
+    """The whole applicant pool, reduced to what is needed to try out many Scenarios at once.
+
+    Whatever the weights, applicants to whom the same criteria apply get the same score. The pool
+    is therefore read with one GROUP BY query into a group per combination of criteria (at most
+    2**criteria of them), with the number of applicants requesting each funding item and the
+    sum of what they request. Each Scenario is then evaluated per group, not per applicant.
+    """
+    def __init__(self, rule_set=None):
+        self.rule_set = rule_set or ScoringRuleSet.current()
+        flags = [rule.applies_expression() for rule in self.rule_set.criterion_rules]
+        aggregates = [func.count(FundingRequest.id)]
+        for rule in self.rule_set.funding_item_rules:
+            budget = func.coalesce(getattr(FundingRequest, rule.budget_column), 0)
+            aggregates.append(func.sum(case([(budget > 0, 1)], else_=0)))
+            aggregates.append(func.sum(budget))
+
+        number_of_criteria = len(flags)
+        self.groups = []
+        for row in Session.query(*(flags+aggregates)).group_by(*flags):
+            applies = [bool(flag) for flag in row[:number_of_criteria]]
+            requesting = [count or 0 for count in row[number_of_criteria+1::2]]
+            amounts = [amount or 0 for amount in row[number_of_criteria+2::2]]
+            self.groups.append((applies, requesting, amounts))
+
+    def simulate(self, scenarios):
+        """Returns a ScenarioOutcome for each of `scenarios`."""
+        number_of_criteria = len(self.rule_set.criterion_rules)
+        number_of_items = len(self.rule_set.funding_item_rules)
+        outcomes = []
+        for scenario in scenarios:
+            if len(scenario.weights) != number_of_criteria or len(scenario.thresholds) != number_of_items:
+                raise ValueError('%s needs %s weights and %s thresholds' % (scenario.name, number_of_criteria, number_of_items))
+            funded = [0]*number_of_items
+            payouts = [0]*number_of_items
+            for applies, requesting, amounts in self.groups:
+                score = sum([weight for weight, criterion_applies in zip(scenario.weights, applies) if criterion_applies])
+                for index, threshold in enumerate(scenario.thresholds):
+                    if score >= threshold:
+                        funded[index] += requesting[index]
+                        payouts[index] += amounts[index]
+            outcomes.append(ScenarioOutcome(scenario, funded, payouts))
+        return outcomes
+
+
+def expand_scenario_grid(name, weight_choices, threshold_choices, limit=None):
+    """Returns a Scenario for every combination of the given choices.
+
+    `weight_choices` has a list of weights to try for each criterion, and `threshold_choices`
+    a list of thresholds to try for each funding item.
+    """
+    grid = itertools.product(itertools.product(*weight_choices), itertools.product(*threshold_choices))
+    scenarios = []
+    for number, (weights, thresholds) in enumerate(grid, 1):
+        if limit and number > limit:
+            raise ValueError('%s has more than %s combinations' % (name, limit))
+        scenarios.append(Scenario('%s #%s' % (name, number), list(weights), list(thresholds)))
+    return scenarios
+
+
+class FundingScenario(Base):
+    """A named grid of Scenarios to simulate, as typed in by the super user.
+
+    `weights` and `thresholds` are comma separated values in the order of the rules; a value may
+    be several alternatives separated by | (eg "35|40") to sweep over all their combinations.
+    """
+    __tablename__ = 'pyconza_funding_scenario'
+    max_scenarios = 1000
+
+    id         = Column(Integer, primary_key=True)
+    name       = Column(UnicodeText, nullable=False)
+    weights    = Column(UnicodeText, nullable=False)
+    thresholds = Column(UnicodeText, nullable=False)
+
+    def __init__(self, name='', weights=None, thresholds=None):
+        super(FundingScenario, self).__init__()
+        current = Scenario.from_rule_set(ScoringRuleSet.current())
+        self.name = name
+        self.weights = weights or ', '.join(str(weight) for weight in current.weights)
+        self.thresholds = thresholds or ', '.join(str(threshold) for threshold in current.thresholds)
+
+    @exposed
+    def fields(self, fields):
+        fields.name = Field(label='Scenario name', required=True)
+        fields.weights = Field(label='Criterion weights', required=True)
+        fields.thresholds = Field(label='Funding item thresholds', required=True)
+
+    @exposed('save')
+    def events(self, events):
+        events.save = Event(label='Add scenario', action=Action(self.save))
+
+    def parse_choices(self, text, expected_count, description):
+        try:
+            choices = [[int(choice) for choice in value.split('|')] for value in text.split(',')]
+        except ValueError:
+            raise DomainException(message='The %s should be whole numbers, eg 35|40, 10, 20' % description)
+        if len(choices) != expected_count:
+            raise DomainException(message='Please give %s %s' % (expected_count, description))
+        return choices
+
+    def get_scenarios(self, rule_set=None):
+        rule_set = rule_set or ScoringRuleSet.current()
+        weight_choices = self.parse_choices(self.weights, len(rule_set.criterion_rules), 'criterion weights')
+        threshold_choices = self.parse_choices(self.thresholds, len(rule_set.funding_item_rules), 'funding item thresholds')
+        try:
+            return expand_scenario_grid(self.name, weight_choices, threshold_choices, limit=self.max_scenarios)
+        except ValueError as ex:
+            raise DomainException(message='%s' % ex)
+
+    def save(self):
+        self.get_scenarios()
+        Session.add(self)
+
+    @classmethod
+    def simulate_all(cls):
+        """Simulates the current rules and every stored FundingScenario, returning the ScenarioOutcomes."""
+        rule_set = ScoringRuleSet.current()
+        scenarios = [Scenario.from_rule_set(rule_set)]
+        for funding_scenario in Session.query(cls).order_by(cls.id):
+            try:
+                scenarios += funding_scenario.get_scenarios(rule_set)
+            except DomainException:
+                pass  # Written for an older set of rules
+        return ApplicantPool(rule_set).simulate(scenarios)
+
+
+class Allocation(object):
+    """An amount granted to a FundingRequest for one of its funding items."""
+    def __init__(self, funding_request_id, applicant, item_label, score, requested, granted):
+        self.funding_request_id = funding_request_id
+        self.applicant = applicant
+        self.item_label = item_label
+        self.score = score
+        self.requested = requested
+        self.granted = granted
+
+
+class AllocationResult(object):
+    """The outcome of distributing `budget` (None for no limit) with a GrantAllocator."""
+    def __init__(self, budget, allocations, item_labels):
+        self.budget = budget
+        self.allocations = allocations
+        self.total_granted = sum(allocation.granted for allocation in allocations)
+        self.coverage = sum(allocation.score*allocation.granted for allocation in allocations)
+        self.applicants_funded = len(set(allocation.funding_request_id for allocation in allocations))
+        self.granted_per_item = collections.OrderedDict((label, 0) for label in item_labels)
+        for allocation in allocations:
+            self.granted_per_item[allocation.item_label] += allocation.granted
+
+
+class GrantAllocator(object):
+    """Distributes a limited aid budget over the budget lines that applicants qualify for.
+
+    Each rand granted is worth the score of the applicant receiving it, and the score-weighted
+    total is maximised. As in a fractional knapsack, that is achieved by funding lines from the
+    highest score down (ties go to earlier funding items, then earlier applications), and
+    granting part of the line at which the budget runs out.
+
+    Lines are kept sorted, so a changed application is re-inserted without re-reading the rest,
+    and solving is a single pass. One allocator is cached per process for the current version of
+    the FundingRequest data. Changes made through the save and update events are applied to it
+    incrementally once they commit (and only if it is at the version just before theirs); if the
+    data changed in any other way, it is reloaded.
+    """
+    cached = None
+    lock = threading.Lock()
+
+    def __init__(self, item_labels, version=None):
+        self.item_labels = item_labels
+        self.version = version
+        self.lines = []
+        self.lines_by_request = {}
+        self.applicants = {}
+
+    @classmethod
+    def load(cls, version=None):
+        score_sheet = FundingRequest.score_requests()
+        allocator = cls([rule.label for rule in score_sheet.funding_item_rules], version=version)
+        for scored_request in score_sheet:
+            allocator.set_request(scored_request.id, '%s %s' % (scored_request.name, scored_request.surname),
+                                  scored_request.score_total, scored_request.qualified_amounts)
+        return allocator
+
+    @classmethod
+    def for_current_data(cls):
+        version = DatasetVersion.current(FundingRequest.__tablename__)
+        with cls.lock:
+            if cls.cached is None or cls.cached.version != version:
+                cls.cached = cls.load(version=version)
+            return cls.cached
+
+    @classmethod
+    def request_changed(cls, funding_request):
+        """Applies what `funding_request` now is to the cached allocator, after the change commits."""
+        funding_items = funding_request.get_funding_items(score_total=funding_request.score_total)
+        change = (funding_request.id, '%s %s' % (funding_request.name, funding_request.surname),
+                  funding_request.score_total, [item.qualified_amount for item in funding_items])
+
+        def apply_change(version):
+            with cls.lock:
+                allocator = cls.cached
+                if allocator and allocator.version in (version-1, version):
+                    allocator.set_request(*change)
+                    allocator.version = version
+        funding_request.bump_version(when_bumped=apply_change)
+
+    def set_request(self, funding_request_id, applicant, score, qualified_amounts):
+        self.remove_request(funding_request_id)
+        lines = [(-score, index, funding_request_id, amount)
+                 for index, amount in enumerate(qualified_amounts) if amount and amount > 0]
+        for line in lines:
+            bisect.insort(self.lines, line)
+        self.lines_by_request[funding_request_id] = lines
+        self.applicants[funding_request_id] = applicant
+
+    def remove_request(self, funding_request_id):
+        for line in self.lines_by_request.pop(funding_request_id, []):
+            del self.lines[bisect.bisect_left(self.lines, line)]
+        self.applicants.pop(funding_request_id, None)
+
+    def solve(self, budget=None, allow_partial=True):
+        with self.lock:
+            allocations = []
+            remaining = budget
+            for negative_score, item_index, funding_request_id, amount in self.lines:
+                if remaining is None or amount <= remaining:
+                    granted = amount
+                elif allow_partial:
+                    granted = remaining
+                else:
+                    continue
+                if granted > 0:
+                    allocations.append(Allocation(funding_request_id, self.applicants[funding_request_id],
+                                                  self.item_labels[item_index], -negative_score, amount, granted))
+                if remaining is not None:
+                    remaining -= granted
+                    if remaining <= 0:
+                        break
+            return AllocationResult(budget, allocations, self.item_labels)
+
+
+SummaryRow = collections.namedtuple('SummaryRow', ['label', 'applications', 'amount_requested', 'qualify_total'])
+BudgetLineRow = collections.namedtuple('BudgetLineRow', ['label', 'requested', 'qualifies'])
+
+
+class FundingSummary(object):
+    """Totals and breakdowns of all FundingRequests, for the committee.
+
+    Each is a single aggregate (GROUP BY) query over the stored columns and totals. They are
+    computed once for each version of the FundingRequest data and scoring rules, and shared by
+    all requests until either changes.
+    """
+    cached = None
+    lock = threading.Lock()
+    unfunded_budget_columns = [('budget_other', 'Other'), ('budget_own_contribution', 'Own contribution')]
+
+    def __init__(self, version=None):
+        self.version = version
+        rule_set = ScoringRuleSet.current()
+        aggregates = [func.count(FundingRequest.id),
+                      func.coalesce(func.sum(FundingRequest.amount_requested), 0),
+                      func.coalesce(func.sum(FundingRequest.qualify_total), 0)]
+
+        self.total = SummaryRow('All applications', *Session.query(*aggregates).one())
+        self.by_status = self.group_by(FundingRequest.grant_status, aggregates, FundingRequest.grant_status)
+        self.by_country = self.group_by(FundingRequest.resident_country, aggregates, func.count(FundingRequest.id).desc())
+
+        budget_sums = [func.coalesce(func.sum(getattr(FundingRequest, rule.budget_column)), 0) for rule in rule_set.funding_item_rules]
+        qualified_sums = [func.coalesce(func.sum(rule.qualified_amount_expression(FundingRequest.score_total)), 0)
+                          for rule in rule_set.funding_item_rules]
+        unfunded_sums = [func.coalesce(func.sum(getattr(FundingRequest, name)), 0) for name, label in self.unfunded_budget_columns]
+        sums = Session.query(*(budget_sums+qualified_sums+unfunded_sums)).one()
+        number_of_rules = len(rule_set.funding_item_rules)
+        self.budget_lines = [BudgetLineRow(rule.label, sums[index], sums[number_of_rules+index])
+                             for index, rule in enumerate(rule_set.funding_item_rules)]
+        self.budget_lines.extend(BudgetLineRow(label, sums[2*number_of_rules+index], 0)
+                                 for index, (name, label) in enumerate(self.unfunded_budget_columns))
+
+    def group_by(self, column, aggregates, order_by):
+        query = Session.query(column, *aggregates).group_by(column).order_by(order_by)
+        return [SummaryRow(row[0] or '(none)', *row[1:]) for row in query]
+
+    @classmethod
+    def for_current_data(cls):
+        version = (DatasetVersion.current(FundingRequest.__tablename__), ScoringRuleSet.current().version)
+        with cls.lock:
+            if cls.cached is None or cls.cached.version != version:
+                cls.cached = cls(version=version)
+            return cls.cached
+
+
+class SearchIndex(object, metaclass=abc.ABCMeta):
+    """A full-text index over the text reviewers look up FundingRequests by.
+
+    The kind of index depends on the database: an FTS5 table in SQLite, a weighted tsvector with
+    a GIN index in PostgreSQL, and elsewhere LIKE over the columns themselves (no index). It is
+    created and dropped with the FundingRequest table (or by the AddSearchIndex migration), kept up
+    to date by the save and update events and by imports, and can be refilled from scratch with `rebuild`.
+
+    A search matches FundingRequests containing every word of the query (as a prefix), with
+    matches on names and email ranked above matches in the motivation.
+    """
+    table_name = 'pyconza_funding_request_search'
+    columns = ['name', 'surname', 'email_address', 'username_on_za', 'motivation', 'budget_other_describe']
+    max_words = 10
+    chunk_size = 1000
+
+    @classmethod
+    def for_dialect(cls, dialect_name):
+        index_classes = {'sqlite': SqliteSearchIndex, 'postgresql': PostgresqlSearchIndex}
+        return index_classes.get(dialect_name, LikeSearchIndex)()
+
+    @classmethod
+    def for_current_database(cls):
+        return cls.for_dialect(Session.get_bind().dialect.name)
+
+    @classmethod
+    def get_words(cls, query_text):
+        return re.findall(r'\w+', query_text or '', re.UNICODE)[:cls.max_words]
+
+    def create(self, connection):
+        """Creates what holds the index, using `connection`."""
+
+    def drop(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS %s' % self.table_name))
+
+    def index_request(self, funding_request):
+        values = dict((name, getattr(funding_request, name) or '') for name in self.columns)
+        values['id'] = funding_request.id
+        self.store([values])
+
+    def index_requests(self, query=None):
+        """Indexes all FundingRequests in `query` (or all of them) a chunk at a time, returning how many."""
+        if query is None:
+            query = Session.query(FundingRequest)
+        Session.flush()
+        rows = query.with_entities(FundingRequest.id, *[getattr(FundingRequest, name) for name in self.columns]).\
+            order_by(FundingRequest.id).yield_per(self.chunk_size)
+        count = 0
+        rows = iter(rows)
+        chunk = list(itertools.islice(rows, self.chunk_size))
+        while chunk:
+            self.store([dict(zip(['id']+self.columns, [row[0]]+[value or '' for value in row[1:]])) for row in chunk])
+            count += len(chunk)
+            chunk = list(itertools.islice(rows, self.chunk_size))
+        return count
+
+    def rebuild(self):
+        self.clear()
+        return self.index_requests()
+
+    def search(self, query_text, limit, offset=0):
+        """Returns the ids of (up to `limit`) FundingRequests matching all the words in `query_text`, best first."""
+        words = self.get_words(query_text)
+        if not words:
+            return []
+        return self.find_ids(words, limit, offset)
+
+    def clear(self):
+        Session.execute(text('DELETE FROM %s' % self.table_name))
+
+    @abc.abstractmethod
+    def store(self, rows):
+        """Adds `rows` (dicts of the `columns` and 'id') to the index, replacing what it held for their ids."""
+
+    @abc.abstractmethod
+    def find_ids(self, words, limit, offset):
+        """The ids of (up to `limit`) FundingRequests containing all of `words` as prefixes, best first."""
+
+
+class SqliteSearchIndex(SearchIndex):
+    weights = [10.0, 10.0, 5.0, 5.0, 1.0, 1.0]
+
+    def create(self, connection):
+        connection.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='unicode61 remove_diacritics 1')" % \
+                                (self.table_name, ', '.join(self.columns))))
+
+    def store(self, rows):
+        Session.execute(text('DELETE FROM %s WHERE rowid = :id' % self.table_name), [{'id': row['id']} for row in rows])
+        Session.execute(text('INSERT INTO %s (rowid, %s) VALUES (:id, %s)' % \
+                             (self.table_name, ', '.join(self.columns), ', '.join(':%s' % name for name in self.columns))), rows)
+
+    def find_ids(self, words, limit, offset):
+        statement = 'SELECT rowid FROM %s WHERE %s MATCH :match ORDER BY bm25(%s, %s), rowid LIMIT :limit OFFSET :offset' % \
+                    (self.table_name, self.table_name, self.table_name, ', '.join(str(weight) for weight in self.weights))
+        match = ' '.join('"%s"*' % word for word in words)
+        return [row_id for (row_id,) in Session.execute(text(statement), {'match': match, 'limit': limit, 'offset': offset})]
+
+
+class PostgresqlSearchIndex(SearchIndex):
+    weighted_columns = [('A', ['name', 'surname', 'email_address', 'username_on_za']),
+                        ('B', ['motivation', 'budget_other_describe'])]
+
+    def create(self, connection):
+        connection.execute(text('CREATE TABLE IF NOT EXISTS %s (funding_request_id INTEGER PRIMARY KEY REFERENCES %s (id), document TSVECTOR NOT NULL)' % \
+                                (self.table_name, FundingRequest.__tablename__)))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_%s_document ON %s USING GIN (document)' % (self.table_name, self.table_name)))
+
+    def get_document_sql(self):
+        return ' || '.join("setweight(to_tsvector('simple', %s), '%s')" % (" || ' ' || ".join(':%s' % name for name in names), weight)
+                           for weight, names in self.weighted_columns)
+
+    def store(self, rows):
+        Session.execute(text('INSERT INTO %s (funding_request_id, document) VALUES (:id, %s) '
+                             'ON CONFLICT (funding_request_id) DO UPDATE SET document = EXCLUDED.document' % \
+                             (self.table_name, self.get_document_sql())), rows)
+
+    def find_ids(self, words, limit, offset):
+        statement = "SELECT funding_request_id FROM %s, to_tsquery('simple', :query) AS query WHERE document @@ query " \
+                    "ORDER BY ts_rank(document, query) DESC, funding_request_id LIMIT :limit OFFSET :offset" % self.table_name
+        query = ' & '.join('%s:*' % word for word in words)
+        return [row_id for (row_id,) in Session.execute(text(statement), {'query': query, 'limit': limit, 'offset': offset})]
+
+
+class LikeSearchIndex(SearchIndex):
+    def drop(self, connection):
+        pass
+
+    def clear(self):
+        pass
+
+    def store(self, rows):
+        pass
+
+    def find_ids(self, words, limit, offset):
+        conditions = [or_(*[getattr(FundingRequest, name).ilike('%%%s%%' % word) for name in self.columns]) for word in words]
+        query = Session.query(FundingRequest.id).filter(and_(*conditions)).order_by(FundingRequest.id)
+        return [row_id for (row_id,) in query.limit(limit).offset(offset)]
+
+
+class FundingExport(object):
+    """Writes out FundingRequests as CSV or JSON lines, row by row.
+
+    `parts` selects what is included: the 'columns' of FundingRequest, whether each of the 'criteria'
+    applies, and the qualifying 'amounts' per FundingItem. Rows are streamed from the database in
+    chunks of `chunk_size` and never turned into FundingRequest objects: through the Session, or
+    through a `connection` of their own when the export outlives a request (see ExportMiddleware).
+    """
+    formats = ['csv', 'jsonl']
+    chunk_size = 1000
+
+    def __init__(self, parts=('columns', 'criteria', 'amounts'), rule_set=None):
+        self.parts = parts
+        self.rule_set = rule_set
+
+    def get_columns(self):
+        columns = []
+        if 'columns' in self.parts:
+            columns += [(column.name, getattr(FundingRequest, column.key)) for column in FundingRequest.__table__.columns]
+        else:
+            columns += [('id', FundingRequest.id), ('name', FundingRequest.name), ('surname', FundingRequest.surname)]
+        rule_set = self.rule_set or ScoringRuleSet.current()
+        score = FundingRequest.score_total_expression(rule_set=rule_set)
+        if 'criteria' in self.parts:
+            columns += [(rule.label, rule.applies_expression()) for rule in rule_set.criterion_rules]
+            columns.append(('Score', score))
+        if 'amounts' in self.parts:
+            columns += [(rule.label, rule.qualified_amount_expression(score)) for rule in rule_set.funding_item_rules]
+            columns.append(('Qualifying total', FundingRequest.qualify_total_expression(score, rule_set=rule_set)))
+        return columns
+
+    def get_headers(self):
+        return [header for header, expression in self.get_columns()]
+
+    def get_rows(self, funding_request_ids=None, connection=None):
+        expressions = [expression for header, expression in self.get_columns()]
+        if connection is not None:
+            statement = select(expressions).order_by(FundingRequest.id)
+            if funding_request_ids is not None:
+                statement = statement.where(FundingRequest.id.in_(funding_request_ids))
+            result = connection.execution_options(stream_results=True).execute(statement)
+            try:
+                rows = result.fetchmany(self.chunk_size)
+                while rows:
+                    for row in rows:
+                        yield list(row)
+                    rows = result.fetchmany(self.chunk_size)
+            finally:
+                result.close()
+            return
+        query = Session.query(*expressions)
+        if funding_request_ids is not None:
+            query = query.filter(FundingRequest.id.in_(funding_request_ids))
+        for row in query.order_by(FundingRequest.id).yield_per(self.chunk_size):
+            yield list(row)
+
+    def generate_csv(self, funding_request_ids=None, headers=True, connection=None):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if headers:
+            writer.writerow(self.get_headers())
+        for row in self.get_rows(funding_request_ids=funding_request_ids, connection=connection):
+            writer.writerow(row)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+        yield output.getvalue()
+
+    def generate_jsonl(self, funding_request_ids=None, headers=True, connection=None):
+        header_names = self.get_headers()
+        for row in self.get_rows(funding_request_ids=funding_request_ids, connection=connection):
+            yield json.dumps(dict(zip(header_names, row)))+'\n'
+
+    def generate(self, export_format, funding_request_ids=None, headers=True, connection=None):
+        """Yields the export in `export_format` as text, optionally of only some FundingRequests (and without a header)."""
+        if export_format not in self.formats:
+            raise ValueError('%s is not one of %s' % (export_format, self.formats))
+        return getattr(self, 'generate_%s' % export_format)(funding_request_ids=funding_request_ids, headers=headers,
+                                                            connection=connection)
+
+
+
+class ImportedValues(object):
+    pass
+
+
+class FundingRequestImport(object):
+    """Creates FundingRequests from records (dicts keyed on FundingRequest field names) in batches.
+
+    Each record is validated with the Fields of a FundingRequest and linked to the account with its
+    email_address. Records that fail are reported in `errors` as (record number, message) and
+    skipped; they do not stop the rest of their batch from being inserted.
+    """
+    batch_size = 2000
+    lookup_chunk_size = 500
+    true_strings = ['1', 'true', 'yes', 'y', 'on']
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self.batch_size
+        self.columns = set(column.key for column in FundingRequest.__table__.columns)
+        self.specs = [spec for spec in funding_request_field_specs if spec.name in self.columns]
+        self.errors = []
+        self.imported = 0
+
+    @classmethod
+    def read_records(cls, filename):
+        if filename.endswith('.csv'):
+            with io.open(filename, encoding='utf-8', newline='') as csv_file:
+                for record in csv.DictReader(csv_file):
+                    yield record
+        else:
+            with io.open(filename, encoding='utf-8') as json_file:
+                if filename.endswith('.json'):
+                    for record in json.load(json_file):
+                        yield record
+                else:
+                    for line in json_file:
+                        if line.strip():
+                            yield json.loads(line)
+
+    def get_account_ids(self, emails):
+        account_ids = {}
+        emails = list(emails)
+        for start in range(0, len(emails), self.lookup_chunk_size):
+            chunk = emails[start:start+self.lookup_chunk_size]
+            account_ids.update(Session.query(EmailAndPasswordSystemAccount.email, EmailAndPasswordSystemAccount.id).
+                               filter(EmailAndPasswordSystemAccount.email.in_(chunk)))
+        return account_ids
+
+    def get_account_ids_with_requests(self, account_ids):
+        return set(account_id for (account_id,) in Session.query(FundingRequest.account_id).
+                                                    filter(FundingRequest.account_id.in_(account_ids)))
+
+    def as_input(self, field, value):
+        if isinstance(field, BooleanField):
+            return field.true_value if str(value).strip().lower() in self.true_strings else field.false_value
+        return '%s' % value
+
+    def validate(self, record, fields):
+        values = ImportedValues()
+        for spec in self.specs:
+            field = fields[spec.name]
+            value = record.get(spec.name)
+            if value is None or value == '':
+                if field.required:
+                    raise ValidationConstraint('%s is required' % spec.label)
+                continue
+            field.bind(spec.name, values)
+            try:
+                field.from_input(self.as_input(field, value))
+            except ValidationConstraint as ex:
+                raise ValidationConstraint('%s: %s' % (spec.label, ex.message))
+        return dict((name, value) for name, value in vars(values).items() if name in self.columns)
+
+    def import_records(self, records):
+        records = list(records)
+        schema = FundingRequestSchema.get()
+        fields = dict((spec.name, schema.get_column_field(spec.name)) for spec in self.specs)
+        emails = set((record.get('email_address') or '').strip() for record in records)
+        account_ids = self.get_account_ids(email for email in emails if email)
+        taken_account_ids = self.get_account_ids_with_requests(account_ids.values())
+        countries = CountryDirectory.current()
+
+        batch = []
+        for number, record in enumerate(records, 1):
+            try:
+                mapping = self.validate(record, fields)
+            except ValidationConstraint as ex:
+                self.errors.append((number, ex.message))
+                continue
+            mapping.update(countries.normalized(mapping))
+            account_id = account_ids.get(mapping.get('email_address'))
+            if account_id is None:
+                self.errors.append((number, 'There is no account for %s' % mapping.get('email_address')))
+                continue
+            if account_id in taken_account_ids:
+                self.errors.append((number, '%s already has a funding request' % mapping['email_address']))
+                continue
+            taken_account_ids.add(account_id)
+            mapping['account_id'] = account_id
+            batch.append((number, mapping))
+            if len(batch) >= self.batch_size:
+                self.insert_batch(batch)
+                batch = []
+        if batch:
+            self.insert_batch(batch)
+        return self.imported
+
+    def insert_batch(self, batch):
+        try:
+            self.insert_mappings([mapping for number, mapping in batch])
+        except DatabaseError:
+            for number, mapping in batch:
+                try:
+                    self.insert_mappings([mapping])
+                except DatabaseError as ex:
+                    self.errors.append((number, '%s' % ex.orig))
+
+    def insert_mappings(self, mappings):
+        savepoint = Session.begin_nested()
+        try:
+            Session.bulk_insert_mappings(FundingRequest, mappings)
+            account_ids = [mapping['account_id'] for mapping in mappings]
+            inserted = Session.query(FundingRequest).filter(FundingRequest.account_id.in_(account_ids))
+            FundingRequest.update_totals_in_bulk(inserted)
+            FundingRequestChange.record_inserted(inserted)
+            SearchIndex.for_current_database().index_requests(inserted)
+            savepoint.commit()
+        except Exception:
+            savepoint.rollback()
+            raise
+        self.imported += len(mappings)
+
+
+class JobLost(Exception):
+    """Raised in a worker busy with a Job that another worker has since claimed."""
+
+
+class Job(Base):
+    """A bulk operation over FundingRequests, queued in the database and run by `jobworker` processes.
+
+    The `kind` of job (one of `job_kinds`) selects the FundingRequests it works on, and the job
+    works through them in chunks ordered by id. Each chunk is committed together with the job's
+    progress and `cursor` (the last id done). A job whose worker died thus keeps the work done so
+    far, and is claimed by another worker once its heartbeat is older than `stale_after`. A worker
+    that was merely slow finds out before it commits its next chunk (see `keep_claim`), and leaves
+    the job to the new one. A chunk that fails is rolled back and the job queued again from its
+    cursor, after a backoff that doubles each time; only after `max_attempts` failed attempts in a
+    row is the job marked failed.
+    """
+    __tablename__ = 'pyconza_job'
+    stale_after = datetime.timedelta(minutes=5)
+    max_attempts = 5
+    retry_seconds = 30
+
+    id           = Column(Integer, primary_key=True)
+    kind         = Column(UnicodeText, nullable=False)
+    arguments    = Column(UnicodeText, nullable=False, default='{}')
+    state        = Column(UnicodeText, nullable=False, default='{}')
+    status       = Column(UnicodeText, nullable=False, default='queued', index=True)
+    total        = Column(Integer)
+    done         = Column(Integer, nullable=False, default=0)
+    cursor       = Column(Integer, nullable=False, default=0)
+    queued_by    = Column(UnicodeText)
+    queued_at    = Column(DateTime, nullable=False)
+    started_at   = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at  = Column(DateTime)
+    worker       = Column(UnicodeText)
+    result       = Column(UnicodeText)
+    error        = Column(UnicodeText)
+    attempts     = Column(Integer, nullable=False, default=0)
+    retry_at     = Column(DateTime)
+
+    @classmethod
+    def queue(cls, kind, queued_by=None, **arguments):
+        if kind not in job_kinds:
+            raise DomainException(message='There is no kind of job called %s' % kind)
+        job_kinds[kind].check_arguments(arguments)
+        job = cls(kind=kind, arguments=json.dumps(arguments, sort_keys=True), state='{}', status='queued',
+                  done=0, cursor=0, attempts=0, queued_by=queued_by, queued_at=datetime.datetime.utcnow())
+        Session.add(job)
+        Session.flush()
+        return job
+
+    @classmethod
+    def claim_next(cls, worker):
+        """Marks the oldest queued (or abandoned) job as running in `worker` and returns it, or None if there are none.
+
+        Jobs queued again after a failure are only claimed once their `retry_at` has passed.
+
+        Claiming is a conditional UPDATE, so two workers cannot claim the same job.
+        """
+        now = datetime.datetime.utcnow()
+        claimable = or_(and_(cls.status == 'queued', or_(cls.retry_at.is_(None), cls.retry_at <= now)),
+                        and_(cls.status == 'running', cls.heartbeat_at < now-cls.stale_after))
+        for (job_id,) in Session.query(cls.id).filter(claimable).order_by(cls.id).limit(10):
+            claimed = Session.query(cls).filter(cls.id == job_id, claimable).\
+                update({cls.status: 'running', cls.worker: worker, cls.heartbeat_at: now,
+                        cls.started_at: func.coalesce(cls.started_at, now)}, synchronize_session=False)
+            if claimed:
+                Session.expire_all()
+                return Session.query(cls).get(job_id)
+        return None
+
+    @classmethod
+    def recent(cls, limit=50):
+        return Session.query(cls).order_by(cls.id.desc()).limit(limit).all()
+
+    def get_arguments(self):
+        return json.loads(self.arguments)
+
+    def get_state(self):
+        return json.loads(self.state)
+
+    def set_state(self, state):
+        self.state = json.dumps(state, sort_keys=True)
+
+    @property
+    def label(self):
+        return job_kinds[self.kind].describe(self.get_arguments())
+
+    @property
+    def progress(self):
+        if self.total is None:
+            return '%s' % self.done
+        return '%s/%s (%.0f%%)' % (self.done, self.total, 100.0*self.done/self.total if self.total else 100)
+
+    def keep_claim(self, worker):
+        """Renews the heartbeat of this job if it is still claimed by `worker`, and raises JobLost if not.
+
+        It is a conditional UPDATE: until the transaction ends, the job cannot be claimed by anyone else.
+        """
+        kept = Session.query(Job).filter(Job.id == self.id, Job.status == 'running', Job.worker == worker).\
+            update({Job.heartbeat_at: datetime.datetime.utcnow()}, synchronize_session=False)
+        if not kept:
+            raise JobLost('Job %s was claimed by another worker' % self.id)
+
+    def run(self, commit, rollback):
+        """Does the rest of this (claimed) job, committing after each chunk. Returns True if it succeeded.
+
+        If it fails, the chunk it was busy with is rolled back and the job is queued to be retried from
+        its cursor (or marked failed, after `max_attempts`); False is returned either way. If another
+        worker has claimed the job in the meantime, the chunk is rolled back and the job left alone.
+        """
+        job_id = self.id
+        worker = self.worker
+        try:
+            kind = job_kinds[self.kind](self)
+            if self.total is None:
+                self.total = kind.count()
+                self.keep_claim(worker)
+                commit()
+            ids = kind.next_ids(self.cursor)
+            while ids:
+                kind.process(ids)
+                self.cursor = ids[-1]
+                self.done += len(ids)
+                self.attempts = 0
+                self.keep_claim(worker)
+                commit()
+                ids = kind.next_ids(self.cursor)
+            self.result = kind.finish()
+            self.keep_claim(worker)
+            self.error = None
+            self.status = 'done'
+            self.finished_at = datetime.datetime.utcnow()
+            commit()
+            return True
+        except JobLost:
+            rollback()
+            return False
+        except Exception as ex:
+            rollback()
+            job = Session.query(Job).get(job_id)
+            job.attempts += 1
+            job.error = '%s: %s' % (ex.__class__.__name__, ex)
+            now = datetime.datetime.utcnow()
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                job.finished_at = now
+            else:
+                job.status = 'queued'
+                job.retry_at = now+datetime.timedelta(seconds=job.retry_seconds*2**(job.attempts-1))
+            commit()
+            return False
+
+
+class JobKind(object, metaclass=abc.ABCMeta):
+    """What a kind of Job does: which FundingRequests it selects, and what it does to each chunk of them."""
+    label = None
+    chunk_size = 500
+
+    def __init__(self, job):
+        self.job = job
+        self.arguments = job.get_arguments()
+
+    @classmethod
+    def check_arguments(cls, arguments):
+        pass
+
+    @classmethod
+    def describe(cls, arguments):
+        return cls.label
+
+    def get_query(self):
+        return Session.query(FundingRequest)
+
+    def count(self):
+        return self.get_query().count()
+
+    def next_ids(self, after_id):
+        query = self.get_query().with_entities(FundingRequest.id).filter(FundingRequest.id > after_id).\
+            order_by(FundingRequest.id).limit(self.chunk_size)
+        return [funding_request_id for (funding_request_id,) in query]
+
+    @abc.abstractmethod
+    def process(self, ids):
+        """Does the work of the Job on the FundingRequests with the given `ids`, in the job's transaction."""
+
+    def finish(self):
+        return None
+
+
+class RescoreJob(JobKind):
+    label = 'Recompute stored scores'
+    chunk_size = 5000
+
+    def process(self, ids):
+        FundingRequest.update_totals_in_bulk(Session.query(FundingRequest).filter(FundingRequest.id.in_(ids)))
+
+
+class GrantStatusJob(JobKind):
+    """Sets the grant_status of the FundingRequests matching a condition in the scoring rule language."""
+    label = 'Set application status'
+
+    @classmethod
+    def check_arguments(cls, arguments):
+        if not (arguments.get('status') or '').strip():
+            raise DomainException(message='Please give the application status to set')
+        try:
+            ConditionCompiler(arguments.get('condition') or 'true')
+        except RuleSyntaxError as ex:
+            raise DomainException(message='%s' % ex)
+
+    @classmethod
+    def describe(cls, arguments):
+        return '%s to %s where %s' % (cls.label, arguments['status'], arguments.get('condition') or 'true')
+
+    def get_query(self):
+        condition = ConditionCompiler(self.arguments.get('condition') or 'true')
+        return Session.query(FundingRequest).filter(condition.sql_expression)
+
+    def process(self, ids):
+        status = self.arguments['status'].strip()
+        changing = Session.query(FundingRequest).filter(FundingRequest.id.in_(ids), or_(FundingRequest.grant_status != status,
+                                                                                        FundingRequest.grant_status.is_(None)))
+        rows = changing.with_entities(FundingRequest.id, FundingRequest.grant_status, FundingRequest.version).all()
+        if rows:
+            FundingRequestChange.record_in_bulk(dict((row_id, {'grant_status': [old_status, status]}) for row_id, old_status, version in rows),
+                                                'job', versions=dict((row_id, version+1) for row_id, old_status, version in rows),
+                                                changed_by=self.job.queued_by)
+            changing.update({FundingRequest.grant_status: status, FundingRequest.version: FundingRequest.version+1},
+                            synchronize_session=False)
+            OutboxMessage.queue_for_requests(row_id for row_id, old_status, version in rows)
+            FundingRequest.bump_version()
+
+
+class ExportJob(JobKind):
+    """Writes a FundingExport to a file in the job_output_directory, a chunk at a time.
+
+    Each worker writes a file of its own: a worker that lost the job (see `Job.keep_claim`) may still be
+    busy writing a chunk, but not into the file of the worker that took over. The worker taking over
+    starts its file with what was committed of the file it takes over from.
+    """
+    label = 'Export'
+    chunk_size = 2000
+
+    @classmethod
+    def check_arguments(cls, arguments):
+        if arguments.get('format', 'csv') not in FundingExport.formats:
+            raise DomainException(message='The format should be one of %s' % ', '.join(FundingExport.formats))
+
+    @classmethod
+    def describe(cls, arguments):
+        return '%s (%s)' % (cls.label, arguments.get('format', 'csv'))
+
+    def __init__(self, job):
+        super(ExportJob, self).__init__(job)
+        self.export = FundingExport(parts=self.arguments.get('parts') or ('columns', 'criteria', 'amounts'))
+        self.export_format = self.arguments.get('format', 'csv')
+        worker = re.sub(r'[^\w.-]+', '-', job.worker or 'worker')
+        self.filename = os.path.join(FundingConfig.get_current().job_output_directory,
+                                     'funding-export-%s-%s.%s' % (job.id, worker, self.export_format))
+
+    def process(self, ids):
+        state = self.job.get_state()
+        size = state.get('size', 0)
+        with io.open(self.filename, 'a+b') as output:
+            if state.get('filename', self.filename) == self.filename:
+                output.truncate(size)  # Drop what was written for a chunk that did not get committed
+            else:
+                output.truncate(0)
+                with io.open(state['filename'], 'rb') as previous:
+                    output.write(previous.read(size))
+            output.seek(0, io.SEEK_END)
+            headers = size == 0 and self.export_format == 'csv'
+            for chunk in self.export.generate(self.export_format, funding_request_ids=ids, headers=headers):
+                output.write(chunk.encode('utf-8'))
+            state['size'] = output.tell()
+        state['filename'] = self.filename
+        self.job.set_state(state)
+
+    def finish(self):
+        return self.filename
+
+
+job_kinds = collections.OrderedDict([('rescore', RescoreJob), ('grant_status', GrantStatusJob), ('export', ExportJob)])
+
+
+class JobRequest(object):
+    """What the super user fills in on /jobs to queue a Job."""
+    def __init__(self):
+        self.grant_status = ''
+        self.condition = ''
+        self.export_format = 'csv'
+
+    @exposed
+    def fields(self, fields):
+        fields.grant_status = Field(label='New application status')
+        fields.condition = Field(label='For applications where (eg: number_talks_accepted > 0 and grant_status == \'Pending\')')
+        fields.export_format = Field(label='Format (%s)' % ', '.join(FundingExport.formats), required=True)
+
+    @exposed('rescore', 'set_grant_status', 'export')
+    def events(self, events):
+        events.rescore = Event(label='Recompute all scores', action=Action(self.queue_rescore))
+        events.set_grant_status = Event(label='Set status', action=Action(self.queue_set_grant_status))
+        events.export = Event(label='Export', action=Action(self.queue_export))
+
+    def get_queued_by(self):
+        return CurrentUserSession.for_current_request().get_logged_in_user_email()
+
+    def queue_rescore(self):
+        Job.queue('rescore', queued_by=self.get_queued_by())
+
+    def queue_set_grant_status(self):
+        Job.queue('grant_status', queued_by=self.get_queued_by(), status=self.grant_status, condition=self.condition)
+
+    def queue_export(self):
+        Job.queue('export', queued_by=self.get_queued_by(), format=self.export_format)
+
+
+class OutboxMessage(Base):
+    """An email to an applicant, waiting to be sent by a `sendnotifications` process.
+
+    Messages are added in the same transaction as the change they announce, so none are sent for
+    changes that were rolled back, and none are lost for changes that were committed. A pending
+    message for a FundingRequest is superseded when a newer one is queued for it. Sends that failed
+    for a passing reason are retried with exponential backoff, up to mail_max_attempts times; those
+    the server refused for good (see SendFailure) are failed at once.
+    """
+    __tablename__ = 'pyconza_outbox_message'
+    __table_args__ = (Index('ix_pyconza_outbox_message_due', 'status', 'next_attempt_at'),)
+    notify_on = ['grant_status', 'feedback_message']
+    stale_after = datetime.timedelta(minutes=10)
+
+    id                 = Column(Integer, primary_key=True)
+    funding_request_id = Column(Integer, ForeignKey('pyconza_funding_request.id'), nullable=False, index=True)
+    to_address         = Column(UnicodeText, nullable=False)
+    subject            = Column(UnicodeText, nullable=False)
+    body               = Column(UnicodeText, nullable=False)
+    status             = Column(UnicodeText, nullable=False, default='pending')
+    attempts           = Column(Integer, nullable=False, default=0)
+    created_at         = Column(DateTime, nullable=False)
+    next_attempt_at    = Column(DateTime, nullable=False)
+    claimed_by         = Column(UnicodeText)
+    claimed_at         = Column(DateTime)
+    sent_at            = Column(DateTime)
+    last_error         = Column(UnicodeText)
+
+    @classmethod
+    def compose(cls, funding_request_id, email_address, name, grant_status, feedback_message):
+        subject = 'Your PyConZA financial aid application: %s' % grant_status
+        body = 'Dear %s,\n\nThe status of your application for financial aid is now: %s\n' % (name, grant_status)
+        if feedback_message:
+            body += '\n%s\n' % feedback_message
+        now = datetime.datetime.utcnow()
+        return {'funding_request_id': funding_request_id, 'to_address': email_address, 'subject': subject, 'body': body,
+                'status': 'pending', 'attempts': 0, 'created_at': now, 'next_attempt_at': now}
+
+    @classmethod
+    def queue_for_requests(cls, funding_request_ids):
+        """Queues a notification of their current status to the applicants of the given FundingRequests, with one bulk INSERT."""
+        funding_request_ids = list(funding_request_ids)
+        if not funding_request_ids:
+            return
+        Session.query(cls).filter(cls.funding_request_id.in_(funding_request_ids), cls.status == 'pending').\
+            update({cls.status: 'superseded'}, synchronize_session=False)
+        rows = Session.query(FundingRequest.id, FundingRequest.email_address, FundingRequest.name,
+                             FundingRequest.grant_status, FundingRequest.feedback_message).\
+            filter(FundingRequest.id.in_(funding_request_ids), FundingRequest.email_address.isnot(None))
+        Session.bulk_insert_mappings(cls, [cls.compose(*row) for row in rows])
+
+    @classmethod
+    def queue_if_notified(cls, funding_request, diff):
+        """Queues a notification to the applicant of `funding_request` if `diff` changed what they are told about."""
+        if set(diff) & set(cls.notify_on):
+            Session.flush()
+            cls.queue_for_requests([funding_request.id])
+
+    @classmethod
+    def claim_due(cls, limit, claimed_by):
+        """Marks up to `limit` messages that are due (or were left unsent by a dead sender) as being sent, and returns them."""
+        now = datetime.datetime.utcnow()
+        due = or_(and_(cls.status == 'pending', cls.next_attempt_at <= now),
+                  and_(cls.status == 'sending', cls.claimed_at < now-cls.stale_after))
+        ids = [message_id for (message_id,) in Session.query(cls.id).filter(due).order_by(cls.next_attempt_at, cls.id).limit(limit)]
+        if not ids:
+            return []
+        Session.query(cls).filter(cls.id.in_(ids), due).\
+            update({cls.status: 'sending', cls.claimed_by: claimed_by, cls.claimed_at: now}, synchronize_session=False)
+        return Session.query(cls).filter(cls.id.in_(ids), cls.status == 'sending', cls.claimed_by == claimed_by).all()
+
+    @classmethod
+    def record_outcomes(cls, outcomes, max_attempts, retry_seconds):
+        """Marks messages sent or failed, or schedules their next attempt; returns how many were failed.
+
+        `outcomes` maps message ids to a SendFailure, or None if the message was sent.
+        """
+        now = datetime.datetime.utcnow()
+        failed = 0
+        for message in Session.query(cls).filter(cls.id.in_(list(outcomes))):
+            failure = outcomes[message.id]
+            message.attempts += 1
+            if failure is None:
+                message.status = 'sent'
+                message.sent_at = now
+            else:
+                message.last_error = failure.error
+                if failure.permanent or message.attempts >= max_attempts:
+                    message.status = 'failed'
+                    failed += 1
+                else:
+                    delay = retry_seconds*2**(message.attempts-1)*random.uniform(1, 1.5)
+                    message.status = 'pending'
+                    message.next_attempt_at = now+datetime.timedelta(seconds=delay)
+        return failed
+
+    @classmethod
+    def count_by_status(cls):
+        return dict(Session.query(cls.status, func.count(cls.id)).group_by(cls.status))
+
+    def as_email(self, mail_from):
+        message = email.message.EmailMessage()
+        message['From'] = mail_from
+        message['To'] = self.to_address
+        message['Subject'] = self.subject
+        message.set_content(self.body)
+        return message
+
+
+class SmtpConnectionPool(object):
+    """Up to `size` SMTP connections, each used by one send at a time and kept open for the next."""
+    def __init__(self, host, port, username=None, password=None, starttls=False, size=4, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.slots = None
+
+    @classmethod
+    def from_config(cls, config, host=None, port=None):
+        return cls(host or config.smtp_host, port or config.smtp_port, username=config.smtp_username,
+                   password=config.smtp_password, starttls=config.smtp_starttls, size=config.smtp_connections)
+
+    def connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    async def acquire(self, loop, executor):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        await self.slots.acquire()
+        if self.idle:
+            return self.idle.pop()
+        try:
+            return await loop.run_in_executor(executor, self.connect)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        if broken:
+            self.close_connection(connection)
+        else:
+            self.idle.append(connection)
+        self.slots.release()
+
+    def close_connection(self, connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def close(self):
+        while self.idle:
+            self.close_connection(self.idle.pop())
+        self.slots = None
+
+
+class SendFailure(collections.namedtuple('SendFailure', ['error', 'permanent'])):
+    """Why an email was not sent, and whether that is `permanent`: a 5xx reply, which sending again will not change.
+
+    Anything else (a 4xx reply, or not being able to reach or talk to the server) may pass, so is retried.
+    """
+    @classmethod
+    def from_exception(cls, ex, connected=True):
+        if not connected:
+            return cls('Could not connect: %s' % ex, False)
+        if isinstance(ex, smtplib.SMTPRecipientsRefused):
+            permanent = bool(ex.recipients) and all(code >= 500 for code, reply in ex.recipients.values())
+        elif isinstance(ex, smtplib.SMTPResponseException):
+            permanent = ex.smtp_code >= 500
+        else:
+            permanent = False
+        return cls('%s' % ex, permanent)
+
+
+class OutboxSender(object):
+    """Drains the outbox: claims due OutboxMessages a batch at a time and sends each batch concurrently.
+
+    The database is only used between batches, from the calling thread; sending happens on an
+    asyncio loop, with the blocking smtplib calls in a thread per pooled connection.
+    """
+    def __init__(self, pool, mail_from, batch_size=100, max_attempts=6, retry_seconds=60):
+        self.pool = pool
+        self.mail_from = mail_from
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.sender_name = '%s:%s' % (socket.gethostname(), os.getpid())
+
+    @classmethod
+    def from_config(cls, config, host=None, port=None):
+        return cls(SmtpConnectionPool.from_config(config, host=host, port=port), config.mail_from,
+                   batch_size=config.mail_batch_size, max_attempts=config.mail_max_attempts,
+                   retry_seconds=config.mail_retry_seconds)
+
+    def send_due(self, commit):
+        """Sends batches until no messages are due; returns the numbers sent, failed for good, and to be retried."""
+        sent = failed = retried = 0
+        loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.pool.size)
+        try:
+            messages = OutboxMessage.claim_due(self.batch_size, self.sender_name)
+            commit()
+            while messages:
+                emails = [(message.id, message.as_email(self.mail_from)) for message in messages]
+                outcomes = loop.run_until_complete(self.send_batch(loop, executor, emails))
+                newly_failed = OutboxMessage.record_outcomes(outcomes, self.max_attempts, self.retry_seconds)
+                commit()
+                sent += sum(1 for failure in outcomes.values() if failure is None)
+                failed += newly_failed
+                retried += sum(1 for failure in outcomes.values() if failure is not None)-newly_failed
+                messages = OutboxMessage.claim_due(self.batch_size, self.sender_name)
+                commit()
+        finally:
+            self.pool.close()
+            executor.shutdown()
+            loop.close()
+        return sent, failed, retried
+
+    async def send_batch(self, loop, executor, emails):
+        results = await asyncio.gather(*[self.send_one(loop, executor, message_id, message) for message_id, message in emails])
+        return dict(results)
+
+    async def send_one(self, loop, executor, message_id, message):
+        try:
+            connection = await self.pool.acquire(loop, executor)
+        except (smtplib.SMTPException, OSError) as ex:
+            return message_id, SendFailure.from_exception(ex, connected=False)
+        try:
+            await loop.run_in_executor(executor, connection.send_message, message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as ex:
+            self.pool.release(connection)
+            return message_id, SendFailure.from_exception(ex)
+        except (smtplib.SMTPException, OSError) as ex:
+            self.pool.release(connection, broken=True)
+            return message_id, SendFailure.from_exception(ex)
+        self.pool.release(connection)
+        return message_id, None
+
+
+def normalize_country_name(name):
+    """Reduces `name` to lowercase words without accents, punctuation or "the", for matching spellings."""
+    decomposed = unicodedata.normalize('NFKD', (name or '').replace('’', "'"))
+    unaccented = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    words = re.findall(r"[a-z0-9]+", unaccented.lower().replace("'", ''))
+    return ' '.join(word for word in words if word != 'the')
+
+
+class Country(Base):
+    """A country applicants may live in or come from, with the region flags the scoring rules use."""
+    __tablename__ = 'pyconza_country'
+
+    id         = Column(Integer, primary_key=True)
+    name       = Column(UnicodeText, nullable=False, unique=True)
+    is_african = Column(Boolean, nullable=False, default=False, index=True)
+
+    @classmethod
+    def add_missing(cls, connection):
+        """Adds the countries and aliases of the reference lists that are not stored yet; returns how many names were added."""
+        table = cls.__table__
+        name_table = CountryName.__table__
+        country_ids = dict((name, country_id) for (country_id, name) in connection.execute(select([table.c.id, table.c.name])))
+        known_names = set(normalized_name for (normalized_name,) in connection.execute(select([name_table.c.normalized_name])))
+        missing = []
+        for names, is_african in [(african_countries, True), (other_countries, False)]:
+            for name in names:
+                if name not in country_ids:
+                    country_ids[name] = connection.execute(table.insert().values(name=name, is_african=is_african)).inserted_primary_key[0]
+                for alias in [name]+country_aliases.get(name, []):
+                    normalized_name = normalize_country_name(alias)
+                    if normalized_name not in known_names:
+                        known_names.add(normalized_name)
+                        missing.append({'normalized_name': normalized_name, 'country_id': country_ids[name]})
+        if missing:
+            connection.execute(name_table.insert(), missing)
+        return len(missing)
+
+
+class CountryName(Base):
+    """A normalized spelling (the name itself, or an alias) by which a Country can be found."""
+    __tablename__ = 'pyconza_country_name'
+
+    id              = Column(Integer, primary_key=True)
+    normalized_name = Column(UnicodeText, nullable=False, unique=True)
+    country_id      = Column(Integer, ForeignKey(Country.id), nullable=False, index=True)
+    country         = relationship(Country)
 
-    def __init__(self):
-        super(FundingRequest, self).__init__()
-        self.name          = ''
-        self.surname       = ''
 
-        user_session = CurrentUserSession()
+event.listen(CountryName.__table__, 'after_create', lambda table, connection, **kwargs: Country.add_missing(connection))
+
+
+CountryEntry = collections.namedtuple('CountryEntry', ['id', 'name', 'is_african'])
+
+
+class CountryDirectory(object):
+    """The stored Countries by normalized name, for matching what applicants typed.
+
+    Like ScoringRuleSet, it is loaded once for each version of the country data, and then looked
+    up once per request.
+    """
+    loaded = None
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.by_normalized_name = {}
+        for normalized_name, country_id, name, is_african in rows:
+            self.by_normalized_name[normalized_name] = CountryEntry(country_id, name, is_african)
+        countries = set(self.by_normalized_name.values())
+        self.regions = dict((region, frozenset(country.id for country in countries if getattr(country, flag)))
+                            for region, flag in country_regions.items())
+
+    @classmethod
+    def current(cls):
+        context = ExecutionContext.get_context()
+        try:
+            return context.pyconza_countries
+        except AttributeError:
+            version = DatasetVersion.current(Country.__tablename__)
+            if cls.loaded is None or cls.loaded.version != version:
+                rows = Session.query(CountryName.normalized_name, Country.id, Country.name, Country.is_african).\
+                    join(Country, CountryName.country_id == Country.id).all()
+                cls.loaded = cls(rows, version=version)
+            context.pyconza_countries = cls.loaded
+            return cls.loaded
+
+    def find(self, name):
+        return self.by_normalized_name.get(normalize_country_name(name))
+
+    def in_region(self, country_id, region):
+        return country_id in self.regions[region]
+
+    def normalized(self, values):
+        """Returns the country names in `values` (a dict keyed on column names) spelt as stored, with their ids."""
+        normalized = {}
+        for name_column, id_column in country_columns.items():
+            if name_column in values:
+                country = self.find(values[name_column])
+                normalized[name_column] = country.name if country else (values[name_column] or '').strip()
+                normalized[id_column] = country.id if country else None
+        return normalized
+
+
+class AfterCommit(object):
+    """Work to do once the current transaction of the Session has committed, and not at all if it is rolled back.
+
+    Each action is a callable, added under a key; adding to a key that is already there returns the
+    action added first instead. Actions run when SQL can no longer be emitted through the Session,
+    so they should have everything they need from it already.
+    """
+    info_key = 'pyconza_after_commit'
+
+    @classmethod
+    def add(cls, key, action):
+        actions = Session().info.setdefault(cls.info_key, collections.OrderedDict())
+        return actions.setdefault(key, action)
+
+    @classmethod
+    def run(cls, session):
+        if session.transaction is not None and session.transaction.nested:
+            return  # Only a savepoint was released
+        for action in session.info.pop(cls.info_key, {}).values():
+            try:
+                action()
+            except Exception:
+                logging.getLogger(__name__).exception('After commit: %s failed', action)
+
+    @classmethod
+    def discard(cls, session, transaction):
+        if transaction.parent is None:
+            session.info.pop(cls.info_key, None)
+
+
+event.listen(OrmSession, 'after_commit', AfterCommit.run)
+event.listen(OrmSession, 'after_transaction_end', AfterCommit.discard)
+
+
+class VersionBump(object):
+    """Increments the version of a dataset once, after a transaction that changed it, and then calls the
+    `listeners` with the new version."""
+    def __init__(self, bind, name):
+        self.bind = bind
+        self.name = name
+        self.listeners = []
+
+    def __call__(self):
+        version = DatasetVersion.increment(self.bind, self.name)
+        for listener in self.listeners:
+            listener(version)
+
+    def __repr__(self):
+        return '<VersionBump %s>' % self.name
+
+
+class DatasetVersion(Base):
+    """A counter per named dataset, incremented whenever the data in it changes; caches of the data are kept per version.
+
+    There is a row for each of the `names`, added with the table (or by AddSupportTables). A change only
+    marks its dataset with `bump`: the counter is incremented after the change commits, in a short
+    transaction of its own. Writers thus do not queue on the counter row for as long as their own
+    transactions take, and no cache is keyed on a version of data that is not committed yet.
+    """
+    __tablename__ = 'pyconza_dataset_version'
+    names = ['pyconza_funding_request', 'pyconza_scoring_rule', 'pyconza_country']
+
+    id      = Column(Integer, primary_key=True)
+    name    = Column(UnicodeText, nullable=False, unique=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, name):
+        version = Session.query(cls.version).filter_by(name=name).scalar()
+        return version or 0
+
+    @classmethod
+    def bump(cls, name, when_bumped=None):
+        """Marks `name` as changed in the current transaction. Once that commits, its version is incremented
+        (once, however often it was bumped) and `when_bumped` (if given) is called with the new version."""
+        bump = AfterCommit.add((cls.__tablename__, name), VersionBump(Session.get_bind(), name))
+        if when_bumped:
+            bump.listeners.append(when_bumped)
+
+    @classmethod
+    def increment(cls, bind, name):
+        """Increments the version of `name` in a transaction of its own on `bind`, and returns the new version."""
+        table = cls.__table__
+        with bind.begin() as connection:
+            connection.execute(table.update().where(table.c.name == name).values(version=table.c.version+1))
+            return connection.execute(select([table.c.version]).where(table.c.name == name)).scalar()
+
+    @classmethod
+    def add_missing(cls, connection):
+        table = cls.__table__
+        existing = set(name for (name,) in connection.execute(select([table.c.name])))
+        missing = [{'name': name, 'version': 0} for name in cls.names if name not in existing]
+        if missing:
+            connection.execute(table.insert(), missing)
+
+
+event.listen(DatasetVersion.__table__, 'after_create', lambda table, connection, **kwargs: DatasetVersion.add_missing(connection))
+
+
+class FundingRequestChange(Base):
+    """One entry in the append-only history of a FundingRequest: the columns an event changed.
+
+    The `diff` is JSON mapping each changed column to [old value, new value] (old is null when the
+    request was created). Derived columns (the stored totals and country links) are not tracked.
+    Changes are added in the same transaction as the change itself.
+    """
+    __tablename__ = 'pyconza_funding_request_change'
+
+    id                 = Column(Integer, primary_key=True)
+    funding_request_id = Column(Integer, ForeignKey('pyconza_funding_request.id'), nullable=False, index=True)
+    funding_request    = relationship('FundingRequest')
+    changed_at         = Column(DateTime, nullable=False, index=True)
+    changed_by         = Column(UnicodeText)
+    event              = Column(UnicodeText, nullable=False)
+    diff               = Column(UnicodeText, nullable=False)
+    version            = Column(Integer)
+
+    untracked_columns = ['id', 'version', 'score_total', 'qualify_total', 'origin_country_id', 'resident_country_id']
+
+    @classmethod
+    def get_tracked_columns(cls):
+        return [column.key for column in FundingRequest.__table__.columns if column.key not in cls.untracked_columns]
+
+    @classmethod
+    def get_diff(cls, funding_request):
+        """The tracked columns of `funding_request` changed since it was loaded (or all set ones if it is new).
+
+        A blank text and NULL count as the same: an input left empty is read back as None.
+        """
+        state = inspect(funding_request)
+        diff = {}
+        for name in cls.get_tracked_columns():
+            history = state.attrs[name].history
+            if history.has_changes():
+                old = history.deleted[0] if history.deleted else None
+                new = history.added[0] if history.added else None
+                if old != new and not (old in ('', None) and new in ('', None)):
+                    diff[name] = [old, new]
+        return diff
+
+    @classmethod
+    def record(cls, funding_request, event):
+        """Adds the pending changes of `funding_request` (before they are flushed) to its history, if there are any."""
+        diff = cls.get_diff(funding_request)
+        if diff:
+            changed_by = CurrentUserSession.for_current_request().get_logged_in_user_email()
+            Session.add(cls(funding_request=funding_request, changed_at=datetime.datetime.utcnow(), changed_by=changed_by,
+                            event=event, diff=json.dumps(diff, sort_keys=True), version=funding_request.version))
+        return diff
+
+    @classmethod
+    def record_in_bulk(cls, diffs_by_id, event, versions=None, changed_by=None):
+        """Adds a change for each FundingRequest id in `diffs_by_id` (a dict of diffs keyed on id) with one bulk INSERT.
+
+        `versions` optionally maps the ids to the versions the changes produced.
+        """
+        changed_at = datetime.datetime.utcnow()
+        versions = versions or {}
+        Session.bulk_insert_mappings(cls, [{'funding_request_id': funding_request_id, 'changed_at': changed_at,
+                                            'changed_by': changed_by, 'event': event, 'diff': json.dumps(diff, sort_keys=True),
+                                            'version': versions.get(funding_request_id)}
+                                           for funding_request_id, diff in diffs_by_id.items() if diff])
+
+    @classmethod
+    def record_inserted(cls, query, event='import'):
+        """Records the creation of each FundingRequest in `query` (eg, after a bulk insert)."""
+        names = cls.get_tracked_columns()
+        rows = query.with_entities(FundingRequest.id, *[getattr(FundingRequest, name) for name in names])
+        cls.record_in_bulk(dict((row[0], dict((name, [None, value]) for name, value in zip(names, row[1:]) if value is not None))
+                                for row in rows), event)
+
+    @classmethod
+    def changes_since(cls, since, after_id=None, limit=None):
+        """Changes made after the datetime `since`, oldest first.
+
+        To page through them, pass the changed_at and id of the last change seen as `since` and `after_id`.
+        """
+        query = Session.query(cls)
+        if after_id is None:
+            query = query.filter(cls.changed_at > since)
+        else:
+            query = query.filter(or_(cls.changed_at > since, and_(cls.changed_at == since, cls.id > after_id)))
+        query = query.order_by(cls.changed_at, cls.id)
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @classmethod
+    def made_after(cls, funding_request_id, version):
+        """The changes that took the FundingRequest with `funding_request_id` past `version`, oldest first."""
+        return Session.query(cls).filter(cls.funding_request_id == funding_request_id, cls.version > version).order_by(cls.id).all()
+
+    @classmethod
+    def timeline_for(cls, funding_request_id):
+        return Session.query(cls).filter_by(funding_request_id=funding_request_id).order_by(cls.id.desc()).all()
+
+    def get_changes(self):
+        return json.loads(self.diff)
+
+    def describe(self):
+        return '; '.join('%s: %s → %s' % (name, old if old is not None else '(none)', new)
+                         for name, (old, new) in sorted(self.get_changes().items()))
+
+    def as_dict(self):
+        return {'id': self.id, 'funding_request_id': self.funding_request_id, 'changed_at': self.changed_at.isoformat(),
+                'changed_by': self.changed_by, 'event': self.event, 'changes': self.get_changes()}
+
+
+class EditConflict(DomainException):
+    """Raised when a FundingRequest is updated from a form showing a version that someone else has changed since."""
+    def __init__(self, funding_request, seen_version):
+        changes = FundingRequestChange.made_after(funding_request.id, seen_version)
+        descriptions = ['%s by %s: %s' % (change.changed_at.strftime('%Y-%m-%d %H:%M'), change.changed_by or 'the system', change.describe())
+                        for change in changes]
+        message = 'Your changes were not saved: this application was changed after you opened it. '\
+                  'Please open it again to see the current values, then redo your changes. '
+        if descriptions:
+            message += 'What changed: %s' % ' | '.join(descriptions)
+        super(EditConflict, self).__init__(message=message)
+        self.funding_request = funding_request
+        self.changes = changes
+
+    def __reduce__(self):
+        # Reahl keeps the exception of a form to show it again; only the message is needed for that
+        return (DomainException, (self.commit, self.message))
+
+
+class FundingRequest(Base):
+    __tablename__ = 'pyconza_funding_request'
+
+    id              = Column(Integer, primary_key=True)
+
+    account_id    = Column(Integer, ForeignKey(EmailAndPasswordSystemAccount.id), nullable=False, unique=True, index=True)
+    account       = relationship(EmailAndPasswordSystemAccount)
+    
+    email_address = Column(UnicodeText, index=True)
+    name          = Column(UnicodeText)
+    surname       = Column(UnicodeText)
+    username_on_za   = Column(UnicodeText)
+    origin_country   = Column(UnicodeText)
+    resident_country = Column(UnicodeText, index=True)
+    origin_country_id   = Column(Integer, ForeignKey(Country.id), index=True)
+    resident_country_id = Column(Integer, ForeignKey(Country.id), index=True)
+    motivation       = Column(UnicodeText)
+    willing_to_help = Column(Boolean, nullable=False, default=False)
+    amount_requested = Column(Integer, default=0)
+    budget_own_contribution = Column(Integer, default=0)
+    budget_ticket    = Column(Integer, default=0)
+    budget_travel    = Column(Integer, default=0)
+    budget_accommodation = Column(Integer, default=0)
+    budget_food      = Column(Integer, default=0)
+    budget_transport = Column(Integer, default=0)
+    budget_other     = Column(Integer, default=0)
+    budget_other_describe = Column(UnicodeText, default='')
+    
+    allow_user_changes = Column(Boolean, nullable=False, default=True)
+    grant_status  = Column(UnicodeText, default='Pending', index=True)
+    feedback_message = Column(UnicodeText, default='')
+
+    number_talks_proposed = Column(Integer, default=0)
+    number_talks_accepted = Column(Integer, default=0)
+    number_keynote_talks = Column(Integer, default=0)
+
+    score_total   = Column(Integer, nullable=False, default=0, index=True)
+    qualify_total = Column(Integer, nullable=False, default=0, index=True)
+
+    version       = Column(Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+    def __init__(self):
+        super(FundingRequest, self).__init__()
+        self.name          = ''
+        self.surname       = ''
+
+        user_session = CurrentUserSession.for_current_request()
         if user_session.is_logged_in_as_normal_user():
             self.email_address = user_session.get_logged_in_user_email()
 
@@ -590,106 +3927,400 @@ class FundingRequest(Base):
         self.number_talks_accepted = 0
         self.number_keynote_talks = 0
 
+        self.score_total = 0
+        self.qualify_total = 0
+        self.version = 1
+
     @exposed
     def fields(self, fields):
-        fields.name = Field(label='Name', required=True, writable=Action(self.user_may_edit))
-        fields.email_address = EmailField(label='Email', required=self.is_user_super_user(), writable=Action(self.is_user_super_user))
+        for name, field in FundingRequestSchema.get().fields_for(self):
+            setattr(fields, name, field)
 
-        fields.surname = Field(label='Surname', required=True, writable=Action(self.user_may_edit))
-        fields.username_on_za = Field(label='Username on za.pycon.org', required=True, writable=Action(self.user_may_edit))
-        fields.origin_country = Field(label='Country of origin', required=True, writable=Action(self.user_may_edit))
-        fields.resident_country = Field(label='Country of residence', required=True, writable=Action(self.user_may_edit))
-        fields.motivation = Field(label='Motivation', required=True, writable=Action(self.user_may_edit))
+    @property
+    def seen_version(self):
+        """The version the user saw when the form was rendered (posted back from a hidden input)."""
+        return self.__dict__.get('seen_version', self.version)
 
-        fields.willing_to_help = BooleanField(label='Are you willing to help out at the event?', writable=Action(self.user_may_edit))
-        
-        fields.total_expenses   = IntegerField(label='Total expenses', required=True, writable=Action(self.user_may_edit))
-        fields.amount_requested = IntegerField(label='Aid amount requested', required=True, writable=Action(self.user_may_edit))
-        fields.budget_own_contribution = IntegerField(label='Own contribution', required=True, writable=Action(self.user_may_edit))
-        fields.budget_ticket = IntegerField(label='Conference ticket', writable=Action(self.user_may_edit))
-        fields.budget_travel = IntegerField(label='Travel',  writable=Action(self.user_may_edit))
-        fields.budget_accommodation = IntegerField(label='Accommodation',  writable=Action(self.user_may_edit))
-        fields.budget_food = IntegerField(label='Food', writable=Action(self.user_may_edit))
-        fields.budget_transport = IntegerField(label='Local transport', writable=Action(self.user_may_edit))
-        fields.budget_other = IntegerField(label='Other expenses', writable=Action(self.user_may_edit))
-        fields.budget_other_describe = Field(label='Explaination of other expenses', writable=Action(self.user_may_edit))
-        
-        fields.allow_user_changes = BooleanField(label='Allow user changes', default=True,
-                                                   readable=Action(self.is_user_super_user),
-                                                   writable=Action(self.is_user_super_user))
-
-        fields.number_talks_proposed = IntegerField(label='Number of talks proposed',
-                                                    readable=Action(self.is_user_super_user),
-                                                    writable=Action(self.is_user_super_user))
-        fields.number_talks_accepted = IntegerField(label='Number of talks accepted',
-                                                    readable=Action(self.is_user_super_user),
-                                                    writable=Action(self.is_user_super_user))
-        fields.number_keynote_talks = IntegerField(label='Number of talks accepted as keynote',
-                                                   readable=Action(self.is_user_super_user),
-                                                   writable=Action(self.is_user_super_user))
-
-        fields.grant_status = Field(label='Application status', writable=Action(self.is_user_super_user))
-        fields.feedback_message = Field(label='Feedback', writable=Action(self.is_user_super_user))
+    @seen_version.setter
+    def seen_version(self, value):
+        self.__dict__['seen_version'] = value
 
     def get_criteria(self):
-        return [Criterion('Accepted speaker?', 35, self.number_talks_accepted > 0),
-                Criterion('Additional talks accepted?', 10, self.number_talks_accepted > 1),
-                Criterion('Accepted for keynote?', 20, self.number_keynote_talks > 0),
-                Criterion('Will provide lightning talk?', 10, False),
-                Criterion('Lives in Africa?', 25, self.lives_in_africa),
-                Criterion('Lives in SA', 10, self.lives_in_sa),
-                Criterion('Willing to help at venue?', 10, self.willing_to_help)
-        ]
+        return [rule.criterion_for(self) for rule in ScoringRuleSet.current().criterion_rules]
 
-    def get_funding_items(self):
-        return [FundingItem('Conference ticket', 10, self.budget_ticket, self.score_total),
-                FundingItem('Travel', 60, self.budget_travel, self.score_total),
-                FundingItem('Accommodation', 60, self.budget_accommodation, self.score_total),
-                FundingItem('Food', 30, self.budget_food, self.score_total),
-                FundingItem('Local transport', 30, self.budget_transport, self.score_total)
-        ]
-    
-    @property
-    def lives_in_africa(self):
-        return self.resident_country in african_countries
-    
-    @property
-    def lives_in_sa(self):
-        return self.resident_country == 'South Africa'
+    def get_funding_items(self, score_total=None):
+        if score_total is None:
+            score_total = self.calculate_score_total()
+        return [rule.funding_item_for(self, score_total) for rule in ScoringRuleSet.current().funding_item_rules]
 
-    @property
-    def score_total(self):
+    def calculate_score_total(self):
         return sum([criterion.score for criterion in self.get_criteria()])
 
-    @property
-    def qualify_total(self):
-        return sum([item.qualified_amount for item in self.get_funding_items()])
+    def calculate_qualify_total(self, score_total=None):
+        return sum([item.qualified_amount for item in self.get_funding_items(score_total=score_total)])
 
-    def save(self):
-        login_session = LoginSession.for_current_session()
-        self.account = login_session.account
-        Session.add(self)
+    def update_totals(self):
+        self.score_total = self.calculate_score_total()
+        self.qualify_total = self.calculate_qualify_total(score_total=self.score_total)
 
-    @exposed('save', 'update', 'edit')
-    def events(self, events):
-        events.save = Event(label='Save', action=Action(self.save))
-        events.update = Event(label='Update')
-        events.edit = Event(label='Edit')#writable=Action(lambda: self.is_user_super_user() or self.allow_user_changes)
+    @classmethod
+    def score_total_expression(cls, rule_set=None):
+        return sum([rule.score_expression() for rule in (rule_set or ScoringRuleSet.current()).criterion_rules])
+
+    @classmethod
+    def qualify_total_expression(cls, score_expression, rule_set=None):
+        return sum([rule.qualified_amount_expression(score_expression)
+                    for rule in (rule_set or ScoringRuleSet.current()).funding_item_rules])
+
+    @classmethod
+    def score_requests(cls, funding_requests=None):
+        """Returns a ScoreSheet for the given query or list of FundingRequests (or all of them)."""
+        if funding_requests is None:
+            query = Session.query(cls)
+        elif isinstance(funding_requests, (list, tuple)):
+            query = Session.query(cls).filter(cls.id.in_([i.id for i in funding_requests]))
+        else:
+            query = funding_requests
+        return ScoreSheet(query)
 
-    def user_may_edit(self):
-        user_session = CurrentUserSession()
-        return user_session.is_logged_in_as_super_user() or (user_session.is_logged_in() and self.allow_user_changes)
+    @classmethod
+    def update_totals_in_bulk(cls, query=None):
+        """Recomputes the stored totals of all FundingRequests in `query` (or all of them) with a single UPDATE."""
+        if query is None:
+            query = Session.query(cls)
+        Session.flush()
+        score = cls.score_total_expression()
+        count = query.update({cls.score_total: score,
+                              cls.qualify_total: cls.qualify_total_expression(score)},
+                             synchronize_session=False)
+        Session.expire_all()
+        cls.bump_version()
+        return count
 
-    def is_user_super_user(self):
-        user_session = CurrentUserSession()
+    @classmethod
+    def get_sort_expression(cls, column_name):
+        """What tables sort on for `column_name`: the column, with NULL as '' or 0 if it is nullable."""
+        column = cls.__table__.columns[column_name]
+        if column.nullable:
+            return func.coalesce(column, 0 if isinstance(column.type, Integer) else '')
+        return column
+
+    @classmethod
+    def bump_version(cls, when_bumped=None):
+        DatasetVersion.bump(cls.__tablename__, when_bumped=lambda version: rendered_fragments.clear())
+        if when_bumped:
+            DatasetVersion.bump(cls.__tablename__, when_bumped=when_bumped)
+
+    def normalize_countries(self):
+        values = dict((name, getattr(self, name)) for name in country_columns)
+        for name, value in CountryDirectory.current().normalized(values).items():
+            setattr(self, name, value)
+
+    @classmethod
+    def link_countries_in_bulk(cls):
+        """Respells the countries of all FundingRequests as stored and links them to their Country, then rescores.
+
+        Only the distinct spellings are matched, with an UPDATE per spelling.
+        """
+        directory = CountryDirectory.current()
+        Session.flush()
+        for name_column, id_column in country_columns.items():
+            column = getattr(cls, name_column)
+            for (value,) in Session.query(column).distinct():
+                normalized = directory.normalized({name_column: value})
+                matching = Session.query(cls).filter(column == value)
+                if normalized[name_column] != value:
+                    FundingRequestChange.record_in_bulk(dict((funding_request_id, {name_column: [value, normalized[name_column]]})
+                                                             for (funding_request_id,) in matching.with_entities(cls.id)),
+                                                        'relink_countries')
+                matching.update({getattr(cls, name): new_value for name, new_value in normalized.items()}, synchronize_session=False)
+        return cls.update_totals_in_bulk()
+
+    def save(self):
+        user_session = CurrentUserSession.for_current_request()
         if user_session.is_logged_in_as_super_user():
-            return True
+            self.account = self.find_applicant_account(self.email_address)
         else:
-            return False
+            self.account = user_session.account
+        if self.for_account(self.account):
+            raise DomainException(message='%s has already applied for financial aid' % self.account.email)
+        self.normalize_countries()
+        self.update_totals()
+        savepoint = Session.begin_nested()  # Before adding: opening it flushes what is pending
+        Session.add(self)
+        FundingRequestChange.record(self, 'save')
+        try:
+            Session.flush()
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()  # Someone else saved a request for the account in the meantime
+            raise DomainException(message='%s has already applied for financial aid' % self.account.email)
+        SearchIndex.for_current_database().index_request(self)
+        user_session.funding_requests[self.account.id] = self
+        GrantAllocator.request_changed(self)
+
+    def update(self):
+        seen_version = self.__dict__.pop('seen_version', None)  # As posted by this submit only
+        if seen_version is None:
+            seen_version = self.version
+        with Session.no_autoflush:  # Nothing is written (nor its history lost) before it is known not to overwrite another change
+            current_version = Session.query(FundingRequest.version).filter_by(id=self.id).with_for_update().scalar()
+            if current_version != seen_version:
+                raise EditConflict(self, seen_version)
+            self.normalize_countries()
+            self.update_totals()
+            self.version = self.version+1
+            diff = FundingRequestChange.record(self, 'update')
+        Session.flush()
+        OutboxMessage.queue_if_notified(self, diff)
+        SearchIndex.for_current_database().index_request(self)
+        GrantAllocator.request_changed(self)
+
+    @exposed('save', 'update')
+    def events(self, events):
+        events.save = Event(label='Save', action=Action(self.save))
+        events.update = Event(label='Update', action=Action(self.update))
 
     @classmethod
-    def find_requests(cls, account=None):
+    def find_applicant_account(cls, email_address):
+        """The account a request created by the super user is for: the one registered with its email address."""
+        account = Session.query(EmailAndPasswordSystemAccount).filter_by(email=email_address).one_or_none()
         if not account:
-            return Session.query(FundingRequest).all()
+            raise DomainException(message='There is no account for %s: the applicant has to register first' % email_address)
+        return account
+
+    @classmethod
+    def for_account(cls, account):
+        """Returns the FundingRequest of `account` (or None), querying for it only once per request."""
+        cache = CurrentUserSession.for_current_request().funding_requests
+        if account.id not in cache:
+            found = cls.find_requests(account=account)
+            cache[account.id] = found[0] if found else None
+        return cache[account.id]
+
+    @classmethod
+    def find_requests(cls, account=None, ids=None, order_by=None, limit=None, only=None, columns=None, **filters):
+        """Finds FundingRequests, optionally only those of `account`, with one of the given `ids`, or matching
+        `filters` (column=value).
+
+        `order_by` is a list of column names (prefixed by '-' for descending order). To load less,
+        pass the names of the attributes needed in `only` (other columns are loaded when accessed),
+        or in `columns` to get tuples of just those values instead of FundingRequests.
+        """
+        if columns:
+            query = Session.query(*[getattr(cls, name) for name in columns])
         else:
-            return Session.query(FundingRequest).filter_by(account=account).all()
+            query = Session.query(cls)
+            if only:
+                query = query.options(load_only(*only))
+        if account:
+            query = query.filter(cls.account_id == account.id)
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        if filters:
+            query = query.filter_by(**filters)
+        for name in order_by or []:
+            if name.startswith('-'):
+                query = query.order_by(getattr(cls, name[1:]).desc())
+            else:
+                query = query.order_by(getattr(cls, name))
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+
+# One index per column the admin tables sort on, matching the (sort expression, id) keys of KeysetPage
+funding_request_sort_indexes = [Index('ix_%s_sort_%s' % (FundingRequest.__tablename__, column_name),
+                                      FundingRequest.get_sort_expression(column_name), FundingRequest.__table__.c.id)
+                                for column_name in ['name', 'surname', 'email_address', 'resident_country', 'grant_status',
+                                                    'amount_requested', 'score_total', 'qualify_total']]
+
+
+funding_request_field_specs = [
+    FieldSpec('name', Field, 'Name', required=True),
+    FieldSpec('email_address', EmailField, 'Email', required='super_user', writable_by='super_user'),
+
+    FieldSpec('surname', Field, 'Surname', required=True),
+    FieldSpec('username_on_za', Field, 'Username on za.pycon.org', required=True),
+    FieldSpec('origin_country', Field, 'Country of origin', required=True),
+    FieldSpec('resident_country', Field, 'Country of residence', required=True),
+    FieldSpec('motivation', Field, 'Motivation', required=True),
+
+    FieldSpec('willing_to_help', BooleanField, 'Are you willing to help out at the event?'),
+
+    FieldSpec('total_expenses', IntegerField, 'Total expenses', required=True),
+    FieldSpec('amount_requested', IntegerField, 'Aid amount requested', required=True),
+    FieldSpec('budget_own_contribution', IntegerField, 'Own contribution', required=True),
+    FieldSpec('budget_ticket', IntegerField, 'Conference ticket'),
+    FieldSpec('budget_travel', IntegerField, 'Travel'),
+    FieldSpec('budget_accommodation', IntegerField, 'Accommodation'),
+    FieldSpec('budget_food', IntegerField, 'Food'),
+    FieldSpec('budget_transport', IntegerField, 'Local transport'),
+    FieldSpec('budget_other', IntegerField, 'Other expenses'),
+    FieldSpec('budget_other_describe', Field, 'Explaination of other expenses'),
+
+    FieldSpec('allow_user_changes', BooleanField, 'Allow user changes', default=True,
+              readable_by='super_user', writable_by='super_user'),
+
+    FieldSpec('number_talks_proposed', IntegerField, 'Number of talks proposed',
+              readable_by='super_user', writable_by='super_user'),
+    FieldSpec('number_talks_accepted', IntegerField, 'Number of talks accepted',
+              readable_by='super_user', writable_by='super_user'),
+    FieldSpec('number_keynote_talks', IntegerField, 'Number of talks accepted as keynote',
+              readable_by='super_user', writable_by='super_user'),
+
+    FieldSpec('grant_status', Field, 'Application status', writable_by='super_user'),
+    FieldSpec('feedback_message', Field, 'Feedback', writable_by='super_user')
+]
+
+rule_sets = {'AFRICA': african_countries}
+
+country_columns = collections.OrderedDict([('origin_country', 'origin_country_id'), ('resident_country', 'resident_country_id')])
+country_regions = {'AFRICA': 'is_african'}
+
+default_scoring_rules = """\
+criterion 35 "Accepted speaker?": number_talks_accepted > 0
+criterion 10 "Additional talks accepted?": number_talks_accepted > 1
+criterion 20 "Accepted for keynote?": number_keynote_talks > 0
+criterion 10 "Will provide lightning talk?": false
+criterion 25 "Lives in Africa?": resident_country in AFRICA
+criterion 10 "Lives in SA": resident_country == 'South Africa'
+criterion 10 "Willing to help at venue?": willing_to_help
+funding 10 "Conference ticket": budget_ticket
+funding 60 "Travel": budget_travel
+funding 60 "Accommodation": budget_accommodation
+funding 30 "Food": budget_food
+funding 30 "Local transport": budget_transport
+"""
+
+
+class AddStoredTotals(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        table = FundingRequest.__tablename__
+        self.schedule('alter', op.add_column, table, Column('score_total', Integer, nullable=False, server_default='0'))
+        self.schedule('alter', op.add_column, table, Column('qualify_total', Integer, nullable=False, server_default='0'))
+        self.schedule('indexes', op.create_index, 'ix_%s_score_total' % table, table, ['score_total'])
+        self.schedule('indexes', op.create_index, 'ix_%s_qualify_total' % table, table, ['qualify_total'])
+        self.schedule('data', FundingRequest.update_totals_in_bulk)
+
+
+class AddFundingRequestIndexes(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        table = FundingRequest.__tablename__
+        for column_name in ['account_id', 'grant_status', 'email_address', 'resident_country']:
+            self.schedule('indexes', op.create_index, 'ix_%s_%s' % (table, column_name), table, [column_name])
+
+
+class MakeAccountIdUnique(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        table = FundingRequest.__tablename__
+        index_name = 'ix_%s_account_id' % table
+        self.schedule('alter', self.check_no_duplicates)
+        self.schedule('indexes', op.drop_index, index_name, table_name=table)
+        self.schedule('indexes', op.create_index, index_name, table, ['account_id'], unique=True)
+
+    def check_no_duplicates(self):
+        """Stops the migration, listing them, if any accounts have more than one FundingRequest."""
+        table = FundingRequest.__table__
+        duplicates = op.get_bind().execute(select([table.c.account_id, func.count(table.c.id)]).
+                                           group_by(table.c.account_id).having(func.count(table.c.id) > 1)).fetchall()
+        if duplicates:
+            rows = op.get_bind().execute(select([table.c.account_id, table.c.id]).
+                                         where(table.c.account_id.in_([account_id for account_id, count in duplicates])).
+                                         order_by(table.c.account_id, table.c.id))
+            request_ids = collections.OrderedDict()
+            for account_id, funding_request_id in rows:
+                request_ids.setdefault(account_id, []).append('%s' % funding_request_id)
+            raise DomainException(message='Cannot allow only one funding request per account: these accounts have more '
+                                          'than one (account: request ids): %s. Delete or merge the extra requests, then '
+                                          'migrate again.' % '; '.join('%s: %s' % (account_id, ', '.join(ids))
+                                                                       for account_id, ids in request_ids.items()))
+
+
+class AddCountryReferences(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        table = FundingRequest.__tablename__
+        for column_name in country_columns.values():
+            self.schedule('alter', op.add_column, table, Column(column_name, Integer))
+            self.schedule('indexes', op.create_index, 'ix_%s_%s' % (table, column_name), table, [column_name])
+            self.schedule('create_fk', op.create_foreign_key, 'fk_%s_%s' % (table, column_name), table,
+                          Country.__tablename__, [column_name], ['id'])
+        self.schedule('data', FundingRequest.link_countries_in_bulk)
+
+
+class AddFundingRequestVersion(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        table = FundingRequest.__tablename__
+        self.schedule('alter', op.add_column, table, Column('version', Integer, nullable=False, server_default='1'))
+
+
+class AddSortIndexes(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        for index in funding_request_sort_indexes:
+            self.schedule('indexes', self.create_index, index)
+
+    def create_index(self, index):
+        index.create(bind=op.get_bind())
+
+
+class AddJobRetries(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        self.schedule('alter', self.add_column_if_missing, Column('attempts', Integer, nullable=False, server_default='0'))
+        self.schedule('alter', self.add_column_if_missing, Column('retry_at', DateTime))
+
+    def add_column_if_missing(self, column):
+        # AddSupportTables creates the table with its current columns when it upgrades from before it existed
+        if column.name not in [existing['name'] for existing in inspect(op.get_bind()).get_columns(Job.__tablename__)]:
+            op.add_column(Job.__tablename__, column)
+
+
+event.listen(FundingRequest.__table__, 'after_create',
+             lambda table, connection, **kwargs: SearchIndex.for_dialect(connection.dialect.name).create(connection))
+event.listen(FundingRequest.__table__, 'before_drop',
+             lambda table, connection, **kwargs: SearchIndex.for_dialect(connection.dialect.name).drop(connection))
+
+
+class AddSearchIndex(Migration):
+    version = '0.1'
+
+    def schedule_upgrades(self):
+        self.schedule('alter', self.create_index)
+        self.schedule('data', self.rebuild_index)
+
+    def create_index(self):
+        connection = op.get_bind()
+        SearchIndex.for_dialect(connection.dialect.name).create(connection)
+
+    def rebuild_index(self):
+        SearchIndex.for_current_database().rebuild()
+
+
+class AddSupportTables(Migration):
+    version = '0.1'
+    persisted_classes = [SeedMarker, DatasetVersion, ScoringRule, FundingScenario, Country, CountryName, FundingRequestChange, Job,
+                         OutboxMessage]
+
+    def schedule_upgrades(self):
+        for persisted_class in self.persisted_classes:
+            self.schedule('alter', self.create_table, persisted_class)
+        self.schedule('data', self.add_dataset_versions)
+
+    def create_table(self, persisted_class):
+        persisted_class.__table__.create(bind=op.get_bind(), checkfirst=True)
+
+    def add_dataset_versions(self):
+        DatasetVersion.add_missing(op.get_bind())
@@ -0,0 +1,294 @@
+"""Benchmarks the views and scoring of pyconzafunding on generated data.
+
+Point it at a config directory whose database is a throwaway stand-in (SQLite or PostgreSQL) in
+which `reahl createdbtables` has been run, eg::
+
+    python -m pyconzafunding_dev.benchmark etc --sizes 1000 10000 100000 --save-baseline bench.json
+    python -m pyconzafunding_dev.benchmark etc --sizes 1000 10000 100000 --compare bench.json
+
+Data is topped up to each size in turn, so the sizes should be given in increasing order.
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import argparse
+import functools
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from reahl.component.config import StoredConfiguration
+from reahl.component.context import ExecutionContext
+from reahl.component.dbutils import SystemControl
+from reahl.sqlalchemysupport import Session
+from reahl.web.fw import ReahlWSGIApplication
+from reahl.webdev.tools import Browser, XPath
+from reahl.domain.systemaccountmodel import EmailAndPasswordSystemAccount
+
+from pyconzafunding import FundingRequest, CurrentUserSession, african_countries, example_account_emails, \
+    example_account_password, hashed_password_columns, setup_super_and_example_account, SearchIndex, rendered_fragments
+
+
+class QueryCounter(object):
+    """Counts the SQL statements executed by any Engine while it is active (in the current thread)."""
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.count = 0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is self.thread:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+
+
+class Measurement(object):
+    """Wall time (best of the repeats), peak memory and SQL statement count of running something."""
+    def __init__(self, name, seconds, peak_bytes, queries, per_second=None):
+        self.name = name
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+        self.queries = queries
+        self.per_second = per_second
+
+    @classmethod
+    def of(cls, name, function, repeat=3, before_each=None):
+        """Measures `function`, calling `before_each` (if given) before each run, eg to empty a cache."""
+        timings = []
+        for i in range(repeat):
+            if before_each:
+                before_each()
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter()-started)
+
+        if before_each:
+            before_each()
+        tracemalloc.start()
+        with QueryCounter() as counter:
+            function()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return cls(name, min(timings), peak, counter.count)
+
+    def as_dict(self):
+        return {'seconds': self.seconds, 'peak_bytes': self.peak_bytes, 'queries': self.queries,
+                'per_second': self.per_second}
+
+    def __str__(self):
+        per_second = ' %10.0f/s' % self.per_second if self.per_second else ''
+        return '%-28s %9.3fs %9.1fMB %6s queries%s' % (self.name, self.seconds, self.peak_bytes/1024/1024,
+                                                     self.queries, per_second)
+
+
+class SyntheticData(object):
+    """Creates benchmark accounts and FundingRequests with roughly the mix of a real applicant pool."""
+    email_template = 'bench%s@example.org'
+    other_countries = ['India', 'United Kingdom', 'United States', 'Germany', 'Brazil', 'Netherlands']
+    chunk_size = 1000
+
+    def __init__(self, seed=2019):
+        self.random = random.Random(seed)
+
+    def existing_count(self):
+        return Session.query(FundingRequest).filter(FundingRequest.email_address.like('bench%@example.org')).count()
+
+    def top_up_to(self, size):
+        start = self.existing_count()
+        password_columns = dict(hashed_password_columns(self.email_template % 'template'))
+        password_columns.pop('email', None)
+        for chunk_start in range(start, size, self.chunk_size):
+            numbers = range(chunk_start, min(chunk_start+self.chunk_size, size))
+            accounts = [self.make_account(self.email_template % number, password_columns) for number in numbers]
+            Session.add_all(accounts)
+            Session.flush()
+            Session.bulk_insert_mappings(FundingRequest, [self.make_request(account) for account in accounts])
+            Session.flush()
+            Session.expunge_all()
+        FundingRequest.link_countries_in_bulk()
+        SearchIndex.for_current_database().rebuild()
+        return size-start
+
+    def make_account(self, email, password_columns):
+        account = EmailAndPasswordSystemAccount()
+        for name, value in password_columns.items():
+            setattr(account, name, value)
+        account.email = email
+        account.activate()
+        return account
+
+    def choose_country(self):
+        draw = self.random.random()
+        if draw < 0.55:
+            return 'South Africa'
+        elif draw < 0.8:
+            return self.random.choice(african_countries)
+        return self.random.choice(self.other_countries)
+
+    def make_request(self, account):
+        resident_country = self.choose_country()
+        local = resident_country == 'South Africa'
+        talks_proposed = self.random.choice([0]*17+[1, 1, 2])
+        talks_accepted = min(talks_proposed, self.random.choice([0, 0, 1, 2]))
+        budget = {'budget_ticket': self.random.choice([0, 500, 1000]),
+                  'budget_travel': int(self.random.lognormvariate(7.5 if local else 9, 0.5)),
+                  'budget_accommodation': self.random.choice([0, 0, 1500, 3000, 4500]),
+                  'budget_food': self.random.choice([0, 300, 600]),
+                  'budget_transport': self.random.choice([0, 200, 400]),
+                  'budget_other': self.random.choice([0]*9+[1000])}
+        requested = sum(budget.values())
+        mapping = dict(budget,
+                       account_id=account.id, email_address=account.email,
+                       name='Name%s' % account.id, surname='Surname%s' % account.id, username_on_za='user%s' % account.id,
+                       origin_country=resident_country, resident_country=resident_country,
+                       motivation='I would like to attend because... '*self.random.randint(1, 10),
+                       willing_to_help=self.random.random() < 0.5,
+                       amount_requested=requested, budget_own_contribution=self.random.choice([0, 0, 500]),
+                       budget_other_describe='', allow_user_changes=True, grant_status='Pending', feedback_message='',
+                       number_talks_proposed=talks_proposed, number_talks_accepted=talks_accepted,
+                       number_keynote_talks=1 if talks_accepted and self.random.random() < 0.05 else 0,
+                       score_total=0, qualify_total=0)
+        return mapping
+
+
+class BenchmarkRun(object):
+    """Times every view of FundingRequestUI, and scoring, at each of a number of data sizes."""
+    view_repeat = 3
+    scoring_sample = 10000
+
+    def __init__(self, config_directory):
+        self.config_directory = config_directory
+        self.results = {}
+
+    def connect(self):
+        self.context = ExecutionContext().install()
+        self.context.config = StoredConfiguration(self.config_directory)
+        self.context.config.configure()
+        self.context.system_control = SystemControl(self.context.config)
+        self.context.system_control.connect()
+        self.wsgi_app = ReahlWSGIApplication(self.context.config)
+        self.wsgi_app.start()
+
+    def disconnect(self):
+        self.wsgi_app.stop()
+        self.context.system_control.disconnect()
+
+    def commit(self):
+        self.context.system_control.orm_control.commit()
+
+    def logged_in_browser(self, email):
+        browser = Browser(self.wsgi_app)
+        browser.open('/accounts/login')
+        browser.type(XPath.input_labelled('Email'), email)
+        browser.type(XPath.input_labelled('Password'), example_account_password)
+        browser.click(XPath.button_labelled('Log in'))
+        return browser
+
+    def measure_views(self):
+        """Measures each view with the cache of rendered tables emptied before each run (cold), and with it
+        filled by an earlier run (warm)."""
+        admin = self.logged_in_browser(CurrentUserSession.super_user_email_address)
+        applicant = self.logged_in_browser(example_account_emails[0])
+        some_request_id = Session.query(FundingRequest.id).order_by(FundingRequest.id).limit(1).scalar()
+        views = [('/', applicant), ('/myapplication', applicant),
+                 ('/requests', admin), ('/search?q=Surname1', admin), ('/scores', admin), ('/results', admin),
+                 ('/edit?funding_request_id=%s' % some_request_id, admin)]
+        measurements = []
+        for path, browser in views:
+            name = 'GET %s' % path.split('?')[0]
+            open_view = functools.partial(browser.open, path)
+            measurements.append(Measurement.of('%s (cold)' % name, open_view, repeat=self.view_repeat,
+                                               before_each=rendered_fragments.clear))
+            open_view()
+            measurements.append(Measurement.of('%s (warm)' % name, open_view, repeat=self.view_repeat))
+        return measurements
+
+    def measure_scoring(self):
+        funding_requests = Session.query(FundingRequest).limit(self.scoring_sample).all()
+
+        def score_each():
+            for funding_request in funding_requests:
+                funding_request.calculate_score_total()
+                funding_request.calculate_qualify_total()
+
+        def score_sheet():
+            list(FundingRequest.score_requests())
+
+        total = Session.query(FundingRequest).count()
+        measurements = [Measurement.of('score_total/qualify_total', score_each),
+                        Measurement.of('ScoreSheet (all rows)', score_sheet)]
+        measurements[0].per_second = len(funding_requests)/measurements[0].seconds if measurements[0].seconds else None
+        measurements[1].per_second = total/measurements[1].seconds if measurements[1].seconds else None
+        return measurements
+
+    def run(self, sizes):
+        self.connect()
+        try:
+            setup_super_and_example_account()
+            data = SyntheticData()
+            for size in sizes:
+                created = data.top_up_to(size)
+                self.commit()
+                print('%s funding requests (%s new):' % (size, created))
+                measurements = self.measure_views()+self.measure_scoring()
+                for measurement in measurements:
+                    print('  %s' % measurement)
+                self.results[str(size)] = dict((m.name, m.as_dict()) for m in measurements)
+        finally:
+            self.disconnect()
+        return self.results
+
+
+def find_regressions(baseline, results, tolerance):
+    """Lists what got slower, bigger or chattier than `baseline` by more than `tolerance` (a fraction)."""
+    regressions = []
+    for size, measurements in results.items():
+        for name, measured in measurements.items():
+            expected = baseline.get(size, {}).get(name)
+            if not expected:
+                continue
+            if measured['seconds'] > expected['seconds']*(1+tolerance):
+                regressions.append('%s@%s: %.3fs, was %.3fs' % (name, size, measured['seconds'], expected['seconds']))
+            if measured['peak_bytes'] > expected['peak_bytes']*(1+tolerance):
+                regressions.append('%s@%s: peak %s bytes, was %s' % (name, size, measured['peak_bytes'], expected['peak_bytes']))
+            if measured['queries'] > expected['queries']:
+                regressions.append('%s@%s: %s queries, was %s' % (name, size, measured['queries'], expected['queries']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config_directory', help='the config directory of a throwaway database')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--save-baseline', dest='save_baseline', help='write the results to this file')
+    parser.add_argument('--compare', dest='compare', help='fail if results regressed against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='fraction by which time/memory may grow')
+    args = parser.parse_args(argv)
+
+    results = BenchmarkRun(args.config_directory).run(sorted(args.sizes))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu import Fixture, uses
+from reahl.sqlalchemysupport import Session
+from reahl.web_dev.fixtures import WebFixture
+from reahl.webdev.tools import Browser, XPath
+from reahl.domain.systemaccountmodel import EmailAndPasswordSystemAccount
+
+from pyconzafunding import FundingRequest, FundingRequestUI, CurrentUserSession, example_account_password, \
+    hashed_password_columns
+from pyconzafunding_dev.benchmark import SyntheticData
+
+
+def type_in_textarea(browser, label, text):
+    """Types `text` into the <textarea> of the <label> with text `label`. (Browser.type only finds an input
+    by its form attribute, which a TextArea does not render.)"""
+    [textarea] = browser.xpath('//textarea[@id=//label[normalize-space(node())=normalize-space("%s")]/@for]' % label)
+    form_id = textarea.xpath('ancestor::form/@id')[0]
+    browser.last_response.forms[form_id].fields[textarea.name][0].value = text
+
+
+@uses(web_fixture=WebFixture)
+class FundingFixture(Fixture):
+    """Accounts, FundingRequests and Browsers logged in to FundingRequestUI, in the transaction of a test."""
+    def new_synthetic_data(self):
+        return SyntheticData()
+
+    def new_password_columns(self):
+        password_columns = dict(hashed_password_columns('template@example.org'))
+        password_columns.pop('email', None)
+        return password_columns
+
+    def new_account(self, email='applicant@example.org'):
+        account = Session.query(EmailAndPasswordSystemAccount).filter_by(email=email).one_or_none()
+        if not account:
+            account = self.synthetic_data.make_account(email, self.password_columns)
+            Session.add(account)
+            Session.flush()
+        return account
+
+    def new_funding_request(self, account=None, **values):
+        """A FundingRequest like the benchmark's, with the given column `values` instead."""
+        account = account or self.account
+        Session.bulk_insert_mappings(FundingRequest, [dict(self.synthetic_data.make_request(account), **values)])
+        return Session.query(FundingRequest).filter_by(account_id=account.id).one()
+
+    def new_import_record(self, email_address):
+        """A record as FundingRequestImport reads it from a CSV file: all strings."""
+        return {'name': 'Imported', 'surname': 'Applicant', 'email_address': email_address, 'username_on_za': 'imported',
+                'origin_country': 'South Africa', 'resident_country': 'South Africa',
+                'motivation': 'I would like to attend because...', 'willing_to_help': 'yes',
+                'amount_requested': '3000', 'budget_own_contribution': '0', 'budget_travel': '3000'}
+
+    def new_wsgi_app(self):
+        return self.web_fixture.new_wsgi_app(site_root=FundingRequestUI, enable_js=False)
+
+    def new_browser(self, email=None):
+        """A Browser on the app, logged in as `email` (if given)."""
+        browser = Browser(self.wsgi_app)
+        if email:
+            self.new_account(email)
+            Session.flush()
+            browser.open('/accounts/login')
+            browser.type(XPath.input_labelled('Email'), email)
+            browser.type(XPath.input_labelled('Password'), example_account_password)
+            browser.click(XPath.button_labelled('Log in'))
+        return browser
+
+    def new_super_user_browser(self):
+        return self.new_browser(email=CurrentUserSession.super_user_email_address)
+
+    def create_request(self, browser, email_address):
+        """Fills in and saves the form on /create (as the super user) for the applicant registered as `email_address`."""
+        browser.open('/create')
+        for label, value in [('Name', 'Created'), ('Surname', 'Applicant'), ('Email', email_address),
+                             ('Username on za.pycon.org', 'created'), ('Country of origin', 'South Africa'),
+                             ('Country of residence', 'South Africa'), ('Aid amount requested', '3000'), ('Own contribution', '0')]:
+            browser.type(XPath.input_labelled(label), value)
+        type_in_textarea(browser, 'Motivation', 'I would like to attend because...')
+        browser.click(XPath.button_labelled('Save'))
@@ -0,0 +1,285 @@
+"""Simulates a deadline surge of applicants and finds the concurrency at which the app degrades.
+
+Each simulated applicant logs in as one of the applicant%s@example.org accounts, opens
+/myapplication, submits the application form and then polls / a few times. All applicants of a
+level start together; levels are run in increasing order with fresh accounts, eg::
+
+    python -m pyconzafunding_dev.loadtest etc --levels 10 50 100 250 500 1000
+
+By default the WSGI app runs in-process. To measure a deployed stack instead, start a local server
+on the same (throwaway) database and pass its URL with --url (this needs WSGIProxy2). Accounts
+that already applied in an earlier run update their application instead of submitting a new one.
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+
+from reahl.component.context import ExecutionContext
+from reahl.sqlalchemysupport import Session
+from reahl.webdev.tools import Browser, XPath
+from reahl.domain.systemaccountmodel import EmailAndPasswordSystemAccount
+
+from pyconzafunding import example_account_emails, example_account_password, hashed_password_columns, \
+    setup_super_and_example_account, funding_request_field_specs
+from pyconzafunding_dev.benchmark import BenchmarkRun, SyntheticData
+
+
+def percentile(values, fraction):
+    """The nearest-rank percentile of `values` (eg fraction=0.95), or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(fraction*len(ordered)))-1, 0)]
+
+
+class LevelResult(object):
+    """What happened when `concurrency` applicants went through the flow at once."""
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.latencies = {}
+        self.errors = {}
+        self.completed = 0
+        self.submitted = 0
+        self.updated = 0
+        self.seconds = 0
+
+    def record(self, step, seconds, error=None):
+        self.latencies.setdefault(step, []).append(seconds)
+        if error:
+            self.errors.setdefault(step, []).append(error)
+
+    @property
+    def requests(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    @property
+    def error_count(self):
+        return sum(len(errors) for errors in self.errors.values())
+
+    @property
+    def error_rate(self):
+        return self.error_count/self.requests if self.requests else 0
+
+    @property
+    def throughput(self):
+        """Applicants that got through the whole flow, per second."""
+        return self.completed/self.seconds if self.seconds else 0
+
+    @property
+    def p95(self):
+        return percentile([latency for latencies in self.latencies.values() for latency in latencies], 0.95)
+
+    def as_dict(self):
+        steps = {}
+        for step, latencies in self.latencies.items():
+            steps[step] = {'requests': len(latencies), 'errors': len(self.errors.get(step, [])),
+                           'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+                           'p99': percentile(latencies, 0.99), 'max': max(latencies)}
+        return {'concurrency': self.concurrency, 'seconds': self.seconds, 'completed': self.completed,
+                'submitted': self.submitted, 'updated': self.updated, 'requests': self.requests,
+                'requests_per_second': self.requests/self.seconds if self.seconds else 0,
+                'throughput': self.throughput, 'error_rate': self.error_rate, 'p95': self.p95, 'steps': steps}
+
+    def __str__(self):
+        lines = ['%5s applicants: %6.1f completed/s, %7.1f requests/s, p95 %6.3fs, %5.1f%% errors (%s new, %s updated)' %
+                 (self.concurrency, self.throughput, self.requests/self.seconds if self.seconds else 0,
+                  self.p95 or 0, 100*self.error_rate, self.submitted, self.updated)]
+        for step in SimulatedApplicant.steps:
+            latencies = self.latencies.get(step)
+            if latencies:
+                lines.append('        %-16s p50 %6.3fs  p95 %6.3fs  p99 %6.3fs  max %6.3fs  %s errors' %
+                             (step, percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99),
+                              max(latencies), len(self.errors.get(step, []))))
+        return '\n'.join(lines)
+
+
+class SimulatedApplicant(object):
+    """One applicant going through login, /myapplication, submitting the form and polling /."""
+    steps = ['login', 'open form', 'submit', 'poll status']
+    form_values = {'name': 'Load', 'surname': 'Tester', 'username_on_za': 'loadtester',
+                   'origin_country': 'South Africa', 'resident_country': 'south africa ',
+                   'motivation': 'I would like to attend because...', 'amount_requested': '3000',
+                   'budget_own_contribution': '0', 'budget_ticket': '1000', 'budget_travel': '1500',
+                   'budget_accommodation': '500'}
+
+    def __init__(self, app, email, result, lock, polls=3, think_seconds=0.5):
+        self.app = app
+        self.email = email
+        self.result = result
+        self.lock = lock
+        self.polls = polls
+        self.think_seconds = think_seconds
+        self.labels = dict((spec.name, spec.label) for spec in funding_request_field_specs)
+
+    def timed(self, step, action):
+        started = time.perf_counter()
+        error = None
+        try:
+            action()
+        except Exception as ex:
+            error = '%s: %s' % (ex.__class__.__name__, ex)
+        with self.lock:
+            self.result.record(step, time.perf_counter()-started, error)
+        return error is None
+
+    def log_in(self):
+        self.browser.open('/accounts/login')
+        self.browser.type(XPath.input_labelled('Email'), self.email)
+        self.browser.type(XPath.input_labelled('Password'), example_account_password)
+        self.browser.click(XPath.button_labelled('Log in'))
+
+    def submit(self):
+        is_new = self.browser.is_element_present(XPath.button_labelled('Save'))
+        for name, value in self.form_values.items():
+            self.browser.type(XPath.input_labelled(self.labels[name]), value)
+        self.browser.click(XPath.button_labelled('Save' if is_new else 'Update'))
+        with self.lock:
+            if is_new:
+                self.result.submitted += 1
+            else:
+                self.result.updated += 1
+
+    def run(self):
+        self.browser = Browser(self.app)
+        if not (self.timed('login', self.log_in) and
+                self.timed('open form', lambda: self.browser.open('/myapplication')) and
+                self.timed('submit', self.submit)):
+            return
+        for poll in range(self.polls):
+            time.sleep(self.think_seconds)
+            if not self.timed('poll status', lambda: self.browser.open('/')):
+                return
+        with self.lock:
+            self.result.completed += 1
+
+
+class LoadTest(BenchmarkRun):
+    """Runs SimulatedApplicants at increasing levels of concurrency, each in its own thread."""
+    email_template = 'applicant%s@example.org'
+
+    def __init__(self, config_directory, url=None, polls=3, think_seconds=0.5):
+        super(LoadTest, self).__init__(config_directory)
+        self.url = url
+        self.polls = polls
+        self.think_seconds = think_seconds
+
+    def ensure_accounts(self, count):
+        """Creates applicant accounts beyond those of setup_super_and_example_account, up to `count` in all."""
+        setup_super_and_example_account()
+        emails = [self.email_template % number for number in range(count)]
+        existing = set(email for (email,) in Session.query(EmailAndPasswordSystemAccount.email).
+                                              filter(EmailAndPasswordSystemAccount.email.in_(emails)))
+        missing = [email for email in emails if email not in existing]
+        if missing:
+            password_columns = dict(hashed_password_columns(example_account_emails[0]))
+            password_columns.pop('email', None)
+            synthetic_data = SyntheticData()
+            Session.add_all([synthetic_data.make_account(email, password_columns) for email in missing])
+        self.commit()
+        return emails
+
+    def run_level(self, emails):
+        result = LevelResult(len(emails))
+        lock = threading.Lock()
+        start = threading.Barrier(len(emails)+1)
+        app = self.url or self.wsgi_app
+        parent_context = self.context
+
+        def simulate(email):
+            context = ExecutionContext()
+            context.config = parent_context.config
+            context.system_control = parent_context.system_control
+            context.install()
+            applicant = SimulatedApplicant(app, email, result, lock, polls=self.polls, think_seconds=self.think_seconds)
+            start.wait()
+            applicant.run()
+
+        threads = [threading.Thread(target=simulate, args=(email,)) for email in emails]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        result.seconds = time.perf_counter()-started
+        return result
+
+    def run(self, levels):
+        self.connect()
+        try:
+            emails = self.ensure_accounts(sum(levels))
+            results = []
+            first = 0
+            for level in levels:
+                result = self.run_level(emails[first:first+level])
+                first += level
+                print(result)
+                results.append(result)
+        finally:
+            self.disconnect()
+        return results
+
+
+def find_knee(results, max_p95, max_error_rate, min_gain):
+    """Returns the last level that was still fine, the first degraded one (or None), and why it is degraded.
+
+    A level is degraded when its 95th percentile latency or error rate is over the limit, or when
+    its throughput grew by less than `min_gain` (a fraction) over the previous level.
+    """
+    previous = None
+    for result in results:
+        reasons = []
+        if result.p95 is not None and result.p95 > max_p95:
+            reasons.append('p95 %.3fs > %.3fs' % (result.p95, max_p95))
+        if result.error_rate > max_error_rate:
+            reasons.append('error rate %.1f%% > %.1f%%' % (100*result.error_rate, 100*max_error_rate))
+        if previous and result.throughput < previous.throughput*(1+min_gain):
+            reasons.append('throughput %.1f/s, was %.1f/s at %s' % (result.throughput, previous.throughput, previous.concurrency))
+        if reasons:
+            return previous, result, reasons
+        previous = result
+    return previous, None, []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config_directory', help='the config directory of a throwaway database')
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 50, 100, 250, 500, 1000],
+                        help='the numbers of concurrent applicants to try')
+    parser.add_argument('--url', default=None, help='drive a server at this URL instead of the app in-process')
+    parser.add_argument('--polls', type=int, default=3, help='how often each applicant polls / after submitting')
+    parser.add_argument('--think-seconds', dest='think_seconds', type=float, default=0.5, help='the pause between polls')
+    parser.add_argument('--max-p95', dest='max_p95', type=float, default=2.0, help='the slowest acceptable p95 latency (s)')
+    parser.add_argument('--max-error-rate', dest='max_error_rate', type=float, default=0.01, help='the acceptable fraction of errors')
+    parser.add_argument('--min-gain', dest='min_gain', type=float, default=0.1,
+                        help='the throughput gain (a fraction) below which more concurrency counts as degraded')
+    parser.add_argument('--json', dest='json_output', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = LoadTest(args.config_directory, url=args.url, polls=args.polls,
+                       think_seconds=args.think_seconds).run(sorted(args.levels))
+
+    last_good, degraded, reasons = find_knee(results, args.max_p95, args.max_error_rate, args.min_gain)
+    if degraded:
+        print('Degrades at %s concurrent applicants (%s); last good level: %s' %
+              (degraded.concurrency, '; '.join(reasons), last_good.concurrency if last_good else 'none'))
+    else:
+        print('No degradation up to %s concurrent applicants' % results[-1].concurrency)
+
+    if args.json_output:
+        with open(args.json_output, 'w') as json_file:
+            json.dump({'levels': [result.as_dict() for result in results],
+                       'last_good': last_good.concurrency if last_good else None,
+                       'degraded': degraded.concurrency if degraded else None, 'reasons': reasons},
+                      json_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+
+from pyconzafunding import AllocationPanel, DatasetVersion, FundingRequest, GrantAllocator
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+def new_allocator():
+    allocator = GrantAllocator(['Travel', 'Accommodation'])
+    allocator.set_request(1, 'Low Scorer', 10, [1000, 500])
+    allocator.set_request(2, 'High Scorer', 50, [2000, 0])
+    allocator.set_request(3, 'Middle Scorer', 30, [None, 800])
+    return allocator
+
+
+def test_the_highest_scores_are_funded_first():
+    allocator = new_allocator()
+
+    result = allocator.solve(budget=3000)
+    assert [(allocation.applicant, allocation.item_label, allocation.granted) for allocation in result.allocations] == \
+        [('High Scorer', 'Travel', 2000), ('Middle Scorer', 'Accommodation', 800), ('Low Scorer', 'Travel', 200)]
+    assert (result.total_granted, result.applicants_funded) == (3000, 3)
+    assert result.granted_per_item == {'Travel': 2200, 'Accommodation': 800}
+
+    result = allocator.solve(budget=3000, allow_partial=False)
+    assert [allocation.granted for allocation in result.allocations] == [2000, 800]
+
+    assert allocator.solve().total_granted == 4300
+
+
+def test_a_changed_request_is_reallocated():
+    allocator = new_allocator()
+
+    allocator.set_request(1, 'Low Scorer', 60, [1000, 500])
+    assert [allocation.funding_request_id for allocation in allocator.solve(budget=1500).allocations] == [1, 1]
+
+    allocator.remove_request(1)
+    assert [allocation.funding_request_id for allocation in allocator.solve().allocations] == [2, 3]
+
+
+def applicants_shown(browser):
+    return [cell.text_content() for cell in browser.xpath('//table/tbody/tr/td[1]')]
+
+
+@with_fixtures(FundingFixture)
+def test_allocations_are_shown_a_page_at_a_time(funding_fixture):
+    browser = funding_fixture.super_user_browser
+    allocator = new_allocator()
+    allocator.version = DatasetVersion.current(FundingRequest.__tablename__)
+    original_allocator, original_page_size = GrantAllocator.cached, AllocationPanel.page_size
+    GrantAllocator.cached, AllocationPanel.page_size = allocator, 2
+    try:
+        browser.open('/allocation?budget=3000')
+        assert browser.is_element_present(XPath.caption_with_text('Allocation (1 to 2 of 3)'))
+        assert applicants_shown(browser) == ['High Scorer', 'Middle Scorer']
+        assert not browser.is_element_present(XPath.link_with_text('Previous page'))
+
+        browser.click(XPath.link_with_text('Next page'))
+        assert browser.is_element_present(XPath.caption_with_text('Allocation (3 to 3 of 3)'))
+        assert applicants_shown(browser) == ['Low Scorer']
+        assert not browser.is_element_present(XPath.link_with_text('Next page'))
+    finally:
+        GrantAllocator.cached, AllocationPanel.page_size = original_allocator, original_page_size
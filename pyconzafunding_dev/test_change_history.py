@@ -0,0 +1,50 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import datetime
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import CurrentUserSession, FundingRequestChange
+from pyconzafunding_dev.fixtures import FundingFixture, type_in_textarea
+
+
+@with_fixtures(FundingFixture)
+def test_an_update_records_only_what_it_changed(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('history@example.org'),
+                                                          grant_status='Pending', feedback_message='')
+    version = funding_request.version
+    browser = funding_fixture.super_user_browser
+
+    browser.open('/edit/%s' % funding_request.id)
+    browser.type(XPath.input_labelled('Application status'), 'Approved')
+    type_in_textarea(browser, 'Feedback', 'Welcome!')
+    browser.click(XPath.button_labelled('Update'))
+
+    [change] = FundingRequestChange.timeline_for(funding_request.id)
+    assert change.get_changes() == {'grant_status': ['Pending', 'Approved'], 'feedback_message': ['', 'Welcome!']}
+    assert (change.event, change.changed_by, change.version) == \
+        ('update', CurrentUserSession.super_user_email_address, version+1)
+    assert FundingRequestChange.made_after(funding_request.id, version) == [change]
+    assert FundingRequestChange.made_after(funding_request.id, version+1) == []
+
+    browser.open('/history/%s' % funding_request.id)
+    assert [cell.text_content() for cell in browser.xpath('//table/tbody/tr/td[4]')] == [change.describe()]
+
+
+@with_fixtures(FundingFixture)
+def test_changes_since_a_time_are_paged_in_order(funding_fixture):
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('since%s@example.org' % number))
+                        for number in range(3)]
+    since = datetime.datetime.utcnow()-datetime.timedelta(seconds=1)
+    FundingRequestChange.record_in_bulk(dict((funding_request.id, {'grant_status': ['Pending', 'Approved']})
+                                             for funding_request in funding_requests), 'job')
+    Session.flush()
+
+    first_page = FundingRequestChange.changes_since(since, limit=2)
+    last = first_page[-1]
+    second_page = FundingRequestChange.changes_since(last.changed_at, after_id=last.id, limit=2)
+
+    assert [change.funding_request_id for change in first_page+second_page] == [funding_request.id for funding_request in funding_requests]
+    assert FundingRequestChange.changes_since(datetime.datetime.utcnow()+datetime.timedelta(seconds=1)) == []
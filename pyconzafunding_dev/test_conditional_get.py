@@ -0,0 +1,55 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import ConditionalGetMiddleware
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+class ConditionalGetFixture(FundingFixture):
+    def new_wsgi_app(self):
+        # The connection of the test's transaction, so that the middleware sees the logins of the test
+        application = super(ConditionalGetFixture, self).new_wsgi_app()
+        return ConditionalGetMiddleware(application, Session.connection(), self.web_fixture.config.web)
+
+    def open_requests(self, browser, etag=None):
+        headers = {'If-None-Match': str('"%s"' % etag)} if etag else {}
+        browser.open('/requests', follow_redirects=False, headers=headers, status='*')
+        return browser.last_response
+
+
+@with_fixtures(ConditionalGetFixture)
+def test_the_super_user_gets_304_for_a_page_it_already_has(fixture):
+    browser = fixture.new_super_user_browser()
+
+    response = fixture.open_requests(browser)
+    assert response.status_int == 200
+    etag = response.etag
+    assert etag
+
+    response = fixture.open_requests(browser, etag=etag)
+    assert response.status_int == 304
+    assert response.etag == etag
+
+    response = fixture.open_requests(browser, etag='something else')
+    assert response.status_int == 200
+
+
+@with_fixtures(ConditionalGetFixture)
+def test_only_the_super_user_is_answered_without_the_application(fixture):
+    browser = fixture.new_super_user_browser()
+    etag = fixture.open_requests(browser).etag
+
+    browser.open('/')
+    browser.click(XPath.button_labelled('Log out'))
+
+    response = fixture.open_requests(browser, etag=etag)
+    assert response.status_int != 304
+    assert not response.etag
+
+    applicant = fixture.new_browser(email='applicant@example.org')
+    response = fixture.open_requests(applicant, etag=etag)
+    assert response.status_int != 304
+    assert not response.etag
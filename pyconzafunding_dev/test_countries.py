@@ -0,0 +1,33 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import Country, FundingRequest, ConditionCompiler, african_countries, other_countries
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_countries_are_added_with_their_tables(funding_fixture):
+    assert Session.query(Country).count() == len(african_countries)+len(other_countries)
+    assert Country.add_missing(Session.connection()) == 0
+
+
+@with_fixtures(FundingFixture)
+def test_countries_as_typed_are_respelt_and_linked(funding_fixture):
+    spellings = [' mzansi ', 'Ivory Coast', "Côte d'Ivoire", 'the united kingdom', 'Atlantis']
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('country%s@example.org' % number),
+                                                            resident_country=spelling, origin_country='RSA')
+                        for number, spelling in enumerate(spellings)]
+
+    FundingRequest.link_countries_in_bulk()
+    Session.expire_all()
+
+    assert [funding_request.resident_country for funding_request in funding_requests] == \
+        ['South Africa', 'Cote d’Ivoire', 'Cote d’Ivoire', 'United Kingdom', 'Atlantis']
+    assert {funding_request.origin_country for funding_request in funding_requests} == {'South Africa'}
+    assert funding_requests[-1].resident_country_id is None
+    in_africa = ConditionCompiler('resident_country in AFRICA')
+    selected = Session.query(FundingRequest.id).filter(FundingRequest.id.in_([funding_request.id for funding_request in funding_requests]),
+                                                       in_africa.sql_expression)
+    assert {funding_request_id for (funding_request_id,) in selected} == {funding_request.id for funding_request in funding_requests[:3]}
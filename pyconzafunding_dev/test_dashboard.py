@@ -0,0 +1,52 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import collections
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest, FundingSummary, ScoringRuleSet
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_the_summary_adds_up_what_is_stored(funding_fixture):
+    for number, (grant_status, resident_country) in enumerate([('Pending', 'Kenya'), ('Approved', 'Kenya'), ('Approved', 'Ghana'),
+                                                               (None, 'Ghana'), ('Declined', None)]):
+        funding_fixture.new_funding_request(funding_fixture.new_account('summary%s@example.org' % number),
+                                            grant_status=grant_status, resident_country=resident_country)
+    FundingRequest.update_totals_in_bulk()
+    funding_requests = Session.query(FundingRequest).all()
+
+    summary = FundingSummary()
+
+    assert tuple(summary.total[1:]) == (len(funding_requests), sum(funding_request.amount_requested for funding_request in funding_requests),
+                                        sum(funding_request.qualify_total for funding_request in funding_requests))
+    applications_by_status = collections.Counter(funding_request.grant_status or '(none)' for funding_request in funding_requests)
+    assert dict((row.label, row.applications) for row in summary.by_status) == applications_by_status
+    applications_by_country = collections.Counter(funding_request.resident_country or '(none)' for funding_request in funding_requests)
+    assert dict((row.label, row.applications) for row in summary.by_country) == applications_by_country
+    assert [row.applications for row in summary.by_country] == sorted(applications_by_country.values(), reverse=True)
+
+    for rule, budget_line in zip(ScoringRuleSet.current().funding_item_rules, summary.budget_lines):
+        assert budget_line.label == rule.label
+        assert budget_line.requested == sum(getattr(funding_request, rule.budget_column) or 0 for funding_request in funding_requests)
+        assert budget_line.qualifies == sum(item.qualified_amount for funding_request in funding_requests
+                                            for item in funding_request.get_funding_items() if item.label == rule.label)
+
+
+@with_fixtures(FundingFixture)
+def test_the_dashboard_shows_the_summary(funding_fixture):
+    funding_fixture.new_funding_request(funding_fixture.new_account('dashboard@example.org'), grant_status='Shortlisted')
+    browser = funding_fixture.super_user_browser
+    original_summary = FundingSummary.cached
+    FundingSummary.cached = None  # The data of a test is never committed, so its version never changes
+    try:
+        browser.open('/dashboard')
+    finally:
+        FundingSummary.cached = original_summary
+
+    for caption in ['Totals', 'By application status', 'By budget line', 'By country of residence']:
+        assert browser.is_element_present(XPath.caption_with_text(caption))
+    assert browser.is_element_present(XPath.table_cell_with_text('Shortlisted'))
@@ -0,0 +1,63 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import datetime
+import json
+
+from reahl.tofu import expected
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest, FundingRequestChange, EditConflict
+from pyconzafunding_dev.fixtures import FundingFixture, type_in_textarea
+
+
+@with_fixtures(FundingFixture)
+def test_an_update_over_someone_elses_change_is_refused(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('conflict@example.org'))
+    first = funding_fixture.new_browser(email='conflict@example.org')
+    second = funding_fixture.new_browser(email='conflict@example.org')
+    first.open('/myapplication')
+    second.open('/myapplication')
+
+    type_in_textarea(first, 'Motivation', 'The first change')
+    first.click(XPath.button_labelled('Update'))
+    type_in_textarea(second, 'Motivation', 'The second change')
+    second.click(XPath.button_labelled('Update'))
+
+    assert 'Your changes were not saved' in second.raw_html
+    assert '→ The first change' in second.raw_html
+    Session.refresh(funding_request)
+    assert funding_request.motivation == 'The first change'
+
+    # Once opened again, the form is for the current version, not the one refused
+    second.open('/myapplication')
+    type_in_textarea(second, 'Motivation', 'The second change')
+    second.click(XPath.button_labelled('Update'))
+    assert 'Your changes were not saved' not in second.raw_html
+    Session.refresh(funding_request)
+    assert funding_request.motivation == 'The second change'
+
+
+@with_fixtures(FundingFixture)
+def test_a_change_committed_after_the_request_was_read_is_a_conflict(funding_fixture):
+    """Also when the change is committed between reading the FundingRequest and writing it."""
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('race@example.org'))
+    funding_request.seen_version = funding_request.version
+
+    # As if someone else updated it after it was read in this transaction
+    Session.query(FundingRequest).filter_by(id=funding_request.id).\
+        update({'motivation': 'Their change', 'version': FundingRequest.version+1}, synchronize_session=False)
+    Session.add(FundingRequestChange(funding_request_id=funding_request.id, changed_at=datetime.datetime.utcnow(),
+                                     changed_by='them@example.org', event='update', version=funding_request.version+1,
+                                     diff=json.dumps({'motivation': ['', 'Their change']})))
+    Session.flush()
+    funding_request.motivation = 'My change'
+
+    def lists_their_change(conflict):
+        assert [change.changed_by for change in conflict.changes] == ['them@example.org']
+    with expected(EditConflict, test=lists_their_change):
+        funding_request.update()
+
+    Session.refresh(funding_request)
+    assert funding_request.motivation == 'Their change'
@@ -0,0 +1,85 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import time
+import urllib.parse
+
+from reahl.tofu import expected
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+from reahl.component.config import ConfigurationException
+
+from pyconzafunding import ExportMiddleware, ExportSigner
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+class ExportFixture(FundingFixture):
+    def new_config(self):
+        config = self.web_fixture.config.pyconzafunding
+        original_key = config.export_signing_key
+        config.export_signing_key = 'a secret for the tests'
+        yield config
+        config.export_signing_key = original_key
+
+    def new_signer(self):
+        return ExportSigner.for_config(self.config)
+
+    def new_wsgi_app(self):
+        # The connection of the test's transaction, so that the middleware sees the logins and data of the test
+        application = super(ExportFixture, self).new_wsgi_app()
+        yield ExportMiddleware(application, Session.connection(), self.signer, self.web_fixture.config.web)
+        ExportMiddleware.installed = False
+
+    def download(self, browser, url):
+        browser.open(url, follow_redirects=False, status='*')
+        return browser.last_response
+
+
+@with_fixtures(ExportFixture)
+def test_the_super_user_downloads_from_the_links_on_the_page(fixture):
+    funding_request = fixture.new_funding_request(fixture.new_account('export@example.org'), surname='Exported')
+    browser = fixture.new_super_user_browser()
+    browser.open('/requests')
+
+    [link] = browser.xpath(XPath.link_with_text('CSV'))
+    response = fixture.download(browser, link.attrib['href'])
+
+    assert response.status_int == 200
+    assert response.content_type == 'text/csv'
+    header, *rows = response.text.splitlines()
+    assert header.startswith('id,')
+    assert any(row.startswith('%s,' % funding_request.id) and ',Exported,' in row for row in rows)
+
+
+@with_fixtures(ExportFixture)
+def test_a_download_needs_an_unexpired_untampered_url_and_the_super_user(fixture):
+    url = fixture.signer.get_url('all_requests', ['columns'], 'jsonl')
+    path, query = url.split('?')
+    arguments = dict(urllib.parse.parse_qsl(query))
+    browser = fixture.new_super_user_browser()
+    assert fixture.download(browser, url).status_int == 200
+
+    tampered = urllib.parse.urlencode(dict(arguments, parts='columns,amounts'))
+    assert fixture.download(browser, '%s?%s' % (path, tampered)).status_int == 403
+
+    expires = int(time.time())-1
+    expired = urllib.parse.urlencode(dict(arguments, expires=expires,
+                                          signature=fixture.signer.get_signature(path, ['columns'], expires)))
+    assert fixture.download(browser, '%s?%s' % (path, expired)).status_int == 403
+
+    other_key = urllib.parse.urlencode(dict(arguments, signature=ExportSigner(b'another secret').get_signature(path, ['columns'], arguments['expires'])))
+    assert fixture.download(browser, '%s?%s' % (path, other_key)).status_int == 403
+
+    assert fixture.download(fixture.new_browser(), url).status_int == 403
+    assert fixture.download(fixture.new_browser(email='applicant@example.org'), url).status_int == 403
+
+
+@with_fixtures(FundingFixture)
+def test_links_are_only_shown_where_the_middleware_serves_them(fixture):
+    browser = fixture.new_super_user_browser()
+    browser.open('/requests')
+    assert not browser.xpath(XPath.link_with_text('CSV'))
+
+    assert not fixture.web_fixture.config.pyconzafunding.export_signing_key
+    with expected(ConfigurationException):
+        ExportSigner.for_config(fixture.web_fixture.config.pyconzafunding)
@@ -0,0 +1,44 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequestSchema
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_what_each_role_may_read_and_write(funding_fixture):
+    schema = FundingRequestSchema.get()
+
+    assert not schema.writable_by_role['viewer']
+    assert {'name', 'motivation'} <= schema.writable_by_role['editor']
+    assert not {'email_address', 'grant_status', 'number_talks_accepted'} & schema.writable_by_role['editor']
+    assert set(schema.specs) == schema.writable_by_role['super_user'] == schema.readable_by_role['super_user']
+
+    for role in ['viewer', 'editor']:
+        assert 'grant_status' in schema.readable_by_role[role]
+        assert not {'allow_user_changes', 'number_talks_accepted'} & schema.readable_by_role[role]
+
+    assert schema.prototypes['super_user']['email_address'].required
+    assert not schema.prototypes['editor']['email_address'].required
+
+
+@with_fixtures(FundingFixture)
+def test_an_applicant_only_edits_their_own_fields_while_allowed_to(funding_fixture):
+    account = funding_fixture.new_account('fields@example.org')
+    funding_request = funding_fixture.new_funding_request(account, allow_user_changes=True)
+    browser = funding_fixture.new_browser(email='fields@example.org')
+
+    browser.open('/myapplication')
+    assert browser.is_element_enabled(XPath.input_labelled('Name'))
+    assert not browser.is_element_enabled(XPath.input_labelled('Application status'))
+    assert not browser.is_element_present(XPath.input_labelled('Number of talks accepted'))
+    assert not browser.is_element_present(XPath.input_labelled('Allow user changes'))
+
+    funding_request.allow_user_changes = False
+    Session.flush()
+    Session.expunge(funding_request)  # As in a new request: its Fields are bound for the role it was first read in
+    browser.open('/myapplication')
+    assert not browser.is_element_enabled(XPath.input_labelled('Name'))
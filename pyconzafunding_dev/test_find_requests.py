@@ -0,0 +1,35 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+
+from pyconzafunding import FundingRequest
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_requests_are_found_filtered_ordered_and_projected(funding_fixture):
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('find%s@example.org' % number),
+                                                            grant_status=status, surname='Find%s' % number)
+                        for number, status in enumerate(['Pending', 'Approved', 'Pending'])]
+    ids = [funding_request.id for funding_request in funding_requests]
+
+    assert FundingRequest.find_requests(account=funding_requests[1].account) == [funding_requests[1]]
+    assert FundingRequest.find_requests(ids=ids, grant_status='Pending', order_by=['-id']) == \
+        [funding_requests[2], funding_requests[0]]
+    assert FundingRequest.find_requests(ids=ids, order_by=['surname'], limit=2) == funding_requests[:2]
+    assert FundingRequest.find_requests(ids=ids, columns=['surname'], order_by=['id']) == [('Find0',), ('Find1',), ('Find2',)]
+    assert FundingRequest.find_requests(ids=[]) == []
+
+
+@with_fixtures(FundingFixture)
+def test_edit_and_history_views_find_the_request_by_id(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('findview@example.org'), surname='Findview')
+    browser = funding_fixture.super_user_browser
+
+    browser.open('/edit/%s' % funding_request.id)
+    assert browser.get_value(XPath.input_labelled('Surname')) == 'Findview'
+    browser.open('/history/%s' % funding_request.id)
+    assert browser.xpath('//title')[0].text == 'History of the application of %s Findview' % funding_request.name
+
+    browser.open('/edit/%s' % (funding_request.id+1000), status=404)
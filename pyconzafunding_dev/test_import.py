@@ -0,0 +1,56 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.stubble import replaced
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest, FundingRequestImport
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_import_skips_bad_records_and_inserts_the_rest_in_batches(funding_fixture):
+    emails = ['import%s@example.org' % number for number in range(5)]
+    for email in emails:
+        funding_fixture.new_account(email)
+    funding_fixture.new_funding_request(funding_fixture.new_account('taken@example.org'))
+
+    records = [funding_fixture.new_import_record(emails[0]),
+               funding_fixture.new_import_record('nobody@example.org'),
+               funding_fixture.new_import_record(emails[1]),
+               funding_fixture.new_import_record('taken@example.org'),
+               dict(funding_fixture.new_import_record(emails[2]), name=''),
+               funding_fixture.new_import_record(emails[2]),
+               funding_fixture.new_import_record(emails[1]),
+               funding_fixture.new_import_record(emails[3]),
+               dict(funding_fixture.new_import_record(emails[4]), amount_requested='lots')]
+
+    importer = FundingRequestImport(batch_size=2)
+    assert importer.import_records(records) == 4
+
+    errors = dict(importer.errors)
+    assert sorted(errors) == [2, 4, 5, 7, 9]
+    assert errors[2] == 'There is no account for nobody@example.org'
+    assert errors[4] == 'taken@example.org already has a funding request'
+    assert errors[5] == 'Name is required'
+    assert errors[7] == '%s already has a funding request' % emails[1]
+    assert errors[9].startswith('Aid amount requested: ')
+
+    imported = Session.query(FundingRequest.email_address).filter(FundingRequest.email_address.in_(emails))
+    assert sorted(email for (email,) in imported) == emails[:4]
+
+
+@with_fixtures(FundingFixture)
+def test_import_retries_a_refused_batch_one_record_at_a_time(funding_fixture):
+    """A record the database refuses fails on its own, without taking the rest of its batch with it."""
+    funding_fixture.new_account('batchmate@example.org')
+    funding_fixture.new_funding_request(funding_fixture.new_account('raced@example.org'))
+    records = [funding_fixture.new_import_record('batchmate@example.org'), funding_fixture.new_import_record('raced@example.org')]
+
+    importer = FundingRequestImport(batch_size=2)
+    # As if raced@example.org saved a request after the import looked for existing ones
+    with replaced(importer.get_account_ids_with_requests, lambda account_ids: set()):
+        assert importer.import_records(records) == 1
+
+    assert [number for number, message in importer.errors] == [2]
+    assert Session.query(FundingRequest).filter_by(email_address='batchmate@example.org').count() == 1
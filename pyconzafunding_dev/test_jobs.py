@@ -0,0 +1,148 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import datetime
+import io
+import os
+import shutil
+import tempfile
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import ExportJob, FundingExport, FundingRequest, Job, JobKind, job_kinds
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+class FlakyJob(JobKind):
+    """Notes the id of each FundingRequest it processes, but fails on `fail_on` for the first `failures` attempts."""
+    label = 'Flaky'
+    chunk_size = 1
+
+    def get_query(self):
+        return Session.query(FundingRequest).filter(FundingRequest.id.in_(self.arguments['ids']))
+
+    def process(self, ids):
+        if ids[0] == self.arguments['fail_on'] and self.job.attempts < self.arguments['failures']:
+            raise Exception('Temporarily unavailable')
+        state = self.job.get_state()
+        state['processed'] = state.get('processed', [])+ids
+        self.job.set_state(state)
+
+
+class TakenOverJob(FlakyJob):
+    """Is taken over by another worker, as if it was stale, while it processes `fail_on`."""
+    def process(self, ids):
+        super(TakenOverJob, self).process(ids)
+        if ids[0] == self.arguments['fail_on']:
+            Session.query(Job).filter_by(id=self.job.id).\
+                update({Job.heartbeat_at: datetime.datetime.utcnow()-Job.stale_after*2}, synchronize_session=False)
+            assert Job.claim_next('other worker') is self.job
+
+
+class JobFixture(FundingFixture):
+    def new_ids(self):
+        return [self.new_funding_request(self.new_account('job%s@example.org' % number)).id for number in range(3)]
+
+    def queue_flaky_job(self, failures):
+        job_kinds['flaky'] = FlakyJob
+        return Job.queue('flaky', ids=self.ids, fail_on=self.ids[1], failures=failures)
+
+    def run(self, job):
+        """Claims `job` (once it is due) and runs it in the transaction of the test."""
+        assert Job.claim_next('test worker') is job
+        return job.run(Session.flush, Session.expire_all)
+
+    def new_output_directory(self):
+        config = self.web_fixture.config.pyconzafunding
+        original_directory = config.job_output_directory
+        config.job_output_directory = tempfile.mkdtemp()
+        yield config.job_output_directory
+        shutil.rmtree(config.job_output_directory)
+        config.job_output_directory = original_directory
+
+    def make_due(self, job):
+        job.retry_at = datetime.datetime.utcnow()-datetime.timedelta(seconds=1)
+        Session.flush()
+
+
+@with_fixtures(JobFixture)
+def test_a_failed_job_resumes_from_its_last_checkpoint(job_fixture):
+    try:
+        job = job_fixture.queue_flaky_job(failures=1)
+
+        assert not job_fixture.run(job)
+        assert job.status == 'queued'
+        assert job.attempts == 1
+        assert job.cursor == job_fixture.ids[0]
+        assert job.get_state()['processed'] == job_fixture.ids[:1]
+        assert job.error == 'Exception: Temporarily unavailable'
+        assert job.retry_at > datetime.datetime.utcnow()
+        assert Job.claim_next('test worker') is None
+
+        job_fixture.make_due(job)
+        assert job_fixture.run(job)
+        assert job.status == 'done'
+        assert job.error is None
+        assert job.get_state()['processed'] == job_fixture.ids
+        assert job.done == job.total == 3
+    finally:
+        job_kinds.pop('flaky', None)
+
+
+@with_fixtures(JobFixture)
+def test_a_job_that_keeps_failing_gives_up_after_max_attempts(job_fixture):
+    try:
+        job = job_fixture.queue_flaky_job(failures=Job.max_attempts)
+
+        for attempt in range(1, Job.max_attempts):
+            assert not job_fixture.run(job)
+            assert (job.status, job.attempts) == ('queued', attempt)
+            job_fixture.make_due(job)
+
+        assert not job_fixture.run(job)
+        assert job.status == 'failed'
+        assert job.finished_at
+        assert job.cursor == job_fixture.ids[0]
+        assert Job.claim_next('test worker') is None
+    finally:
+        job_kinds.pop('flaky', None)
+
+
+@with_fixtures(JobFixture)
+def test_a_worker_that_lost_its_job_leaves_it_to_the_new_worker(job_fixture):
+    try:
+        job_kinds['taken_over'] = TakenOverJob
+        job = Job.queue('taken_over', ids=job_fixture.ids, fail_on=job_fixture.ids[1], failures=0)
+
+        assert not job_fixture.run(job)
+        assert (job.status, job.worker) == ('running', 'other worker')
+        assert job.attempts == 0
+        assert job.error is None
+    finally:
+        job_kinds.pop('taken_over', None)
+
+
+@with_fixtures(JobFixture)
+def test_a_worker_taking_over_an_export_writes_a_file_of_its_own(job_fixture):
+    ids = job_fixture.ids
+    job_fixture.output_directory
+    job = Job.queue('export', format='csv')
+    job.worker = 'first worker'
+    first = ExportJob(job)
+    first.process(ids[:1])
+    committed_state = job.state
+    first.process(ids[1:2])  # Its worker dies before it commits this chunk
+    job.state = committed_state
+
+    job.worker = 'second worker'
+    second = ExportJob(job)
+    second.process(ids[1:2])
+
+    assert second.filename != first.filename
+    assert os.path.dirname(second.filename) == job_fixture.output_directory
+    export = FundingExport(parts=('columns', 'criteria', 'amounts'))
+    expected_text = ''.join(export.generate('csv', funding_request_ids=ids[:1]))+\
+                    ''.join(export.generate('csv', funding_request_ids=ids[1:2], headers=False))
+    with io.open(second.filename, encoding='utf-8', newline='') as output:
+        assert output.read() == expected_text
+    assert job.get_state() == {'filename': second.filename, 'size': len(expected_text.encode('utf-8'))}
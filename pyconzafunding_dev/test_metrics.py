@@ -0,0 +1,47 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from webob import Request, Response
+
+from pyconzafunding import RequestMetrics, MetricsMiddleware
+
+
+def test_a_request_is_recorded_per_view_once_its_response_is_closed():
+    metrics = RequestMetrics()
+    sent = []
+    def streaming_application(environ, start_response):
+        def generate():
+            for chunk in [b'first', b'second']:
+                sent.append(chunk)
+                yield chunk
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return generate()
+    middleware = MetricsMiddleware(streaming_application, metrics=metrics)
+
+    result = middleware(Request.blank('/edit/12').environ, lambda status, headers: None)
+    assert not metrics.get_records()
+    assert b''.join(result) == b'firstsecond'
+    result.close()
+
+    [record] = metrics.get_records()
+    assert (record.path, record.status) == ('/edit', 200)
+    assert not metrics.current
+
+
+def test_requests_for_unknown_urls_are_recorded_together():
+    metrics = RequestMetrics()
+    middleware = MetricsMiddleware(Response(status=404), metrics=metrics)
+    for path in ['/no-such-thing', '/nor/this']:
+        middleware(Request.blank(path).environ, lambda status, headers: None).close()
+
+    [path_metrics], repeated = metrics.aggregate()
+    assert (path_metrics.path, path_metrics.count) == ('(not found)', 2)
+
+
+def test_label_values_are_escaped_in_prometheus_text():
+    metrics = RequestMetrics()
+    metrics.start('/a"b\\c\nd')
+    metrics.finish(200)
+
+    text = metrics.as_prometheus_text()
+
+    assert 'pyconza_request_seconds_count{view="/a\\"b\\\\c\\nd"} 1\n' in text
@@ -0,0 +1,40 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.stubble import replaced
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_an_account_can_have_only_one_request(funding_fixture):
+    funding_fixture.new_account('twice@example.org')
+    browser = funding_fixture.new_super_user_browser()
+
+    funding_fixture.create_request(browser, 'twice@example.org')
+    assert browser.location_path == '/requests'
+
+    funding_fixture.create_request(browser, 'twice@example.org')
+    assert 'twice@example.org has already applied for financial aid' in browser.raw_html
+
+    funding_fixture.create_request(browser, 'unregistered@example.org')
+    assert 'There is no account for unregistered@example.org' in browser.raw_html
+
+    assert Session.query(FundingRequest).filter_by(email_address='twice@example.org').count() == 1
+    assert Session.query(FundingRequest).filter_by(email_address='unregistered@example.org').count() == 0
+
+
+
+@with_fixtures(FundingFixture)
+def test_a_request_saved_meanwhile_for_the_same_account_is_refused_cleanly(funding_fixture):
+    """The unique account_id is what stops a request saved after the check for an existing one."""
+    funding_fixture.new_funding_request(funding_fixture.new_account('raced@example.org'))
+    browser = funding_fixture.new_super_user_browser()
+
+    with replaced(FundingRequest.for_account, lambda cls, account: None, on=FundingRequest):
+        funding_fixture.create_request(browser, 'raced@example.org')
+
+    assert 'raced@example.org has already applied for financial aid' in browser.raw_html
+    assert Session.query(FundingRequest).filter_by(email_address='raced@example.org').count() == 1
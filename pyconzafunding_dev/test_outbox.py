@@ -0,0 +1,147 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import asyncio
+import concurrent.futures
+import datetime
+import email.message
+import smtplib
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import OutboxMessage, OutboxSender, SendFailure, SmtpConnectionPool
+from pyconzafunding_dev.fixtures import FundingFixture, type_in_textarea
+
+
+class FakeSmtp(object):
+    """An SMTP connection that refuses mail depending on who it is to: unknown@ for good, busy@ for now, and
+    dropped@ by losing the connection."""
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send_message(self, message):
+        to_address = message['To']
+        mailbox = to_address.split('@')[0]
+        if mailbox == 'unknown':
+            raise smtplib.SMTPRecipientsRefused({to_address: (550, b'5.1.1 No such mailbox')})
+        elif mailbox == 'busy':
+            raise smtplib.SMTPRecipientsRefused({to_address: (450, b'4.2.1 Mailbox busy, try again later')})
+        elif mailbox == 'dropped':
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.append(to_address)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSmtpConnectionPool(SmtpConnectionPool):
+    def __init__(self):
+        super(FakeSmtpConnectionPool, self).__init__('localhost', 25, size=2)
+        self.connections = []
+
+    def connect(self):
+        connection = FakeSmtp()
+        self.connections.append(connection)
+        return connection
+
+
+def send_batch(sender, to_addresses):
+    emails = []
+    for number, to_address in enumerate(to_addresses):
+        message = email.message.EmailMessage()
+        message['To'] = to_address
+        message.set_content('Hello')
+        emails.append((number, message))
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=sender.pool.size)
+    try:
+        return loop.run_until_complete(sender.send_batch(loop, executor, emails))
+    finally:
+        executor.shutdown()
+        loop.close()
+
+
+def test_only_5xx_refusals_are_permanent():
+    pool = FakeSmtpConnectionPool()
+    sender = OutboxSender(pool, 'financial-aid@example.org')
+
+    outcomes = send_batch(sender, ['applicant@example.org', 'unknown@example.org', 'busy@example.org', 'dropped@example.org'])
+
+    assert outcomes[0] is None
+    assert outcomes[1].permanent
+    assert '550' in outcomes[1].error
+    assert not outcomes[2].permanent
+    assert not outcomes[3].permanent
+    assert [connection.sent for connection in pool.connections if connection.sent] == [['applicant@example.org']]
+    assert len([connection for connection in pool.connections if connection.closed]) == 1  # Only the dropped one
+
+
+def test_failing_to_connect_is_retried():
+    class UnreachablePool(FakeSmtpConnectionPool):
+        def connect(self):
+            raise ConnectionRefusedError('Connection refused')
+    sender = OutboxSender(UnreachablePool(), 'financial-aid@example.org')
+
+    outcomes = send_batch(sender, ['applicant@example.org'])
+
+    assert outcomes[0] == SendFailure('Could not connect: Connection refused', False)
+
+
+@with_fixtures(FundingFixture)
+def test_permanent_failures_are_not_retried(funding_fixture):
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('outbox%s@example.org' % number))
+                        for number in range(4)]
+    OutboxMessage.queue_for_requests(funding_request.id for funding_request in funding_requests)
+    sent, refused, busy, exhausted = Session.query(OutboxMessage).\
+        filter(OutboxMessage.funding_request_id.in_([funding_request.id for funding_request in funding_requests])).\
+        order_by(OutboxMessage.funding_request_id).all()
+    exhausted.attempts = 2
+
+    failed = OutboxMessage.record_outcomes({sent.id: None,
+                                            refused.id: SendFailure('550 No such mailbox', True),
+                                            busy.id: SendFailure('450 Mailbox busy', False),
+                                            exhausted.id: SendFailure('450 Mailbox busy', False)},
+                                           max_attempts=3, retry_seconds=60)
+
+    assert failed == 2
+    assert (sent.status, refused.status, busy.status, exhausted.status) == ('sent', 'failed', 'pending', 'failed')
+    assert refused.attempts == 1
+    assert refused.last_error == '550 No such mailbox'
+    assert busy.next_attempt_at >= datetime.datetime.utcnow()+datetime.timedelta(seconds=59)
+
+
+@with_fixtures(FundingFixture)
+def test_a_status_change_queues_one_email_in_its_transaction(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('notified@example.org'),
+                                                          grant_status='Pending', feedback_message='')
+    browser = funding_fixture.super_user_browser
+
+    def messages():
+        Session.expire_all()
+        return Session.query(OutboxMessage).filter_by(funding_request_id=funding_request.id).order_by(OutboxMessage.id).all()
+
+    browser.open('/edit/%s' % funding_request.id)
+    browser.type(XPath.input_labelled('Number of talks accepted'), '1')
+    browser.click(XPath.button_labelled('Update'))
+    assert messages() == []
+
+    browser.open('/edit/%s' % funding_request.id)
+    browser.type(XPath.input_labelled('Application status'), 'Shortlisted')
+    browser.click(XPath.button_labelled('Update'))
+    browser.open('/edit/%s' % funding_request.id)
+    browser.type(XPath.input_labelled('Application status'), 'Approved')
+    type_in_textarea(browser, 'Feedback', 'See you there!')
+    browser.click(XPath.button_labelled('Update'))
+
+    superseded, pending = messages()
+    assert (superseded.status, pending.status) == ('superseded', 'pending')
+    assert pending.to_address == 'notified@example.org'
+    assert pending.subject.endswith(': Approved')
+    assert 'See you there!' in pending.body
+    assert OutboxMessage.claim_due(10, 'test sender') == [pending]
+    assert OutboxMessage.claim_due(10, 'other sender') == []
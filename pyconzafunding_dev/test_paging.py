@@ -0,0 +1,34 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest, KeysetPage
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_keyset_pages_visit_every_request_once_in_order(funding_fixture):
+    """Paging on a column with ties and NULLs gives all FundingRequests once, in sort order, both ways round."""
+    surnames = ['Smith', None, 'Adams', 'Smith', None, 'Smith', 'Zulu']
+    amounts = [3000, None, 500, 3000, 0, None, 12000]
+    for number, (surname, amount) in enumerate(zip(surnames, amounts)):
+        account = funding_fixture.new_account('keyset%s@example.org' % number)
+        funding_fixture.new_funding_request(account, surname=surname, amount_requested=amount)
+
+    for column_name, null_value in [('surname', ''), ('amount_requested', 0)]:
+        column = getattr(FundingRequest, column_name)
+        keys = sorted((null_value if value is None else value, funding_request_id)
+                      for value, funding_request_id in Session.query(column, FundingRequest.id))
+        expected = [funding_request_id for value, funding_request_id in keys]
+
+        for descending in [False, True]:
+            seen = []
+            after = None
+            while True:
+                page = KeysetPage(column_name, descending, 2, after)
+                seen.extend(page.ids)
+                if not page.has_next:
+                    break
+                after = page.next_after
+            assert seen == (list(reversed(expected)) if descending else expected), (column_name, descending)
@@ -0,0 +1,66 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu import expected
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest, ConditionCompiler, RuleSyntaxError, ScoringRule, ScoringRuleSet, default_scoring_rules
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_conditions_select_the_same_requests_in_python_and_sql(funding_fixture):
+    """Also where the columns tested are NULL, and under `not`."""
+    column_values = [dict(number_talks_accepted=None, grant_status=None, resident_country=None, willing_to_help=True),
+                     dict(number_talks_accepted=0, grant_status='Pending', resident_country='South Africa', willing_to_help=False),
+                     dict(number_talks_accepted=2, grant_status='Approved', resident_country='Mars', willing_to_help=True)]
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('rules%s@example.org' % number), **values)
+                        for number, values in enumerate(column_values)]
+    ids = [funding_request.id for funding_request in funding_requests]
+
+    conditions = ['number_talks_accepted > 0',
+                  'not (number_talks_accepted > 0)',
+                  'number_talks_accepted != 0',
+                  'not (number_talks_accepted == 0)',
+                  "grant_status in ['Pending']",
+                  "not (grant_status in ['Pending', 'Approved'])",
+                  'resident_country in AFRICA',
+                  'not (resident_country in AFRICA)',
+                  "willing_to_help and not (resident_country == 'Mars')",
+                  "not willing_to_help or not (grant_status != 'Pending')"]
+    for condition in conditions:
+        compiled = ConditionCompiler(condition)
+        in_python = [funding_request.id for funding_request in funding_requests if compiled.applies_to(funding_request)]
+        in_sql = [funding_request_id for (funding_request_id,) in
+                  Session.query(FundingRequest.id).filter(FundingRequest.id.in_(ids), compiled.sql_expression).order_by(FundingRequest.id)]
+        assert in_python == in_sql, condition
+
+
+@with_fixtures(FundingFixture)
+def test_stored_rules_replace_the_defaults_and_rescore(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('stored_rules@example.org'),
+                                                          number_talks_accepted=1, number_keynote_talks=0, willing_to_help=False,
+                                                          resident_country='Mars', budget_ticket=0, budget_travel=3000,
+                                                          budget_accommodation=0, budget_food=0, budget_transport=0)
+    rules_text = default_scoring_rules.replace('criterion 35 "Accepted speaker?"', 'criterion 50 "Accepted speaker?"').\
+        replace('funding 60 "Travel"', 'funding 40 "Travel"')
+
+    ScoringRule.replace_all('# Next year\n\n'+rules_text)
+
+    assert ScoringRuleSet.current().as_text() == rules_text
+    assert Session.query(ScoringRule).count() == len(rules_text.splitlines())
+    Session.expire_all()
+    assert (funding_request.score_total, funding_request.qualify_total) == (50, 3000)
+    assert [criterion.score for criterion in funding_request.get_criteria()][0] == 50
+
+
+@with_fixtures(FundingFixture)
+def test_rules_that_do_not_compile_are_not_stored(funding_fixture):
+    bad_rules = ['criterion 35 Accepted speaker: number_talks_accepted > 0',
+                 'criterion 35 "Accepted speaker?": number_talks_accepted >',
+                 'criterion 35 "Accepted speaker?": favourite_colour == \'blue\'',
+                 'funding 60 "Travel": motivation']
+    for bad_rule in bad_rules:
+        with expected(RuleSyntaxError):
+            ScoringRule.replace_all(default_scoring_rules+bad_rule)
+    assert Session.query(ScoringRule).count() == 0
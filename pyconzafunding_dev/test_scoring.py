@@ -0,0 +1,53 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.webdev.tools import XPath
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import FundingRequest
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+scoring_inputs = dict(number_talks_accepted=0, number_keynote_talks=0, resident_country='Mars', willing_to_help=True,
+                      budget_ticket=500, budget_travel=3000, budget_accommodation=2000, budget_food=0, budget_transport=300)
+
+
+@with_fixtures(FundingFixture)
+def test_totals_are_stored_when_scoring_inputs_change(funding_fixture):
+    funding_request = funding_fixture.new_funding_request(funding_fixture.new_account('totals@example.org'), **scoring_inputs)
+
+    FundingRequest.update_totals_in_bulk(Session.query(FundingRequest).filter_by(id=funding_request.id))
+    assert (funding_request.score_total, funding_request.qualify_total) == (10, 500)  # Willing to help; the ticket
+
+    browser = funding_fixture.super_user_browser
+    browser.open('/edit/%s' % funding_request.id)
+    browser.type(XPath.input_labelled('Number of talks accepted'), '2')
+    browser.click(XPath.button_labelled('Update'))
+
+    Session.expire_all()
+    assert (funding_request.score_total, funding_request.qualify_total) == (55, 800)  # And the talks; and local transport
+    assert (funding_request.score_total, funding_request.qualify_total) == \
+        (funding_request.calculate_score_total(), funding_request.calculate_qualify_total())
+    assert FundingRequest.find_requests(id=funding_request.id, qualify_total=800, order_by=['-score_total']) == [funding_request]
+
+
+@with_fixtures(FundingFixture)
+def test_a_score_sheet_scores_many_requests_as_each_scores_itself(funding_fixture):
+    variations = [dict(), dict(number_talks_accepted=2, number_keynote_talks=1), dict(willing_to_help=False, budget_ticket=None),
+                  dict(resident_country='South Africa', number_talks_accepted=1, budget_travel=None)]
+    funding_requests = [funding_fixture.new_funding_request(funding_fixture.new_account('sheet%s@example.org' % number),
+                                                            **dict(scoring_inputs, **variation))
+                        for number, variation in enumerate(variations)]
+
+    score_sheet = FundingRequest.score_requests(funding_requests)
+    scored_requests = dict((scored_request.id, scored_request) for scored_request in score_sheet)
+
+    assert sorted(scored_requests) == sorted(funding_request.id for funding_request in funding_requests)
+    for funding_request in funding_requests:
+        scored_request = scored_requests[funding_request.id]
+        assert scored_request.criteria_apply == [bool(criterion.applies) for criterion in funding_request.get_criteria()]
+        assert scored_request.criterion_scores == [criterion.score for criterion in funding_request.get_criteria()]
+        assert scored_request.qualified_amounts == [item.qualified_amount for item in funding_request.get_funding_items()]
+        assert (scored_request.score_total, scored_request.qualify_total) == \
+            (funding_request.calculate_score_total(), funding_request.calculate_qualify_total())
+    assert [scored_requests[funding_request.id].score_total for funding_request in funding_requests] == [10, 75, 0, 55]
@@ -0,0 +1,28 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu.pytestsupport import with_fixtures
+
+from pyconzafunding import SearchIndex
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+@with_fixtures(FundingFixture)
+def test_search_finds_requests_with_every_word_and_ranks_names_first(funding_fixture):
+    """The index exists once the tables are created; words match as prefixes, in any column."""
+    named = funding_fixture.new_funding_request(funding_fixture.new_account('search1@example.org'),
+                                                name='Thandiwe', surname='Ndlovu', motivation='I maintain a library')
+    motivated = funding_fixture.new_funding_request(funding_fixture.new_account('search2@example.org'),
+                                                    motivation='I want to meet Thandiwe and learn about Django')
+    funding_fixture.new_funding_request(funding_fixture.new_account('search3@example.org'), motivation='Nothing in common')
+    index = SearchIndex.for_current_database()
+    index.index_requests()
+
+    assert index.search('thandi', 10) == [named.id, motivated.id]
+    assert index.search('Thandiwe djan', 10) == [motivated.id]
+    assert index.search('thandiwe', 1, offset=1) == [motivated.id]
+    assert index.search('nobody', 10) == []
+    assert index.search('', 10) == []
+
+    motivated.motivation = 'Changed my mind'
+    index.index_request(motivated)
+    assert index.search('thandiwe', 10) == [named.id]
@@ -0,0 +1,62 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from reahl.tofu import expected
+from reahl.tofu.pytestsupport import with_fixtures
+from reahl.component.exceptions import DomainException
+from reahl.sqlalchemysupport import Session
+
+from pyconzafunding import ApplicantPool, FundingRequest, FundingScenario, Scenario, ScoringRuleSet, expand_scenario_grid
+from pyconzafunding_dev.fixtures import FundingFixture
+
+
+def simulate_one_by_one(scenario, funding_requests):
+    """What ApplicantPool.simulate should work out for `scenario`, by scoring each of `funding_requests` in turn."""
+    rule_set = ScoringRuleSet.current()
+    funded = [0]*len(rule_set.funding_item_rules)
+    payouts = [0]*len(rule_set.funding_item_rules)
+    for funding_request in funding_requests:
+        score = sum(weight for weight, criterion in zip(scenario.weights, funding_request.get_criteria()) if criterion.applies)
+        for index, (threshold, rule) in enumerate(zip(scenario.thresholds, rule_set.funding_item_rules)):
+            amount = getattr(funding_request, rule.budget_column) or 0
+            if score >= threshold and amount > 0:
+                funded[index] += 1
+                payouts[index] += amount
+    return funded, payouts
+
+
+@with_fixtures(FundingFixture)
+def test_scenarios_are_simulated_as_if_each_applicant_was_scored(funding_fixture):
+    for number in range(12):
+        funding_fixture.new_funding_request(funding_fixture.new_account('whatif%s@example.org' % number))
+    rule_set = ScoringRuleSet.current()
+    current = Scenario.from_rule_set(rule_set)
+    weight_choices = [[weight] for weight in current.weights[:-1]]+[[0, 100]]
+    threshold_choices = [[0, threshold] for threshold in current.thresholds[:2]]+[[threshold] for threshold in current.thresholds[2:]]
+    scenarios = [current]+expand_scenario_grid('Grid', weight_choices, threshold_choices)
+    assert len(scenarios) == 1+2*2*2
+
+    outcomes = ApplicantPool(rule_set).simulate(scenarios)
+
+    funding_requests = Session.query(FundingRequest).all()
+    for outcome in outcomes:
+        assert (outcome.funded, outcome.payouts) == simulate_one_by_one(outcome.scenario, funding_requests)
+        assert outcome.total_payout == sum(outcome.payouts)
+    assert outcomes[0].total_payout == sum(funding_request.calculate_qualify_total() for funding_request in funding_requests)
+
+
+@with_fixtures(FundingFixture)
+def test_a_funding_scenario_is_a_grid_of_alternatives(funding_fixture):
+    rule_set = ScoringRuleSet.current()
+    current = Scenario.from_rule_set(rule_set)
+    weights = ', '.join(['35|40']+[str(weight) for weight in current.weights[1:]])
+    thresholds = ', '.join(['10|20|30']+[str(threshold) for threshold in current.thresholds[1:]])
+
+    scenarios = FundingScenario(name='Sweep', weights=weights, thresholds=thresholds).get_scenarios()
+    assert [scenario.name for scenario in scenarios] == ['Sweep #%s' % number for number in range(1, 7)]
+    assert sorted({(scenario.weights[0], scenario.thresholds[0]) for scenario in scenarios}) == \
+        [(35, 10), (35, 20), (35, 30), (40, 10), (40, 20), (40, 30)]
+
+    with expected(DomainException, test=lambda ex: 'Please give %s criterion weights' % len(current.weights) in ex.message):
+        FundingScenario(name='Short', weights='35, 10', thresholds=thresholds).get_scenarios()
+    with expected(DomainException, test=lambda ex: 'whole numbers' in ex.message):
+        FundingScenario(name='Typo', weights=weights.replace('35', 'x'), thresholds=thresholds).get_scenarios()